@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from main import BitboardConnect4, SearchContext, CENTER_ORDER, WIDTH, HEIGHT, SOLVE_EMPTY_CELLS
+from solver import Solver
+from tt import TranspositionTable
+
+# each worker keeps its table and solver for the life of the process
+_table = None
+_solver = None
+
+def read_positions(file, format: str):
+    """Reads positions lazily, one at a time
+
+    Args:
+        file: the file to read from, opened in binary mode
+        format: 'moves' for a line of columns played per position, 'key' for a line
+            with a packed board (see BitboardConnect4.encode) in decimal or 0x hex, or
+            'binary' for packed boards as 8 byte little endian integers
+
+    Yields:
+        Each position as text, or as an integer for binary input
+
+    Raises:
+        ValueError: binary input ends part way through a board"""
+    if format == 'binary':
+        while record := file.read(8):
+            if len(record) < 8: raise ValueError(f'the input ends with {len(record)} bytes of a board')
+            yield int.from_bytes(record, 'little')
+        return
+    for line in file:
+        line = line.strip()
+        if line: yield line.decode()
+
+def parse_position(position: str | int, format: str) -> BitboardConnect4:
+    """Builds the board of a position read by read_positions. Packed boards are
+    checked the same way as the server checks bitboards (see BitboardConnect4.decode)
+
+    Raises:
+        ValueError: the position is not a legal board"""
+    if format == 'moves':
+        board = BitboardConnect4()
+        for move in position:
+            if not move.isdigit() or not board.is_valid_move(int(move)) or board.is_terminal():
+                raise ValueError(f'invalid move {move}')
+            board.make_move(int(move))
+        return board
+    return BitboardConnect4.decode(position if format == 'binary' else int(position, 0))
+
+def analyse_position(position: str | int, format: str, depth: int) -> dict:
+    """Scores every move of one position
+
+    Args:
+        position: the position as read by read_positions
+        format: the format it was read in
+        depth: the depth to search to. Positions with SOLVE_EMPTY_CELLS or fewer
+            empty cells are solved exactly instead
+
+    Returns:
+        The position, the score of each column (None for a full column), the best
+        score, every move with the best score and whether the scores are exact. A
+        finished game gets its result instead, and a bad position an error"""
+    global _table, _solver
+    if _table is None:
+        _table = TranspositionTable(1 << 20)
+        _solver = Solver(1 << 20)
+    result = {'position': position}
+    try:
+        board = parse_position(position, format)
+    except ValueError as error:
+        result['error'] = str(error)
+        return result
+    if board.is_terminal():
+        result['result'] = board.score()
+        return result
+
+    exact = WIDTH * HEIGHT - board.moves <= SOLVE_EMPTY_CELLS
+    if exact:
+        moves = board.valid_moves()
+        # solver scores are for the player to move, search scores are for player 1
+        scores = [score * board.player for score in _solver.score_moves(board, moves)]
+    else:
+        _table.new_search()
+        moves = [move for move in CENTER_ORDER if board.has_space(move)]
+        context = SearchContext(_table, board.player, geometry=board.geometry)
+        # a full window for every move, since score_moves only bounds the moves that
+        # can't beat the best one and each column's score is written out
+        scores = [board.score_move(move, depth, context, float('-inf'), float('inf')) for move in moves]
+    by_column = dict(zip(moves, scores))
+    best = max(score * board.player for score in scores) * board.player
+    result['scores'] = [by_column.get(column) for column in range(WIDTH)]
+    result['score'] = best
+    result['best'] = sorted(move for move in moves if by_column[move] == best)
+    result['exact'] = exact
+    return result
+
+def analyse_chunk(positions: list, format: str, depth: int) -> list[dict]:
+    """Worker task. Analyses a chunk of positions (see analyse_position)"""
+    return [analyse_position(position, format, depth) for position in positions]
+
+def analyse(positions, format: str, depth: int, workers: int | None = None, chunk_size: int = 64):
+    """Analyses positions across a pool of processes, keeping only a few chunks in flight
+
+    Args:
+        positions: the positions, from read_positions. Only read as fast as they are analysed
+        format: the format they were read in
+        depth: the depth to search to
+        workers: the number of processes, or None for one per CPU
+        chunk_size: the number of positions sent to a process at once
+
+    Yields:
+        The analysis of each position (see analyse_position), in input order
+
+    Raises:
+        ValueError: reading the positions failed. Every position read before the
+            failure is analysed first"""
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # enough chunks to keep every worker busy, and no more, so memory stays flat
+        limit = 2 * workers
+        pending = deque()
+        positions = iter(positions)
+        reading, failure = True, None
+        while True:
+            while reading and len(pending) < limit:
+                chunk = []
+                try:
+                    for position in islice(positions, chunk_size): chunk.append(position)
+                except ValueError as error:
+                    failure = error
+                if len(chunk) < chunk_size: reading = False
+                if chunk: pending.append(executor.submit(analyse_chunk, chunk, format, depth))
+            if not pending:
+                if failure is not None: raise failure
+                return
+            # the oldest chunk first, so results come out in input order
+            yield from pending.popleft().result()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score every move of many positions, writing a line of JSON per position')
+    parser.add_argument('input', nargs='?', default='-', help='the file of positions, or - for stdin')
+    parser.add_argument('--format', choices=['moves', 'key', 'binary'], default='moves',
+                        help='moves: columns played per line, key: a packed board per line, binary: 8 byte packed boards')
+    parser.add_argument('--depth', type=int, default=6, help='the depth to search to')
+    parser.add_argument('--workers', type=int, default=None, help='the number of processes to analyse with')
+    parser.add_argument('--chunk-size', type=int, default=64, help='the number of positions sent to a process at once')
+    parser.add_argument('--output', help='where to write the results, stdout if not given')
+    args = parser.parse_args()
+
+    source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    output = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        for result in analyse(read_positions(source, args.format), args.format, args.depth, args.workers, args.chunk_size):
+            output.write(json.dumps(result) + '\n')
+    except ValueError as error:
+        parser.error(str(error))
+    finally:
+        if source is not sys.stdin.buffer: source.close()
+        if output is not sys.stdout: output.close()
@@ -0,0 +1,315 @@
+import argparse
+import json
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import combinations
+from time import perf_counter
+from evaluation import NTupleEvaluation, WEIGHTS_PATH
+from main import Connect4, BitboardConnect4
+from mcts import MonteCarloTree
+from tt import TranspositionTable
+
+# the board classes an engine can search with, by name
+BOARDS = {
+    'list': Connect4,
+    'bitboard': BitboardConnect4,
+}
+
+def threes(board: Connect4, start_player: int) -> int:
+    """The default heuristic (see Connect4.temp_score): the root player's lines with at least 3 pieces"""
+    return board.count_groups(start_player, 3) * start_player
+
+def balance(board: Connect4, start_player: int) -> int:
+    """The root player's lines with at least 3 pieces, less the opponent's"""
+    return (board.count_groups(start_player, 3) - board.count_groups(-start_player, 3)) * start_player
+
+def nothing(board: Connect4, start_player: int) -> int:
+    """No heuristic at all, so only wins and losses found by the search count"""
+    return 0
+
+# the evaluation functions an engine can score leaves with, by name
+EVALUATIONS = {
+    'threes': threes,
+    'balance': balance,
+    'none': nothing,
+}
+# learned evaluations, which keep their own state on the board (see evaluation.py)
+LEARNED = {'ntuple'}
+
+# the searches an engine can pick its moves with (see Connect4.best_move). mcts
+# ignores the depth, running mcts.PLAYOUTS playouts when there is no time limit,
+# and keeps its tree for the whole game
+ENGINES = {'minimax', 'mcts'}
+
+# the weights each worker has loaded, by path
+_weights: dict[str, NTupleEvaluation] = {}
+
+# board classes with their temp_score swapped for another evaluation, made as needed
+_classes: dict[tuple[str, str], type] = {}
+
+def engine_class(board: str, evaluation: str) -> type:
+    """Gets a board class that scores leaves with the given evaluation
+
+    Args:
+        board: the name of the board class (see BOARDS)
+        evaluation: the name of the evaluation function (see EVALUATIONS). Learned
+            evaluations are set on the board instead (see make_board)
+
+    Returns:
+        The class"""
+    if evaluation == 'threes' or evaluation in LEARNED: return BOARDS[board]
+    if (board, evaluation) not in _classes:
+        function = EVALUATIONS[evaluation]
+        _classes[board, evaluation] = type(f'{BOARDS[board].__name__}_{evaluation}', (BOARDS[board],),
+                                           {'temp_score': lambda self, start_player: function(self, start_player)})
+    return _classes[board, evaluation]
+
+def parse_engine(spec: str) -> dict:
+    """Parses an engine from the command line, written as comma separated settings,
+    eg 'name=deep,depth=8', 'time=0.05,eval=balance', 'time=0.05,engine=mcts' or
+    'solve=20' to solve endgames with 20 or fewer empty cells exactly
+
+    Args:
+        spec: the settings. name is made from the others if it isn't given
+
+    Returns:
+        The engine settings: name, depth, time, eval, board, weights, engine and solve.
+        solve is 0 unless given, so the solver doesn't play the endgame for both engines"""
+    engine = {'depth': 6, 'time': None, 'eval': 'threes', 'board': 'bitboard', 'weights': WEIGHTS_PATH, 'engine': 'minimax',
+              'solve': 0}
+    name = None
+    for setting in spec.split(','):
+        key, _, value = setting.partition('=')
+        if key == 'name': name = value
+        elif key == 'depth': engine['depth'] = int(value)
+        elif key == 'time': engine['time'] = float(value)
+        elif key == 'eval' and (value in EVALUATIONS or value in LEARNED): engine['eval'] = value
+        elif key == 'weights': engine['weights'] = value
+        elif key == 'board' and value in BOARDS: engine['board'] = value
+        elif key == 'engine' and value in ENGINES: engine['engine'] = value
+        elif key == 'solve': engine['solve'] = int(value)
+        else: raise argparse.ArgumentTypeError(f'Unknown engine setting {setting!r}')
+    engine['name'] = name or spec
+    return engine
+
+def make_board(engine: dict, opening: str) -> Connect4:
+    """Sets up the board an engine searches, with its evaluation
+
+    Args:
+        engine: the engine settings (see parse_engine)
+        opening: the moves played so far
+
+    Returns:
+        The board"""
+    board = engine_class(engine['board'], engine['eval']).from_moves(opening)
+    if engine['eval'] in LEARNED:
+        if engine['weights'] not in _weights: _weights[engine['weights']] = NTupleEvaluation.load(engine['weights'])
+        board.set_evaluation(_weights[engine['weights']].copy())
+    return board
+
+def random_opening(plies: int, rng: random.Random) -> str:
+    """Plays random moves from the start of a game, never ending the game
+
+    Args:
+        plies: the number of moves to play
+        rng: the random number generator to pick moves with
+
+    Returns:
+        The moves played, one digit per column"""
+    board = BitboardConnect4()
+    moves = ''
+    while len(moves) < plies:
+        # don't hand either side a game that is already decided
+        safe = []
+        for move in board.valid_moves():
+            board.drop(move)
+            if not board.last_move_won(move) and not board.is_full(): safe.append(move)
+            board.undo(move)
+        if not safe: break
+        move = rng.choice(safe)
+        board.make_move(move)
+        moves += str(move)
+    return moves
+
+def play_game(first: dict, second: dict, opening: str, seed: int) -> dict:
+    """Worker task. Plays one game between two engines
+
+    Args:
+        first: the settings of the engine playing X (player 1)
+        second: the settings of the engine playing O (player -1)
+        opening: the moves to play before the engines take over
+        seed: seeds the random tie breaks so a game can be replayed
+
+    Returns:
+        The record of the game: the engines, the opening, every move, the result from
+        player 1's side (1, 0 or -1) and the seconds each engine spent thinking"""
+    random.seed(seed)
+    engines = {1: first, -1: second}
+    # each engine searches its own copy of the board, so each can use its own class
+    boards = {player: make_board(engine, opening) for player, engine in engines.items()}
+    tables = {player: TranspositionTable() for player in engines}
+    trees = {player: MonteCarloTree() if engine['engine'] == 'mcts' else None for player, engine in engines.items()}
+    thinking = {1: 0.0, -1: 0.0}
+    board = boards[1]
+    moves = opening
+    while not board.is_terminal():
+        player = board.player
+        engine = engines[player]
+        start = perf_counter()
+        move = boards[player].best_move(engine['depth'], tables[player], engine['time'], engine=engine['engine'],
+                                        solve_empty=engine['solve'], tree=trees[player])
+        thinking[player] += perf_counter() - start
+        for copy in boards.values(): copy.make_move(move)
+        moves += str(move)
+    return {
+        'first': first['name'],
+        'second': second['name'],
+        'opening': opening,
+        'moves': moves,
+        'result': board.score(),
+        'seconds': {first['name']: thinking[1], second['name']: thinking[-1]},
+        'seed': seed,
+    }
+
+def schedule(engines: list[dict], openings: int, plies: int, seed: int) -> list[tuple]:
+    """Lists every game of a round robin. Each pair of engines plays every opening
+    twice, once from each side, so neither gets an easier set of positions
+
+    Args:
+        engines: the settings of every engine in the tournament
+        openings: the number of random openings each pair plays
+        plies: the number of random moves in each opening
+        seed: seeds the openings and the games
+
+    Returns:
+        The arguments of play_game for each game"""
+    rng = random.Random(seed)
+    games = []
+    for a, b in combinations(engines, 2):
+        for _ in range(openings):
+            opening = random_opening(plies, rng)
+            games.append((a, b, opening, rng.getrandbits(32)))
+            games.append((b, a, opening, rng.getrandbits(32)))
+    return games
+
+def tally(records) -> dict:
+    """Counts the wins, draws and losses of each engine against each other engine
+
+    Args:
+        records: the game records (see play_game)
+
+    Returns:
+        A dictionary of [wins, draws, losses] for each engine and opponent"""
+    table = {}
+    for record in records:
+        for name, opponent, result in ((record['first'], record['second'], record['result']),
+                                       (record['second'], record['first'], -record['result'])):
+            counts = table.setdefault(name, {}).setdefault(opponent, [0, 0, 0])
+            counts[1 - result] += 1
+    return table
+
+def elo(wins: int, draws: int, losses: int, z: float = 1.96) -> tuple[float, float, float]:
+    """Estimates the Elo difference implied by a match score
+
+    Args:
+        wins, draws, losses: the results of the games
+        z: the number of standard errors the interval spans. 1.96 gives 95% confidence
+
+    Returns:
+        A tuple of (estimate, low, high). Infinite when every game went one way"""
+    games = wins + draws + losses
+    if games == 0: return 0.0, -math.inf, math.inf
+    score = (wins + draws / 2) / games
+    # the standard error of the mean score of a game, from the spread of the results
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    error = math.sqrt(variance / games)
+    return to_elo(score), to_elo(score - z * error), to_elo(score + z * error)
+
+def to_elo(score: float) -> float:
+    """Converts an expected score between 0 and 1 into an Elo difference"""
+    if score <= 0: return -math.inf
+    if score >= 1: return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+def report(records) -> str:
+    """Formats the win/draw/loss table of a tournament with Elo estimates
+
+    Args:
+        records: the game records (see play_game)
+
+    Returns:
+        The table, one line per engine and opponent, then one per engine against the field"""
+    table = tally(records)
+    lines = [f"{'engine':>16} {'opponent':>16} {'wins':>6} {'draws':>6} {'losses':>6} {'elo':>8}  95% interval"]
+    for name in sorted(table):
+        total = [0, 0, 0]
+        for opponent in sorted(table[name]):
+            counts = table[name][opponent]
+            total = [a + b for a, b in zip(total, counts)]
+            lines.append(format_line(name, opponent, counts))
+        lines.append(format_line(name, 'all', total))
+    return '\n'.join(lines)
+
+def format_line(name: str, opponent: str, counts: list[int]) -> str:
+    """Formats one row of report"""
+    estimate, low, high = elo(*counts)
+    return f'{name:>16} {opponent:>16} {counts[0]:6} {counts[1]:6} {counts[2]:6} {estimate:+8.1f}  [{low:+.1f}, {high:+.1f}]'
+
+def run(engines: list[dict], openings: int, plies: int, workers: int, output: str | None = None,
+        seed: int = 0, verbose: bool = False) -> list[dict]:
+    """Plays a round robin tournament across a pool of processes
+
+    Args:
+        engines: the settings of every engine in the tournament (see parse_engine)
+        openings: the number of random openings each pair plays, from both sides
+        plies: the number of random moves in each opening
+        workers: the number of processes to play games on
+        output: a file to append each game record to as a line of JSON, or None
+        seed: seeds the openings and the games, so a tournament can be replayed
+        verbose: print a line per game
+
+    Returns:
+        The record of every game, in the order they finished"""
+    games = schedule(engines, openings, plies, seed)
+    records = []
+    file = open(output, 'a') if output else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(play_game, *game) for game in games]
+            for future in as_completed(futures):
+                record = future.result()
+                records.append(record)
+                if file is not None:
+                    # written as soon as the game ends so a long run can be watched or cut short
+                    file.write(json.dumps(record) + '\n')
+                    file.flush()
+                if verbose:
+                    print(f"{len(records)}/{len(games)} {record['first']} vs {record['second']}: "
+                          f"{('X wins', 'draw', 'O wins')[1 - record['result']]} ({record['moves']})")
+    finally:
+        if file is not None: file.close()
+    return records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play engines against each other and estimate their strength')
+    parser.add_argument('--engine', type=parse_engine, action='append', dest='engines', default=[],
+                        help="an engine to play, as settings like 'name=deep,depth=8,time=0.1,eval=balance,board=list,engine=minimax,solve=0'")
+    parser.add_argument('--openings', type=int, default=50, help='the number of random openings each pair plays from both sides')
+    parser.add_argument('--plies', type=int, default=4, help='the number of random moves in each opening')
+    parser.add_argument('--workers', type=int, default=None, help='the number of processes to play on')
+    parser.add_argument('--output', help='a JSONL file to append each game to')
+    parser.add_argument('--seed', type=int, default=0, help='seeds the openings and the games')
+    parser.add_argument('--results', nargs='+', help='report on games already written to these JSONL files instead of playing')
+    args = parser.parse_args()
+
+    if args.results:
+        records = []
+        for path in args.results:
+            with open(path) as file:
+                records.extend(json.loads(line) for line in file if line.strip())
+    else:
+        if len(args.engines) < 2: parser.error('at least two engines are needed')
+        if len({engine['name'] for engine in args.engines}) < len(args.engines): parser.error('engine names must be unique')
+        records = run(args.engines, args.openings, args.plies, args.workers, args.output, args.seed, verbose=True)
+    print(report(records))
@@ -0,0 +1,131 @@
+import numpy as np
+from main import Connect4, BitboardConnect4, WIDTH, BOARD_MASK, WINDOW_STARTS, bottom_mask, top_mask
+
+# the number of set bits in every byte, used to count the bits of a whole array at once
+BYTE_COUNTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+TOPS = np.array([top_mask(column) for column in range(WIDTH)], dtype=np.uint64)
+BOTTOMS = np.array([bottom_mask(column) for column in range(WIDTH)], dtype=np.uint64)
+
+def popcount(bits: np.ndarray) -> np.ndarray:
+    """Counts the set bits of every bitboard in an array
+
+    Args:
+        bits: an array of uint64 bitboards
+
+    Returns:
+        An array of the number of bits set in each bitboard"""
+    return BYTE_COUNTS[bits.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int64)
+
+def aligned(bits: np.ndarray) -> np.ndarray:
+    """Vectorized is_aligned. Checks every bitboard in an array for 4 in a row
+
+    Args:
+        bits: an array of uint64 bitboards, each the pieces of a single player
+
+    Returns:
+        A bool array, True where a bitboard has 4 pieces in a line"""
+    won = np.zeros(bits.shape, dtype=bool)
+    for shift in WINDOW_STARTS:
+        shift = np.uint64(shift)
+        pairs = bits & (bits >> shift)
+        won |= (pairs & (pairs >> (shift + shift))) != 0
+    return won
+
+def count_threats(bits: np.ndarray) -> np.ndarray:
+    """Vectorized BitboardConnect4.count_groups(player, 3). Counts the lines with
+    at least 3 pieces in every bitboard of an array
+
+    Args:
+        bits: an array of uint64 bitboards, each the pieces of a single player
+
+    Returns:
+        An array of the number of lines with 3 or more pieces in each bitboard"""
+    count = np.zeros(bits.shape, dtype=np.int64)
+    for shift, starts in WINDOW_STARTS.items():
+        shift = np.uint64(shift)
+        b1 = bits >> shift
+        b2 = b1 >> shift
+        b3 = b2 >> shift
+        windows = (bits & b1 & (b2 | b3)) | (b2 & b3 & (bits | b1))
+        count += popcount(windows & np.uint64(starts))
+    return count
+
+def evaluate_batch(ones: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Scores many boards in one call
+
+    Args:
+        ones: an array of uint64 bitboards of player 1's pieces (see BitboardConnect4.ones)
+        mask: an array of uint64 bitboards of the occupied cells (see BitboardConnect4.mask)
+
+    Returns:
+        The winner of each board (1, -1, or 0 if there isn't one) and an array with a row
+        for each board holding the number of lines with 3 or more pieces for player 1 and player -1"""
+    ones = np.asarray(ones, dtype=np.uint64)
+    others = np.asarray(mask, dtype=np.uint64) ^ ones
+    winners = aligned(ones).astype(np.int8) - aligned(others).astype(np.int8)
+    threats = np.stack([count_threats(ones), count_threats(others)], axis=1)
+    return winners, threats
+
+def frontier_scores(board: Connect4, depth: int) -> list[int]:
+    """Scores every valid move like Connect4.score_move, but without alpha beta pruning
+    or the tactical pruning of Connect4.tactics, so near the leaves it can miss a
+    forced block or a double threat the minimax search would see. The tree is expanded
+    one ply at a time for every node at once, the whole leaf frontier is scored with
+    a single evaluate_batch style call, and the scores are backed up with minimax.
+    The tree grows by up to 7 times per ply, so this is only practical for shallow depths
+
+    Args:
+        board: the board to score the moves of. It must not be terminal
+        depth: the max recursion depth below each move
+
+    Returns:
+        The score of each move in board.valid_moves()"""
+    if not isinstance(board, BitboardConnect4):
+        board = BitboardConnect4.from_board(board)
+    start_player = board.player
+
+    # expand every live node of a level into its 7 children, until the leaves
+    ones = np.array([board.ones], dtype=np.uint64)
+    mask = np.array([board.mask], dtype=np.uint64)
+    player = board.player
+    levels = []
+    for level in range(depth + 1):
+        child_ones = np.repeat(ones, WIDTH)
+        child_mask = np.repeat(mask, WIDTH)
+        valid = (child_mask & np.tile(TOPS, len(mask))) == 0
+
+        # drop a piece in every column of every node at once
+        new_mask = child_mask | (child_mask + np.tile(BOTTOMS, len(mask)))
+        if player == 1: child_ones = child_ones | (new_mask ^ child_mask)
+        child_mask = new_mask
+        mover = child_ones if player == 1 else child_ones ^ child_mask
+
+        # score the children that end the game. the remaining depth below a child
+        # on this level is the same as in score_move
+        remaining = depth - level
+        values = np.where(player == 1, -np.inf, np.inf) * np.ones(len(child_mask))
+        won = valid & aligned(mover)
+        full = valid & ~won & (child_mask == np.uint64(BOARD_MASK))
+        values[won] = player * (100 + remaining)
+        values[full] = -start_player * remaining
+        live = valid & ~won & ~full
+        if remaining == 0:
+            # the leaf frontier, scored all at once
+            threats = count_threats(child_ones if start_player == 1 else child_ones ^ child_mask)
+            values[live] = (threats * start_player)[live]
+            live[:] = False
+        levels.append((values, live, valid))
+        if not live.any(): break
+        ones, mask = child_ones[live], child_mask[live]
+        player *= -1
+
+    # back the scores up the tree with minimax
+    for level in range(len(levels) - 1, 0, -1):
+        values, live, valid = levels[level]
+        parent_values, parent_live, _ = levels[level - 1]
+        child_values = values.reshape(-1, WIDTH)
+        maximizing = (board.player if level % 2 == 0 else -board.player) == 1
+        parent_values[parent_live] = child_values.max(axis=1) if maximizing else child_values.min(axis=1)
+
+    values, _, valid = levels[0]
+    return [int(value) for value in values[valid]]
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import platform
+import sys
+from time import perf_counter
+from main import Connect4, BitboardConnect4, SearchContext, CENTER_ORDER
+from tt import TranspositionTable
+
+# the engines that can be benchmarked, by name
+ENGINES = {
+    'list': Connect4,
+    'bitboard': BitboardConnect4,
+}
+
+# fixed positions to benchmark on. moves are the columns played from the start of
+# the game, best is every move that keeps the best result for the player to move
+# (None if the position is only there to measure speed) and outcome is that result.
+# the midgame and endgame answers were found by searching every line to the end
+POSITIONS = {
+    'opening': [
+        {'moves': '', 'best': [3], 'outcome': 'win'}, # only the center wins
+        {'moves': '3', 'best': None, 'outcome': None},
+        {'moves': '33', 'best': None, 'outcome': None},
+        {'moves': '332', 'best': None, 'outcome': None},
+        {'moves': '3324', 'best': None, 'outcome': None},
+        {'moves': '33224', 'best': None, 'outcome': None},
+    ],
+    'midgame': [ # each has a forced win within 7 moves, but no immediate win
+        {'moves': '52116256264403355032', 'best': [6], 'outcome': 'win'},
+        {'moves': '63033333211105505', 'best': [0], 'outcome': 'win'},
+        {'moves': '562241231011156142063', 'best': [3, 4], 'outcome': 'win'},
+        {'moves': '6405251164034034', 'best': [5, 6], 'outcome': 'win'},
+        {'moves': '0560001206346111601', 'best': [3], 'outcome': 'win'},
+        {'moves': '24445104114252066164', 'best': [5, 6], 'outcome': 'win'},
+        {'moves': '65304432534016410', 'best': [3], 'outcome': 'win'},
+        {'moves': '43443205103401443363', 'best': [2, 5], 'outcome': 'win'},
+    ],
+    'endgame': [ # solved to the end of the game
+        {'moves': '4053160266006053652426015552', 'best': [3], 'outcome': 'win'},
+        {'moves': '6461314006604060120144265143', 'best': [2], 'outcome': 'win'},
+        {'moves': '5632522411250151321154564264', 'best': [0, 4], 'outcome': 'win'},
+        {'moves': '4404051443635422166530633113', 'best': [0], 'outcome': 'win'},
+        {'moves': '6155342264066112445610355640', 'best': [3], 'outcome': 'draw'},
+        {'moves': '6305511623056125155430434231', 'best': [2, 4, 6], 'outcome': 'draw'},
+        {'moves': '0515050455400452422022446131', 'best': [1, 3], 'outcome': 'win'},
+        {'moves': '0236000254606425152042351654', 'best': [1], 'outcome': 'win'},
+    ],
+}
+
+def best_moves(board: Connect4, moves: list[int], scores: list[int]) -> list[int]:
+    """Gets every move tied for the best score, which best_move picks from at random"""
+    best = max(score * board.player for score in scores) * board.player
+    return sorted(move for move, score in zip(moves, scores) if score == best)
+
+def bench_position(engine: type, position: dict, depth: int, max_depth: int, workers: int = 1) -> dict:
+    """Benchmarks an engine on a single position
+
+    Args:
+        engine: the Connect4 class to benchmark
+        position: the position to benchmark on (see POSITIONS)
+        depth: the depth to run score_state and best_move to
+        max_depth: the deepest iteration to time for time-to-depth
+        workers: the number of processes best_move searches with (see parallel.parallel_scores)
+
+    Returns:
+        The results for the position"""
+    board = engine.from_moves(position['moves'])
+    result = {'moves': position['moves']}
+
+    # the search behind score_state, counting nodes
+    context = SearchContext(TranspositionTable(), board.player)
+    start = perf_counter()
+    result['score'] = board.search(depth, context, float('-inf'), float('inf'))
+    result['search_seconds'] = perf_counter() - start
+    result['nodes'] = context.nodes
+    result['nodes_per_second'] = context.nodes / max(result['search_seconds'], 1e-9)
+
+    # the endgame set is inside the solver's range, which would be timed instead of
+    # the engine, so it is turned off. there is no book unless one is given
+    start = perf_counter()
+    board.best_move(depth, workers=workers, solve_empty=0)
+    result['best_move_seconds'] = perf_counter() - start
+
+    # iterative deepening, timing how long it takes to finish each depth and
+    # noting which moves it would pick at each one
+    context = SearchContext(TranspositionTable(), board.player)
+    moves = [move for move in CENTER_ORDER if board.has_space(move)]
+    start = perf_counter()
+    result['time_to_depth'] = []
+    picks = []
+    for iteration in range(max_depth + 1):
+        scores = board.score_moves(moves, iteration, context)
+        result['time_to_depth'].append(perf_counter() - start)
+        picks.append(best_moves(board, moves, scores))
+
+    # a position is solved once every move the engine could pick is a best move,
+    # and stays that way at every deeper iteration
+    if position['best'] is not None:
+        correct = [set(pick) <= set(position['best']) for pick in picks]
+        result['correct'] = correct[-1]
+        solved = None
+        for iteration in range(max_depth, -1, -1):
+            if not correct[iteration]: break
+            solved = iteration
+        result['time_to_solve'] = None if solved is None else result['time_to_depth'][solved]
+    return result
+
+def summarize(results: list[dict]) -> dict:
+    """Totals the results of a set of positions"""
+    known = [result for result in results if 'correct' in result]
+    solved = [result['time_to_solve'] for result in known if result['time_to_solve'] is not None]
+    nodes = sum(result['nodes'] for result in results)
+    seconds = sum(result['search_seconds'] for result in results)
+    return {
+        'nodes': nodes,
+        'nodes_per_second': nodes / max(seconds, 1e-9),
+        'best_move_seconds': sum(result['best_move_seconds'] for result in results),
+        'time_to_depth': [sum(times) for times in zip(*(result['time_to_depth'] for result in results))],
+        'accuracy': sum(result['correct'] for result in known) / len(known) if known else None,
+        'solved': len(solved),
+        'time_to_solve': sum(solved) / len(solved) if solved else None,
+    }
+
+def run(engines: list[str], sets: list[str], depth: int, max_depth: int, verbose: bool = False, workers: int = 1) -> dict:
+    """Runs the benchmark
+
+    Args:
+        engines: the names of the engines to benchmark (see ENGINES)
+        sets: the names of the position sets to run (see POSITIONS)
+        depth: the depth to run score_state and best_move to
+        max_depth: the deepest iteration to time for time-to-depth
+        verbose: print a line per position
+        workers: the number of processes best_move searches with. best_move is timed
+            without the solver, so comparing the best_move times of runs with different
+            numbers shows how the parallel search scales, on every set
+
+    Returns:
+        The results, ready to be written as JSON"""
+    report = {
+        'config': {'depth': depth, 'max_depth': max_depth, 'workers': workers, 'cpus': os.cpu_count(),
+                   'python': platform.python_version()},
+        'results': {},
+    }
+    # an untimed search starts the worker processes, so starting them isn't counted
+    if workers > 1: BitboardConnect4().best_move(1, workers=workers)
+    for name in engines:
+        report['results'][name] = {}
+        for set_name in sets:
+            results = []
+            for position in POSITIONS[set_name]:
+                results.append(bench_position(ENGINES[name], position, depth, max_depth, workers))
+                if verbose:
+                    print(f"{name} {set_name} {position['moves'] or '(empty)'}: "
+                          f"{results[-1]['nodes_per_second']:.0f} nodes/s, {results[-1]['time_to_depth'][-1]:.3f}s to depth {max_depth}")
+            report['results'][name][set_name] = {'summary': summarize(results), 'positions': results}
+    return report
+
+def regressions(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """Compares a run against an earlier one
+
+    Args:
+        report: the results of this run
+        baseline: the results of the run to compare against
+        threshold: the fraction speed can drop by before it counts as a regression
+
+    Returns:
+        A description of each regression found"""
+    found = []
+    for name, sets in report['results'].items():
+        for set_name, results in sets.items():
+            old = baseline['results'].get(name, {}).get(set_name)
+            if old is None: continue
+            new, old = results['summary'], old['summary']
+            label = f'{name}/{set_name}'
+            if new['nodes_per_second'] < old['nodes_per_second'] * (1 - threshold):
+                found.append(f"{label}: {new['nodes_per_second']:.0f} nodes/s, was {old['nodes_per_second']:.0f}")
+            if len(new['time_to_depth']) == len(old['time_to_depth']) and new['time_to_depth'][-1] > old['time_to_depth'][-1] * (1 + threshold):
+                found.append(f"{label}: {new['time_to_depth'][-1]:.3f}s to depth, was {old['time_to_depth'][-1]:.3f}s")
+            if old['accuracy'] is not None and new['accuracy'] < old['accuracy']:
+                found.append(f"{label}: accuracy {new['accuracy']:.2f}, was {old['accuracy']:.2f}")
+    return found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Connect4 engines on fixed positions')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES), help='the engines to benchmark')
+    parser.add_argument('--sets', nargs='+', choices=POSITIONS, default=list(POSITIONS), help='the position sets to run')
+    parser.add_argument('--depth', type=int, default=6, help='the depth to run score_state and best_move to')
+    parser.add_argument('--max-depth', type=int, default=8, help='the deepest iteration to time')
+    parser.add_argument('--workers', type=int, default=1, help='the number of processes best_move searches with')
+    parser.add_argument('--output', help='where to write the results as JSON')
+    parser.add_argument('--baseline', help='the results of an earlier run to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='the fraction speed can drop by before failing')
+    args = parser.parse_args()
+
+    report = run(args.engines, args.sets, args.depth, args.max_depth, verbose=True, workers=args.workers)
+    for name, sets in report['results'].items():
+        for set_name, results in sets.items():
+            summary = results['summary']
+            accuracy = 'n/a' if summary['accuracy'] is None else f"{summary['accuracy']:.0%}"
+            print(f"{name:>8} {set_name:>8}: {summary['nodes_per_second']:8.0f} nodes/s  "
+                  f"{summary['time_to_depth'][-1]:7.3f}s to depth {args.max_depth}  accuracy {accuracy}  "
+                  f"best_move {summary['best_move_seconds']:.3f}s with {args.workers} worker{'s' if args.workers > 1 else ''}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(report, json.load(file), args.threshold)
+        for regression in found:
+            print(f'Regression: {regression}')
+        if found: sys.exit(1)
@@ -0,0 +1,147 @@
+import argparse
+import mmap
+import struct
+from main import Connect4, BitboardConnect4, SearchContext, CENTER_ORDER, WIDTH
+from tt import TranspositionTable
+
+# file layout: a header, then one fixed size record per position sorted by key
+MAGIC = b'C4BK'
+HEADER = struct.Struct('<4sHHQ') # magic, plies, search depth, number of records
+RECORD = struct.Struct('<Qhb')   # position key, score, best move
+
+class OpeningBook:
+    """Best moves for every position of the opening, read from a file made by generate_book
+
+    The file is memory mapped and searched with a binary search, so opening it is
+    instant and only the pages a lookup touches are ever read into memory.
+
+    Attributes:
+        plies: the number of moves into the game the book covers
+        depth: the depth each position was searched to
+        count: the number of positions in the book
+    """
+    def __init__(self, path: str) -> None:
+        """Opens a book
+
+        Args:
+            path: the path of the book file"""
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.plies, self.depth, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC: raise ValueError(f'{path} is not an opening book')
+
+    def close(self) -> None:
+        """Closes the file"""
+        self.map.close()
+
+    def find(self, key: int) -> tuple[int, int] | None:
+        """Binary searches the book for a position
+
+        Args:
+            key: the canonical key of the position (see book_key)
+
+        Returns:
+            The score and best move of the position, or None if it isn't in the book"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_key, score, move = RECORD.unpack_from(self.map, HEADER.size + middle * RECORD.size)
+            if record_key == key: return score, move
+            if record_key < key: low = middle + 1
+            else: high = middle
+        return None
+
+    def lookup(self, board: Connect4) -> tuple[int, int] | None:
+        """Looks up the best move of a board
+
+        Args:
+            board: the board to look up. The player to move must match the number of pieces
+
+        Returns:
+            The score and best move of the board, or None if it isn't in the book"""
+        if not isinstance(board, BitboardConnect4):
+            board = BitboardConnect4.from_board(board)
+        if board.moves > self.plies or board.player != (1 if board.moves % 2 == 0 else -1):
+            return None
+        key, mirrored = book_key(board)
+        entry = self.find(key)
+        if entry is None: return None
+        score, move = entry
+        return score, WIDTH - 1 - move if mirrored else move
+
+def book_key(board: BitboardConnect4) -> tuple[int, bool]:
+    """Gets the key a board is stored under. A board and its mirror image share a key
+
+    Args:
+        board: the board to get the key of
+
+    Returns:
+        The key, and whether the board is mirrored relative to the stored position"""
+    key, mirror_key = board.keys()
+    return min(key, mirror_key), mirror_key < key
+
+def opening_positions(plies: int) -> dict[int, BitboardConnect4]:
+    """Finds every position that can come up in the first few moves of a game,
+    keeping only one of each mirror image pair and skipping finished games
+
+    Args:
+        plies: the number of moves to look ahead
+
+    Returns:
+        A dictionary from each position's key to the position"""
+    positions = {}
+    frontier = {book_key(BitboardConnect4())[0]: BitboardConnect4()}
+    for ply in range(plies + 1):
+        positions.update(frontier)
+        if ply == plies: break
+        next_frontier = {}
+        for board in frontier.values():
+            for move in board.valid_moves():
+                child = board.clone()
+                child.drop(move)
+                if child.last_move_won(move) or child.is_full(): continue
+                next_frontier.setdefault(book_key(child)[0], child)
+        frontier = next_frontier
+    return positions
+
+def generate_book(path: str, plies: int = 6, depth: int = 8, verbose: bool = False) -> int:
+    """Searches every opening position and writes the results to a book file
+
+    Args:
+        path: where to write the book
+        plies: the number of moves into the game to cover
+        depth: the depth to search each position to
+        verbose: print progress while searching
+
+    Returns:
+        The number of positions written"""
+    positions = opening_positions(plies)
+    table = TranspositionTable(1 << 20)
+    records = []
+    for index, (key, board) in enumerate(sorted(positions.items())):
+        # store the moves of the canonical orientation
+        if book_key(board)[1]:
+            board.state = [column for column in reversed(board.state)]
+        context = SearchContext(table, board.player, geometry=board.geometry)
+        moves = [move for move in CENTER_ORDER if board.has_space(move)]
+        scores = board.score_moves(moves, depth, context)
+        # the book is deterministic: ties go to the column closest to the center
+        best = max(range(len(moves)), key=lambda x: scores[x] * board.player)
+        records.append((key, scores[best], moves[best]))
+        if verbose and index % 100 == 0:
+            print(f'{index}/{len(positions)} positions searched')
+
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, plies, depth, len(records)))
+        for record in records:
+            file.write(RECORD.pack(*record))
+    return len(records)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate an opening book')
+    parser.add_argument('path', help='where to write the book')
+    parser.add_argument('--plies', type=int, default=6, help='the number of moves into the game to cover')
+    parser.add_argument('--depth', type=int, default=8, help='the depth to search each position to')
+    args = parser.parse_args()
+    count = generate_book(args.path, args.plies, args.depth, verbose=True)
+    print(f'Wrote {count} positions to {args.path}')
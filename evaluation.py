@@ -0,0 +1,266 @@
+import argparse
+import json
+import struct
+from abc import ABC, abstractmethod
+from array import array
+from main import Connect4, LINES, WIDTH, HEIGHT, STANDARD
+
+# file layout: a header, then one 32 bit float weight per pattern of every line
+MAGIC = b'C4NT'
+HEADER = struct.Struct('<4sHH') # magic, number of lines, patterns per line
+WEIGHTS_PATH = 'ntuple.bin' # made with `python evaluation.py ntuple.bin --games ...`
+
+# every line is 4 cells, each empty (0), player 1 (1) or player -1 (2)
+PATTERNS = 3 ** 4
+# scores are kept well inside the scores of wins and losses (about 100) so the
+# search never mistakes a good position for a won one
+LIMIT = 60
+# the score of a position the weights are sure is a win, set by the trainer
+SCALE = 40
+
+# for each cell, the (line, place value) of every line through it, so a piece
+# dropped in the cell can update the pattern index of each line it is part of
+CELL_TUPLES = [[[(index, 3 ** line.index((col, row))) for index, line in enumerate(LINES) if (col, row) in line]
+                for row in range(HEIGHT)] for col in range(WIDTH)]
+
+class Evaluation(ABC):
+    """Scores the leaves of a search. Each board gets its own instance (see
+    Connect4.set_evaluation), which is told about every piece dropped and taken
+    back, so it can keep its score up to date instead of working it out at every leaf.
+    Subclasses must give score and copy. The updates do nothing unless overridden
+    """
+    def reset(self, board: Connect4) -> None:
+        """Works out everything from scratch for a board
+
+        Args:
+            board: the board this evaluation belongs to"""
+
+    def drop(self, col: int, row: int, player: int) -> None:
+        """Updates the evaluation for a piece dropped into a cell
+
+        Args:
+            col, row: the cell, in the layout of Connect4.state (row 0 is the top)
+            player: the player the piece belongs to"""
+
+    def undo(self, col: int, row: int, player: int) -> None:
+        """Updates the evaluation for a piece taken back out of a cell
+
+        Args:
+            col, row: the cell, in the layout of Connect4.state (row 0 is the top)
+            player: the player the piece belonged to"""
+
+    @abstractmethod
+    def score(self, start_player: int) -> int:
+        """Scores the board, from player 1's side like every score in the search
+
+        Args:
+            start_player: the player making a move on the root board
+
+        Returns:
+            The score"""
+
+    @abstractmethod
+    def copy(self) -> 'Evaluation':
+        """Makes a copy to go with a copy of the board"""
+
+class NTupleEvaluation(Evaluation):
+    """A learned evaluation: a table of weights for every pattern of pieces on every
+    line, summed over the lines of the board
+
+    The pattern index of each line is kept up to date as pieces are dropped and taken
+    back, along with the sum of their weights. A piece only changes the lines through
+    its cell, so each move is a handful of array lookups and the score of a leaf is
+    free, where count_groups has to look at the whole board.
+
+    Attributes:
+        weights: a flat table of weights, PATTERNS for each line in LINES. Shared by copies
+        patterns: the index into weights of the current pattern of each line
+        total: the sum of the weights of the current patterns
+    """
+    def __init__(self, weights: array) -> None:
+        """Initializes the instance
+
+        Args:
+            weights: the weight table (see load)"""
+        if len(weights) != len(LINES) * PATTERNS: raise ValueError('the weights are for a different board')
+        self.weights = weights
+        self.patterns = [index * PATTERNS for index in range(len(LINES))]
+        self.total = sum(weights[pattern] for pattern in self.patterns)
+
+    @classmethod
+    def load(cls, path: str = WEIGHTS_PATH) -> 'NTupleEvaluation':
+        """Reads weights written by save
+
+        Args:
+            path: the weights file
+
+        Returns:
+            An evaluation with the weights, for an empty board"""
+        with open(path, 'rb') as file:
+            magic, lines, patterns = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC: raise ValueError(f'{path} is not a weights file')
+            if (lines, patterns) != (len(LINES), PATTERNS): raise ValueError(f'{path} is for a different board')
+            weights = array('f')
+            weights.frombytes(file.read())
+        return cls(weights)
+
+    def save(self, path: str = WEIGHTS_PATH) -> None:
+        """Writes the weights to a file
+
+        Args:
+            path: where to write the weights"""
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, len(LINES), PATTERNS))
+            self.weights.tofile(file)
+
+    def reset(self, board: Connect4) -> None:
+        """Works out the pattern of every line from scratch"""
+        if board.geometry is not STANDARD: raise ValueError('the weights are for the standard board')
+        state = board.state
+        self.patterns = [index * PATTERNS + pattern_of(state, line) for index, line in enumerate(LINES)]
+        self.total = sum(self.weights[pattern] for pattern in self.patterns)
+
+    def drop(self, col: int, row: int, player: int) -> None:
+        """Moves every line through the cell to its new pattern"""
+        weights, patterns = self.weights, self.patterns
+        digit = 1 if player == 1 else 2
+        total = self.total
+        for index, place in CELL_TUPLES[col][row]:
+            old = patterns[index]
+            new = old + digit * place
+            total += weights[new] - weights[old]
+            patterns[index] = new
+        self.total = total
+
+    def undo(self, col: int, row: int, player: int) -> None:
+        """Moves every line through the cell back to its old pattern"""
+        weights, patterns = self.weights, self.patterns
+        digit = 1 if player == 1 else 2
+        total = self.total
+        for index, place in CELL_TUPLES[col][row]:
+            old = patterns[index]
+            new = old - digit * place
+            total += weights[new] - weights[old]
+            patterns[index] = new
+        self.total = total
+
+    def score(self, start_player: int) -> int:
+        """Rounds the sum of the weights, kept within LIMIT"""
+        return max(-LIMIT, min(LIMIT, round(self.total)))
+
+    def copy(self) -> 'NTupleEvaluation':
+        """Makes a copy sharing the same weights"""
+        copy = NTupleEvaluation.__new__(NTupleEvaluation)
+        copy.weights = self.weights
+        copy.patterns = self.patterns[:]
+        copy.total = self.total
+        return copy
+
+def pattern_of(state: list[list[int]], line: tuple) -> int:
+    """Gets the pattern of the pieces on a line, as a number in base 3 with the first cell lowest"""
+    pattern = 0
+    for place, (col, row) in enumerate(line):
+        player = state[col][row]
+        if player: pattern += 3 ** place * (1 if player == 1 else 2)
+    return pattern
+
+def tied_patterns() -> list[int]:
+    """Ties each line's patterns to the same patterns on its mirror image, since a
+    position is worth the same flipped left to right
+
+    Returns:
+        For each entry of the weight table, the number of the parameter it shares"""
+    index_of = {frozenset(line): index for index, line in enumerate(LINES)}
+    parameters = [-1] * (len(LINES) * PATTERNS)
+    count = 0
+    for index, line in enumerate(LINES):
+        mirror = index_of[frozenset((WIDTH - 1 - col, row) for col, row in line)]
+        # where each cell of the line lands on the mirror line
+        places = [LINES[mirror].index((WIDTH - 1 - col, row)) for col, row in line]
+        for pattern in range(PATTERNS):
+            if parameters[index * PATTERNS + pattern] != -1: continue
+            mirrored = sum((pattern // 3 ** place) % 3 * 3 ** places[place] for place in range(4))
+            parameters[index * PATTERNS + pattern] = parameters[mirror * PATTERNS + mirrored] = count
+            count += 1
+    return parameters
+
+def training_positions(records) -> tuple[list[list[int]], list[float]]:
+    """Turns finished games into positions labelled with how the game ended
+
+    Args:
+        records: games as dictionaries with the moves played and the result for
+            player 1 (1, 0 or -1), like the records written by arena.py
+
+    Returns:
+        The weight table entries of the line patterns of each position, and the result of its game"""
+    features, targets = [], []
+    for record in records:
+        evaluation = NTupleEvaluation(array('f', bytes(4 * len(LINES) * PATTERNS)))
+        board = Connect4()
+        board.set_evaluation(evaluation)
+        for move in record['moves']:
+            board.make_move(int(move))
+            # the last position is decided already, which the search can see for itself
+            if board.is_terminal(): break
+            features.append(evaluation.patterns[:])
+            targets.append(float(record['result']))
+    return features, targets
+
+def train(records, epochs: int = 300, rate: float = 0.05, ridge: float = 1e-4) -> NTupleEvaluation:
+    """Fits the weights to predict the result of each game from its positions,
+    by least squares with Adam. Needs numpy
+
+    Args:
+        records: finished games (see training_positions)
+        epochs: the number of passes over every position
+        rate: the learning rate
+        ridge: how hard weights are pulled towards 0, for patterns that are rarely seen
+
+    Returns:
+        The trained evaluation"""
+    import numpy as np # only needed for training
+    features, targets = training_positions(records)
+    parameters = np.array(tied_patterns())
+    count = parameters.max() + 1
+    # each position as the parameters of its line patterns
+    active = parameters[np.array(features, dtype=np.int64)]
+    targets = np.array(targets)
+    weights = np.zeros(count)
+    mean = np.zeros(count)
+    variance = np.zeros(count)
+    for epoch in range(1, epochs + 1):
+        errors = weights[active].sum(axis=1) - targets
+        gradient = np.bincount(active.ravel(), np.repeat(errors, active.shape[1]), count) / len(targets) + ridge * weights
+        mean = 0.9 * mean + 0.1 * gradient
+        variance = 0.999 * variance + 0.001 * gradient ** 2
+        weights -= rate * (mean / (1 - 0.9 ** epoch)) / (np.sqrt(variance / (1 - 0.999 ** epoch)) + 1e-8)
+    # results run from -1 to 1, scores from -SCALE to SCALE
+    return NTupleEvaluation(array('f', (weights[parameters] * SCALE).astype(np.float32).tobytes()))
+
+def read_games(paths: list[str]) -> list[dict]:
+    """Reads finished games from JSONL files, such as the output of arena.py"""
+    records = []
+    for path in paths:
+        with open(path) as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+    return records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the N-tuple evaluation on self-play games')
+    parser.add_argument('path', nargs='?', default=WEIGHTS_PATH, help='where to write the weights')
+    parser.add_argument('--games', nargs='*', default=[], help='JSONL files of finished games, such as written by arena.py')
+    parser.add_argument('--play', type=int, default=0, help='play this many openings of self-play first, from both sides')
+    parser.add_argument('--depth', type=int, default=4, help='the depth the self-play engines search to')
+    parser.add_argument('--plies', type=int, default=8, help='the number of random moves opening each self-play game')
+    parser.add_argument('--workers', type=int, default=None, help='the number of processes to play on')
+    parser.add_argument('--epochs', type=int, default=300, help='the number of passes over the positions')
+    args = parser.parse_args()
+
+    records = read_games(args.games)
+    if args.play:
+        from arena import parse_engine, run
+        engines = [parse_engine(f'name=a,depth={args.depth}'), parse_engine(f'name=b,depth={args.depth},eval=balance')]
+        records += run(engines, args.play, args.plies, args.workers, seed=len(records))
+    if not records: parser.error('there are no games to train on')
+    print(f'Training on {len(records)} games')
+    train(records, args.epochs).save(args.path)
@@ -1,23 +1,403 @@
-from random import shuffle
+from random import shuffle, Random
+from time import perf_counter
+from tt import TranspositionTable, EXACT, LOWER, UPPER, PLAYER_KEY, START_KEY
+from stats import SearchStats
 
 class InvalidMoveError(Exception): pass # raised when someone makes an invalid move
+class SearchTimeout(Exception): pass # raised inside a search when its time or node budget runs out
+
+WIDTH = 7
+HEIGHT = 6
+CONNECT = 4 # the number of pieces in a row that wins
+# boards with this many empty cells or fewer are solved exactly instead of searched (see solver.Solver)
+SOLVE_EMPTY_CELLS = 20
+
+# bitboard keys longer than this are hashed down to fit in a transposition table
+# key alongside PLAYER_KEY and START_KEY, by taking them modulo a prime
+KEY_BITS = 62
+KEY_PRIME = (1 << 61) - 1
+
+def winning_lines(size: int = CONNECT, width: int = WIDTH, height: int = HEIGHT) -> list[tuple[tuple[int, int], ...]]:
+    """Lists every line of size cells on the board as (column, row) pairs. Verticals
+    come first, then horizontals, then both diagonals
+    
+    Args:
+        size: the number of cells in a line
+        width, height: the size of the board
+    
+    Returns:
+        A list of lines, each a tuple of cells"""
+    lines = []
+    for col in range(width):
+        for row in range(height - size + 1):
+            lines.append(tuple((col, row + i) for i in range(size)))
+    for col in range(width - size + 1):
+        for row in range(height):
+            lines.append(tuple((col + i, row) for i in range(size)))
+    for col in range(width - size + 1):
+        for row in range(height - size + 1):
+            lines.append(tuple((col + i, row + i) for i in range(size)))
+    for col in range(width - size + 1):
+        for row in range(size - 1, height):
+            lines.append(tuple((col + i, row - i) for i in range(size)))
+    return lines
+
+# bitboard layout: each column is height + 1 bits, bottom cell first, with a spare
+# sentinel bit on top so shifted lines never wrap into the next column
+
+def bottom_mask(column: int, height: int = HEIGHT) -> int:
+    """Returns the bit of the bottom cell of a column"""
+    return 1 << (column * (height + 1))
+
+def top_mask(column: int, height: int = HEIGHT) -> int:
+    """Returns the bit of the top cell of a column"""
+    return 1 << (height - 1 + column * (height + 1))
+
+def column_mask(column: int, height: int = HEIGHT) -> int:
+    """Returns the bits of every cell in a column"""
+    return ((1 << height) - 1) << (column * (height + 1))
+
+def cell_bit(column: int, row: int, height: int = HEIGHT) -> int:
+    """Converts a cell of Connect4.state (row 0 is the top) into its bitboard bit"""
+    return 1 << (column * (height + 1) + height - 1 - row)
+
+def window_starts(line_masks: list[int]) -> dict[int, int]:
+    """Groups the lines by the bit distance between their cells
+    
+    Args:
+        line_masks: the bits of the cells of every line
+    
+    Returns:
+        A dictionary from each distance to a mask of the lowest bit of every line with that distance"""
+    starts = {}
+    for line in line_masks:
+        low = line & -line
+        shift = ((line ^ low) & -(line ^ low)).bit_length() - low.bit_length()
+        starts[shift] = starts.get(shift, 0) | low
+    return starts
+
+class Geometry:
+    """The shape of a board, and every table the boards and the search need for it.
+    Get one with get_geometry, so the tables are only worked out once per shape
+
+    Attributes:
+        width, height: the number of columns and rows
+        connect: the number of pieces in a row that wins
+        cells: the number of cells on the board
+        center_order: the columns, closest to the middle first. They are part of more lines, so they are tried first
+        zobrist: a random 64 bit number for each player in each cell, xored together to key a board
+        lines: every line a player can win with, and cell_lines: the lines through each cell
+        bottoms, tops, columns: the bitboard bits of the bottom cell, the top cell and every cell of each column
+        cell_bits: the bitboard bit of each cell
+        bottom_mask, board_mask: the bits of the bottom row, and of every cell
+        column_key_mask: the bits of one column of a key, sentinel included
+        line_masks: the bits of the cells of every line
+        window_starts: see window_starts
+        alignment_shifts: for each direction, the shifts that narrow a bitboard down to the
+            first cell of every run of connect pieces (see is_aligned)
+        pair_shifts: alignment_shifts as pairs, when every direction takes two shifts, else None
+        key_shifts: for each column, its bit offset in a key and in the key of the mirror image
+        packed: True if bitboard keys fit in a transposition table key as they are
+        gap_shifts: for each direction and each place in a run of connect cells, the shifts
+            that bring the other cells of the run onto that place (see winning_cells)
+    """
+    def __init__(self, width: int, height: int, connect: int) -> None:
+        """Works out the tables
+
+        Args:
+            width, height: the size of the board
+            connect: the number of pieces in a row that wins"""
+        if width < 1 or height < 1 or not 1 < connect <= max(width, height):
+            raise ValueError(f'no game of connect {connect} on a {width} by {height} board')
+        self.width = width
+        self.height = height
+        self.connect = connect
+        self.cells = width * height
+        self.center_order = sorted(range(width), key=lambda column: abs(2 * column - (width - 1)))
+        # always seeded the same, so every process keys boards the same
+        rng = Random(0)
+        self.zobrist = {player: [[rng.getrandbits(64) for _ in range(height)] for _ in range(width)] for player in (1, -1)}
+        self.lines = winning_lines(connect, width, height)
+        self.cell_lines = [[[line for line in self.lines if (col, row) in line] for row in range(height)] for col in range(width)]
+
+        self.bottoms = [bottom_mask(column, height) for column in range(width)]
+        self.tops = [top_mask(column, height) for column in range(width)]
+        self.columns = [column_mask(column, height) for column in range(width)]
+        self.cell_bits = [[cell_bit(col, row, height) for row in range(height)] for col in range(width)]
+        self.bottom_mask = sum(self.bottoms)
+        self.board_mask = self.bottom_mask * ((1 << height) - 1)
+        self.column_key_mask = (1 << (height + 1)) - 1
+        self.line_masks = [sum(self.cell_bits[col][row] for col, row in line) for line in self.lines]
+        self.window_starts = window_starts(self.line_masks)
+        # vertical, horizontal, and both diagonals. each shift doubles the runs found
+        # so far, and the last one tops them up to connect
+        self.alignment_shifts = []
+        for direction in (1, height + 1, height, height + 2):
+            shifts, length = [], 1
+            while length * 2 <= connect:
+                shifts.append(direction * length)
+                length *= 2
+            if length < connect: shifts.append(direction * (connect - length))
+            self.alignment_shifts.append(shifts)
+        # connect 3 and 4 take exactly two shifts in every direction
+        self.pair_shifts = [tuple(shifts) for shifts in self.alignment_shifts] if connect in (3, 4) else None
+        # where each column of a key goes in the key of the mirror image
+        self.key_shifts = [(column * (height + 1), (width - 1 - column) * (height + 1)) for column in range(width)]
+        self.packed = width * (height + 1) <= KEY_BITS
+        self.gap_shifts = [[(other - place) * direction for other in range(connect) if other != place]
+                           for direction in (1, height + 1, height, height + 2) for place in range(connect)]
+
+    def __reduce__(self):
+        """Pickles to the shape, so a geometry sent to another process is that process's cached one"""
+        return get_geometry, (self.width, self.height, self.connect)
+
+    def is_aligned(self, bits: int) -> bool:
+        """Checks if a bitboard contains connect pieces in a row in any direction
+        
+        Args:
+            bits: the pieces of a single player
         
+        Returns:
+            True if there are enough pieces in a line, else False"""
+        if self.pair_shifts is not None:
+            # the usual game, unrolled since this is called at every node
+            for first, second in self.pair_shifts:
+                run = bits & (bits >> first)
+                if run & (run >> second):
+                    return True
+            return False
+        for shifts in self.alignment_shifts:
+            run = bits
+            for shift in shifts:
+                run &= run >> shift
+            if run:
+                return True
+        return False
+
+    def winning_cells(self, position: int, mask: int) -> int:
+        """Finds every empty cell, playable now or not, that would give position
+        connect pieces in a row
+
+        Args:
+            position: a bitboard of one player's pieces
+            mask: a bitboard of every occupied cell
+
+        Returns:
+            A bitboard of the cells"""
+        cells = 0
+        if self.connect == 4:
+            # the usual game, unrolled since this is called at every node
+            cells = (position << 1) & (position << 2) & (position << 3)
+            for shift in (self.height + 1, self.height, self.height + 2):
+                pair = (position << shift) & (position << 2 * shift)
+                cells |= pair & (position << 3 * shift)
+                cells |= pair & (position >> shift)
+                pair = (position >> shift) & (position >> 2 * shift)
+                cells |= pair & (position << shift)
+                cells |= pair & (position >> 3 * shift)
+            return cells & (self.board_mask ^ mask)
+        for shifts in self.gap_shifts:
+            run = self.board_mask
+            for shift in shifts:
+                run &= position >> shift if shift > 0 else position << -shift
+            cells |= run
+        return cells & (self.board_mask ^ mask)
+
+    def non_losing_cells(self, position: int, mask: int) -> int:
+        """Finds the moves that don't let the opponent win straight away. The player
+        to move must not have a winning move
+
+        Args:
+            position: a bitboard of the pieces of the player to move
+            mask: a bitboard of every occupied cell
+
+        Returns:
+            A bitboard of the cell each move would fill, 0 if every move loses"""
+        possible = (mask + self.bottom_mask) & self.board_mask
+        threats = self.winning_cells(position ^ mask, mask)
+        forced = possible & threats
+        if forced:
+            # two threats at once can't both be blocked
+            if forced & (forced - 1): return 0
+            possible = forced
+        # don't play under a cell the opponent would win with
+        return possible & ~(threats >> 1)
+
+# the geometries made so far, by (width, height, connect)
+_geometries: dict[tuple[int, int, int], Geometry] = {}
+
+# the solver best_move uses when it isn't given one, made the first time it is needed
+# so its table is only allocated once per process
+_solver = None
+
+def get_geometry(width: int = WIDTH, height: int = HEIGHT, connect: int = CONNECT) -> Geometry:
+    """Gets the geometry of a board shape, working its tables out the first time it is asked for
+
+    Raises:
+        ValueError: the shape has no winning lines"""
+    shape = (width, height, connect)
+    if shape not in _geometries:
+        _geometries[shape] = Geometry(width, height, connect)
+    return _geometries[shape]
+
+# the board the game is played on, whose tables the rest of the package uses
+STANDARD = get_geometry()
+# columns closer to the middle are part of more lines, so they are tried first
+CENTER_ORDER = STANDARD.center_order
+ZOBRIST = STANDARD.zobrist
+# the 69 lines a player can win with, and the lines through each cell
+LINES = STANDARD.lines
+CELL_LINES = STANDARD.cell_lines
+BOTTOM_MASK = STANDARD.bottom_mask
+BOARD_MASK = STANDARD.board_mask
+COLUMN_KEY_MASK = STANDARD.column_key_mask
+LINE_MASKS = STANDARD.line_masks
+# shifting a bitboard by one of these lines up each cell of a line with the next one
+WINDOW_STARTS = STANDARD.window_starts
+
+# what Connect4.tactics finds for the player to move: a move that wins on the spot,
+# a position the opponent wins on their next move whatever is played, or neither
+WINS_NOW, LOSES_NEXT, UNCLEAR = 1, -1, 0
+
+class SearchContext:
+    """Everything a search carries from node to node besides the board itself
+
+    Attributes:
+        table: the transposition table of previously explored nodes
+        start_player: the player making a move on the root board
+        killers: for each number of pieces on the board, the last two moves that caused a cutoff
+        history: for each player, how much each column has caused cutoffs so far
+        nodes: the number of nodes searched
+        deadline: the perf_counter time to stop searching at, or None
+        node_limit: the number of nodes to stop searching at, or None
+        stop: a function that returns True when the search should be abandoned, or None
+        stats: the statistics to count the search in, or None
+    """
+    def __init__(self, table: TranspositionTable, start_player: int, stats: SearchStats | None = None,
+                 geometry: Geometry = STANDARD) -> None:
+        """Initializes the instance
+
+        Args:
+            table: the transposition table to search with
+            start_player: the player making a move on the root board
+            stats: the statistics to count the search in, or None
+            geometry: the shape of the board being searched"""
+        self.table = table
+        self.start_player = start_player
+        self.stats = stats
+        self.killers = [[-1, -1] for _ in range(geometry.cells + 1)]
+        self.history = {1: [0] * geometry.width, -1: [0] * geometry.width}
+        self.nodes = 0
+        self.deadline = None
+        self.node_limit = None
+        self.stop = None
+        self.next_check = None
+
+    def set_budget(self, time_limit: float | None, node_limit: int | None, stop=None) -> None:
+        """Limits the rest of the search. Once the budget runs out the search raises SearchTimeout
+
+        Args:
+            time_limit: the number of seconds to search for from now, or None
+            node_limit: the number of nodes to search from now, or None
+            stop: a function that returns True when the search should be abandoned, or None"""
+        self.deadline = None if time_limit is None else perf_counter() + time_limit
+        self.node_limit = None if node_limit is None else self.nodes + node_limit
+        self.stop = stop
+        limited = time_limit is not None or node_limit is not None or stop is not None
+        self.next_check = self.nodes if limited else None
+
+    def check_budget(self) -> None:
+        """Raises SearchTimeout if the budget has run out. The clock is only read every 1024 nodes"""
+        self.next_check = self.nodes + 1024
+        if self.node_limit is not None:
+            if self.nodes >= self.node_limit: raise SearchTimeout()
+            self.next_check = min(self.next_check, self.node_limit)
+        if self.deadline is not None and perf_counter() >= self.deadline: raise SearchTimeout()
+        if self.stop is not None and self.stop(): raise SearchTimeout()
+
+    def record_cutoff(self, board: 'Connect4', move: int, depth: int) -> None:
+        """Remembers a move that caused a beta cutoff so it can be tried early elsewhere
+
+        Args:
+            board: the board the move was made on
+            move: the move that caused the cutoff
+            depth: the remaining depth of the search at the board"""
+        killers = self.killers[board.moves]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[board.player][move] += depth * depth
+
 class Connect4:
-    """A 7 wide by 6 tall connect 4 board
+    """A connect 4 board, 7 wide by 6 tall unless given another shape
 
     Attributes:
         player: An integer representing the player. Should always be either 1 or -1
+        geometry: the shape of the board and its tables (see Geometry)
         state: the state of the board. each sub array represents a column
+        heights: the number of pieces in each column
+        moves: the number of pieces on the board
+        zobrist: the zobrist key of the board
+        mirror_zobrist: the zobrist key of the board flipped left to right
+        evaluation: scores the leaves of a search instead of count_groups, kept up to date
+            as pieces are dropped and taken back (see evaluation.Evaluation), or None
     """
-    def __init__(self) -> None:
-        """Initializes the instance"""
+    geometry = STANDARD
+    evaluation = None
+
+    def __init__(self, width: int = WIDTH, height: int = HEIGHT, connect: int = CONNECT) -> None:
+        """Initializes the instance
+
+        Args:
+            width, height: the size of the board
+            connect: the number of pieces in a row that wins"""
         self.player = 1 # player 1 goes first
-        # create a 7 wide by 6 tall board, rotated 90 degrees
-        self.state = [[0] * 6 for _ in range(7)]
+        self.geometry = get_geometry(width, height, connect)
+        # create the board rotated 90 degrees
+        self.state = [[0] * height for _ in range(width)]
+
+    @classmethod
+    def from_moves(cls, moves: str, width: int = WIDTH, height: int = HEIGHT, connect: int = CONNECT) -> 'Connect4':
+        """Builds a board by playing moves from the start of a game
+        
+        Args:
+            moves: the columns played in order, one digit each (eg '3324')
+            width, height, connect: the shape of the board
+        
+        Returns:
+            The board after the moves"""
+        board = cls(width, height, connect)
+        for move in moves:
+            board.make_move(int(move))
+        return board
+
+    @property
+    def state(self) -> list[list[int]]:
+        """the state of the board. each sub array represents a column, starting from the top.
+        treat it as read only: writing into it doesn't update the heights or keys, and on a
+        BitboardConnect4 it is a copy, so the write is lost. assign a whole new state instead"""
+        return self._state
+
+    @state.setter
+    def state(self, state: list[list[int]]) -> None:
+        self._state = state
+        # keep the column heights, move counter and keys in sync with the new board
+        geometry = self.geometry
+        zobrist = geometry.zobrist
+        self.heights = [geometry.height - column.count(0) for column in state]
+        self.moves = sum(self.heights)
+        self.zobrist = 0
+        self.mirror_zobrist = 0
+        for col, column in enumerate(state):
+            for row, player in enumerate(column):
+                if player == 0: continue
+                self.zobrist ^= zobrist[player][col][row]
+                self.mirror_zobrist ^= zobrist[player][geometry.width - 1 - col][row]
+        if self.evaluation is not None: self.evaluation.reset(self)
 
     def __hash__(self) -> int:
         """Returns a hash value of the state"""
-        return hash((self.player, tuple(tuple(column) for column in self.state)))
+        return self.zobrist
     
     def __eq__(self, other) -> bool:
         """Checks if this board is the same as another board. It ignores the active player"""
@@ -29,26 +409,52 @@ class Connect4:
         Args:
             move: an integer representing which column to drop the piece, starting at 0"""
         self.validate_move(move)
+        self.drop(move)
+        return
 
-        # figure out the next free space
-        index = 0
-        while self.state[move][index] == 0:
-            index += 1
-            if index == 6: break
-        index -= 1
-
-        # make the move
-        self.state[move][index] = self.player
+    def drop(self, move: int) -> None:
+        """Drops a piece into the board without validating the move. Used by the search
+        to walk the tree in place
+        
+        Args:
+            move: the column to drop the piece in. It must have space"""
+        # the column height tells us the next free space
+        geometry = self.geometry
+        zobrist = geometry.zobrist[self.player]
+        self.heights[move] += 1
+        self.moves += 1
+        row = geometry.height - self.heights[move]
+        self._state[move][row] = self.player
+        self.zobrist ^= zobrist[move][row]
+        self.mirror_zobrist ^= zobrist[geometry.width - 1 - move][row]
+        if self.evaluation is not None: self.evaluation.drop(move, row, self.player)
 
         # switch players for next turn
         self.player *= -1
         return
+
+    def undo(self, move: int) -> None:
+        """Takes back the last piece dropped into a column
+        
+        Args:
+            move: the column to remove the top piece from"""
+        self.player *= -1
+        geometry = self.geometry
+        zobrist = geometry.zobrist[self.player]
+        row = geometry.height - self.heights[move]
+        self._state[move][row] = 0
+        self.zobrist ^= zobrist[move][row]
+        self.mirror_zobrist ^= zobrist[geometry.width - 1 - move][row]
+        if self.evaluation is not None: self.evaluation.undo(move, row, self.player)
+        self.heights[move] -= 1
+        self.moves -= 1
+        return
     
     def validate_move(self, move: int) -> None:
         """Raises an exception if the move is invalid
         
         Args:
-            move: the move to validate in the range [0, 6]
+            move: the move to validate, a column starting at 0
         """
         if not self.is_valid_move(move): raise Exception('Invalid Move')
         return
@@ -57,7 +463,7 @@ class Connect4:
         """Checks if a move is valid
         
         Args:
-            move: the move to check in the range [0, 6]
+            move: the move to check, a column starting at 0
         
         Returns:
             True if the move is valid else False"""
@@ -68,7 +474,7 @@ class Connect4:
         
         Returns:
             A list of all the valid moves that can be made in the current state"""
-        return [column for column in range(7) if self.has_space(column)]
+        return [column for column in range(self.geometry.width) if self.has_space(column)]
     
     def has_space(self, column: int) -> bool:
         """Checks if a column has space for more pieces
@@ -99,48 +505,79 @@ class Connect4:
         
         Returns:
             True if the player is a winner, else False"""
-        return self.count_groups(player, 4) > 0
+        return self.count_groups(player, self.geometry.connect) > 0
+
+    def last_move_won(self, move: int) -> bool:
+        """Checks if the piece on top of a column is part of a winning line. Only the
+        lines through that cell are looked at, so this is much cheaper than is_winner
+        
+        Args:
+            move: the column that was just played in
+        
+        Returns:
+            True if the last piece dropped in the column wins, else False"""
+        state = self._state
+        geometry = self.geometry
+        row = geometry.height - self.heights[move]
+        player = state[move][row]
+        lines = geometry.cell_lines[move][row]
+        if geometry.connect == 4:
+            # unrolled for the usual game, where this is called at every node
+            for (c0, r0), (c1, r1), (c2, r2), (c3, r3) in lines:
+                if state[c0][r0] == state[c1][r1] == state[c2][r2] == state[c3][r3] == player:
+                    return True
+            return False
+        return any(all(state[col][row] == player for col, row in line) for line in lines)
+
+    def completes_line(self, col: int, row: int, player: int) -> bool:
+        """Checks if a piece dropped into an empty cell would win
+        
+        Args:
+            col, row: the cell, in the layout of state (row 0 is the top)
+            player: the player whose piece it would be
+        
+        Returns:
+            True if every other cell of a line through the cell is the player's, else False"""
+        state = self._state
+        geometry = self.geometry
+        lines = geometry.cell_lines[col][row]
+        # the cell itself is empty, so a line is complete once it has connect - 1 pieces
+        if geometry.connect == 4:
+            for (c0, r0), (c1, r1), (c2, r2), (c3, r3) in lines:
+                if (state[c0][r0] == player) + (state[c1][r1] == player) + (state[c2][r2] == player) + (state[c3][r3] == player) == 3:
+                    return True
+            return False
+        return any(sum(state[c][r] == player for c, r in line) == geometry.connect - 1 for line in lines)
+
+    def is_full(self) -> bool:
+        """Checks if every space on the board is taken
+        
+        Returns:
+            True if there are no valid moves left, else False"""
+        return self.moves == self.geometry.cells
     
     def count_groups(self, player: int, size: int) -> int:
-        """Iterates over every 4 piece line in the game, and checks if it has
+        """Iterates over every winning line in the game, and checks if it has
         more than size pieces belonging to the specified player
         
         Args:
             player: the player to check
-            size: the number of pieces in the group to match or exceed. Should not be more than 4
+            size: the number of pieces in the group to match or exceed. Should not be more than the pieces in a line
         
         Returns:
             The number of valid groups found
             """
-        ROWS = len(self.state[0])  # Number of rows (from column height)
-        COLS = len(self.state)     # Number of columns
-
+        state = self._state
+        geometry = self.geometry
         count = 0
-
-        # Check verticals
-        for col in range(COLS):
-            for row in range(ROWS - 3):
-                if [self.state[col][row + i] for i in range(4)].count(player) >= size:
-                    count += 1
-
-        # Check horizontals
-        for col in range(COLS - 3):
-            for row in range(ROWS):
-                if [self.state[col + i][row] for i in range(4)].count(player) >= size:
-                    count += 1
-
-        # Check diagonals (bottom-left to top-right)
-        for col in range(COLS - 3):
-            for row in range(ROWS - 3):
-                if [self.state[col + i][row + i] for i in range(4)].count(player) >= size:
+        if geometry.connect != 4:
+            for line in geometry.lines:
+                if sum(state[col][row] == player for col, row in line) >= size:
                     count += 1
-
-        # Check diagonals (top-left to bottom-right)
-        for col in range(COLS - 3):
-            for row in range(3, ROWS):
-                if [self.state[col + i][row - i] for i in range(4)].count(player) >= size:
-                    count += 1
-
+            return count
+        for (c0, r0), (c1, r1), (c2, r2), (c3, r3) in geometry.lines:
+            if (state[c0][r0] == player) + (state[c1][r1] == player) + (state[c2][r2] == player) + (state[c3][r3] == player) >= size:
+                count += 1
         return count
     
     def score(self) -> int:
@@ -167,17 +604,30 @@ class Connect4:
         
         Returns:
             True if the board is terminal, else False"""
-        return self.has_winner() or all(self.column_full(i) for i in range(7))
+        return self.has_winner() or self.is_full()
     
     def clone(self) -> 'Connect4':
         """Make a copy of ourself
         
         Returns:
             A copy of the current board"""
-        clone = Connect4()
-        clone.state = [column[:] for column in self.state]
+        clone = Connect4.__new__(Connect4)
+        clone.geometry = self.geometry
+        clone._state = [column[:] for column in self._state]
+        clone.heights = self.heights[:]
+        clone.moves = self.moves
+        clone.zobrist = self.zobrist
+        clone.mirror_zobrist = self.mirror_zobrist
         clone.player = self.player
+        if self.evaluation is not None: clone.evaluation = self.evaluation.copy()
         return clone
+
+    def keys(self) -> tuple[int, int]:
+        """Gets the keys used to look the board up in a transposition table
+        
+        Returns:
+            The key of the board and the key of its mirror image"""
+        return self.zobrist, self.mirror_zobrist
     
     def children(self) -> list['Connect4']:
         """Generates all boards that can result from making a move
@@ -191,76 +641,369 @@ class Connect4:
         return children
     
     def temp_score(self, start_player: int) -> int:
-        """Returns the heuristic value of a board based off the number of almost complete 4s
+        """Returns the heuristic value of a board based off the number of almost complete lines,
+        or from the board's evaluation if it has one
         
         Args:
             start_player: the player that is making a move on the root board
         
         Returns:
-            The number of possible connect 4s that have at least 3 pieces
+            The number of possible winning lines that are one piece short
         """
-        return self.count_groups(start_player, 3) * start_player
+        if self.evaluation is not None: return self.evaluation.score(start_player)
+        return self.count_groups(start_player, self.geometry.connect - 1) * start_player
+
+    def set_evaluation(self, evaluation) -> None:
+        """Scores the leaves of searches from this board with an evaluation instead of count_groups
+        
+        Args:
+            evaluation: the evaluation.Evaluation to use, or None to go back to count_groups.
+                It belongs to this board from now on, clones get copies of it"""
+        self.evaluation = evaluation
+        if evaluation is not None: evaluation.reset(self)
+
+    def tactics(self) -> tuple[int, list[int] | None]:
+        """Sorts out the sharp moves of the position before it is searched: a move that
+        wins on the spot is played at once, a threat of the opponent's must be blocked,
+        two threats can't both be blocked, and a move under a cell the opponent wins
+        with only hands it to them
+        
+        Returns:
+            WINS_NOW and the winning moves, LOSES_NEXT and None if every move lets the
+            opponent win straight away, or UNCLEAR and the moves worth searching, None
+            if that is every valid move"""
+        player = self.player
+        height = self.geometry.height
+        moves = [(column, height - 1 - self.heights[column]) for column in self.geometry.center_order
+                 if self.heights[column] < height]
+        wins = [column for column, row in moves if self.completes_line(column, row, player)]
+        if wins: return WINS_NOW, wins
+        threats = [(column, row) for column, row in moves if self.completes_line(column, row, -player)]
+        if len(threats) > 1: return LOSES_NEXT, None
+        candidates = threats or moves
+        # the opponent would play on top of the piece and win
+        safe = [column for column, row in candidates if row == 0 or not self.completes_line(column, row - 1, -player)]
+        if not safe: return LOSES_NEXT, None
+        return UNCLEAR, safe if len(safe) < len(moves) else None
+
+    def forced_move(self) -> int | None:
+        """Finds a move that can be played without searching: a move that wins on the
+        spot, or the only move that doesn't let the opponent win straight away
+        
+        Returns:
+            The move, or None if the position has to be searched"""
+        outcome, moves = self.tactics()
+        if outcome == WINS_NOW or (outcome == UNCLEAR and moves is not None and len(moves) == 1): return moves[0]
+        return None
     
-    def score_state(self, depth: int, states: dict, alpha: int, beta: int, start_player: int) -> int:
+    def score_state(self, depth: int, table: TranspositionTable, alpha: int, beta: int, start_player: int) -> int:
         """Uses minimax to determine the score of the state
         
         Args:
             depth: the max recursion depth
-            states: a dictionary of all previously explored nodes and their scores
+            table: the transposition table of previously explored nodes
             alpha: the alpha value for alpha beta pruning
             beta: the beta value for alpha beta pruning
             start_player: the player making a move on the root board
         
         Returns:
             The score of the board found via minimax"""
-
-        if self in states: return states[self]
         if self.is_terminal(): 
-            # prolong the inevitable for as long as possible
-            return (self.score() * 100) - (start_player * depth) # base case
+            # win as soon as possible, and prolong the inevitable for as long as possible.
+            # a draw scores the same as in score_move
+            winner = self.score()
+            return winner * (100 + depth) if winner else -(start_player * depth) # base case
+        return self.search(depth, SearchContext(table, start_player, geometry=self.geometry), alpha, beta)
+
+    def score_move(self, move: int, depth: int, context: SearchContext, alpha: int, beta: int) -> int:
+        """Scores the board that results from a move. The move is made in place and
+        taken back before returning, so the board is left unchanged
+        
+        Args:
+            move: the move to score. It must be valid
+            depth: the max recursion depth below the move
+            context: the state of the search
+            alpha: the alpha value for alpha beta pruning
+            beta: the beta value for alpha beta pruning
+        
+        Returns:
+            The score of the move found via minimax"""
+        self.drop(move)
+        try:
+            if self.last_move_won(move):
+                # the more depth is left the sooner the win, so the winner wants it
+                # as big as it can be and the loser as small as it can be
+                score = -self.player * (100 + depth)
+            elif self.is_full():
+                score = -(context.start_player * depth)
+            else:
+                score = self.search(depth, context, alpha, beta)
+        finally:
+            # the board must be restored even if the search ran out of time
+            self.undo(move)
+        return score
+
+    def ordered_moves(self, tt_move: int, context: SearchContext, moves: list[int] | None = None) -> list[int]:
+        """Orders the valid moves so the ones most likely to cause a cutoff come first:
+        the best move from an earlier search, then the killer moves, then by history,
+        with columns closer to the center breaking ties
+        
+        Args:
+            tt_move: the best move found by an earlier search, or -1
+            context: the state of the search
+            moves: the moves to order, or None for every valid move
+        
+        Returns:
+            The moves in the order they should be searched"""
+        history = context.history[self.player]
+        if moves is None: moves = [move for move in self.geometry.center_order if self.has_space(move)]
+        else: moves = moves[:]
+        moves.sort(key=history.__getitem__, reverse=True)
+        for move in reversed(context.killers[self.moves]):
+            if move >= 0 and move != tt_move and move in moves:
+                moves.remove(move)
+                moves.insert(0, move)
+        if tt_move in moves:
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
+        return moves
+
+    def search(self, depth: int, context: SearchContext, alpha: int, beta: int) -> int:
+        """The minimax search behind score_state. It walks the tree by making and
+        unmaking moves on this board instead of creating children.
+        
+        Args:
+            depth: the max recursion depth
+            context: the state of the search
+            alpha: the alpha value for alpha beta pruning
+            beta: the beta value for alpha beta pruning
+        
+        Returns:
+            The score of the board found via minimax. The board must not be terminal"""
+        context.nodes += 1
+        if context.next_check is not None and context.nodes >= context.next_check:
+            context.check_budget()
+        start_player = context.start_player
+        stats = context.stats
         if depth == 0:
+            if stats is not None: stats.leaves += 1
             return self.temp_score(start_player) # TODO make this score the intrensic value
 
-        scores = []
-        if self.player == 1:
-            for child in self.children():
-                score = child.score_state(depth - 1, states, alpha, beta, start_player)
-                scores.append(score)
+        # mirror images have the same score, so they share the entry with the smaller key
+        key, mirror_key = self.keys()
+        mirrored = mirror_key < key
+        if mirrored: key = mirror_key
+        if self.player == -1: key ^= PLAYER_KEY
+        if start_player == -1: key ^= START_KEY
 
-                alpha = max(score, alpha)
-                if alpha >= beta: break
-        if self.player == -1:
-            for child in self.children():
-                score = child.score_state(depth - 1, states, alpha, beta, start_player)
-                scores.append(score)  
+        table = context.table
+        tt_move = -1
+        entry = table.probe(key)
+        if stats is not None:
+            stats.tt_probes += 1
+            stats.tt_hits += entry is not None
+        if entry is not None:
+            score, entry_depth, flag, tt_move = entry
+            if mirrored and tt_move >= 0: tt_move = self.geometry.width - 1 - tt_move
+            # scores depend on the remaining depth (see score_move), so only entries
+            # searched to exactly this depth can stand in for a search
+            if entry_depth == depth:
+                if flag == EXACT: return score
+                if flag == LOWER and score >= beta: return score
+                if flag == UPPER and score <= alpha: return score
+
+        # settle sharp positions without searching them, and drop moves that lose at once
+        outcome, moves = self.tactics()
+        if outcome == WINS_NOW: return self.player * (100 + depth - 1)
+        if outcome == LOSES_NEXT: return -self.player * (100 + depth - 2)
+
+        original_alpha, original_beta = alpha, beta
+        maximizing = self.player == 1
+        score = float('-inf') if maximizing else float('inf')
+        best = -1
+        for index, move in enumerate(self.ordered_moves(tt_move, context, moves)):
+            child_score = self.score_move(move, depth - 1, context, alpha, beta)
 
+            if maximizing and child_score > score:
+                score, best = child_score, move
+                alpha = max(score, alpha)
+            elif not maximizing and child_score < score:
+                score, best = child_score, move
                 beta = min(score, beta)
-                if alpha >= beta: break
+            if alpha >= beta:
+                context.record_cutoff(self, move, depth)
+                if stats is not None:
+                    stats.cutoffs += 1
+                    stats.first_move_cutoffs += index == 0
+                break
 
-        score = 0
-        if self.player == 1:
-            score = max(scores)
-        if self.player == -1:
-            score = min(scores)
-        
-        states[self] = score
+        if score <= original_alpha: flag = UPPER
+        elif score >= original_beta: flag = LOWER
+        else: flag = EXACT
+        table.store(key, score, depth, flag, self.geometry.width - 1 - best if mirrored else best)
+        if stats is not None: stats.tt_stores += 1
         return score
     
-    def best_move(self, recursion_depth=6) -> int:
-        """Use minimax to find the best move
+    def score_moves(self, moves: list[int], depth: int, context: SearchContext) -> list[int]:
+        """Scores each move at the root of a search. Moves that can't tie the best
+        score so far are only searched far enough to prove it, so their scores are
+        bounds rather than exact values
+        
+        Args:
+            moves: the moves to score
+            depth: the max recursion depth below each move
+            context: the state of the search
+        
+        Returns:
+            The score of each move"""
+        stats = context.stats
+        if stats is not None: stats.start_iteration(depth, context.nodes)
+        scores = []
+        best = None
+        for move in moves:
+            if stats is not None: move_start = perf_counter()
+            # scores are integers, so a window just below the best score so far still
+            # finds every move that ties it
+            if best is None:
+                alpha, beta = float('-inf'), float('inf')
+            elif self.player == 1:
+                alpha, beta = best - 1, float('inf')
+            else:
+                alpha, beta = float('-inf'), best + 1
+            score = self.score_move(move, depth, context, alpha, beta)
+            scores.append(score)
+            if best is None or (score > best if self.player == 1 else score < best):
+                best = score
+            if stats is not None: stats.span(f'move {move}', move_start, depth=depth, score=score)
+        if stats is not None: stats.finish_iteration(depth, context.nodes)
+        return scores
+
+    def deepen(self, moves: list[int], context: SearchContext, time_limit: float | None = None,
+               node_limit: int | None = None, stop=None, max_depth: int | None = None) -> tuple[list[int], list[int], int]:
+        """Scores the root moves with iterative deepening, one level deeper at a time,
+        until the budget runs out or the search reaches the end of the game
+        
+        Args:
+            moves: the moves to score, in the order to try them first
+            context: the state of the search
+            time_limit: the number of seconds to search for, or None
+            node_limit: the number of nodes to search, or None
+            stop: a function that returns True when the search should be abandoned, or None
+            max_depth: the deepest search to run, or None to keep going until the budget runs out
+        
+        Returns:
+            The moves, reordered best first, their scores from the deepest finished search,
+            and the depth of that search"""
+        moves = moves[:]
+        # the first iteration always finishes so there is a move to return
+        scores = self.score_moves(moves, 0, context)
+        finished = 0
+        context.set_budget(time_limit, node_limit, stop)
+        # there is nothing left to learn once the search reaches the end of the game
+        end = self.geometry.cells - self.moves
+        if max_depth is not None: end = min(end, max_depth + 1)
+        for depth in range(1, end):
+            # search the best move of the last iteration first
+            best = max(range(len(moves)), key=lambda x: scores[x] * self.player)
+            moves.insert(0, moves.pop(best))
+            scores.insert(0, scores.pop(best))
+            try:
+                scores = self.score_moves(moves, depth, context)
+            except SearchTimeout:
+                break
+            finished = depth
+        return moves, scores, finished
+
+    def best_move(self, recursion_depth=6, table: TranspositionTable | None = None,
+                  time_limit: float | None = None, node_limit: int | None = None, engine: str = 'minimax',
+                  book=None, workers: int = 1, stats: SearchStats | None = None,
+                  solve_empty: int = SOLVE_EMPTY_CELLS, tree=None, solver=None) -> int:
+        """Use minimax to find the best move. With a time or node limit, the search
+        deepens one level at a time until the budget runs out and the move from the
+        deepest finished search is returned. Once few enough cells are left the game
+        is solved exactly instead, which is both faster and never wrong. A move that
+        wins on the spot, or the only move that doesn't lose at once, is returned
+        without searching
         
         Args:
-            recursion_depth: the depth to recurse to
+            recursion_depth: the depth to recurse to. Ignored if there is a time or node limit
+            table: a transposition table to share between searches. A new one is made if this is None
+            time_limit: the number of seconds to search for, or None
+            node_limit: the number of nodes to search, or None
+            engine: 'minimax' for alpha beta search, 'batch' to score the whole tree at
+                once with numpy (see batch.frontier_scores), or 'mcts' for Monte Carlo tree
+                search (see mcts.MonteCarloTree). The batch engine ignores the limits, and
+                mcts counts playouts against the node limit and ignores the depth
+            book: a book.OpeningBook to look the board up in before searching, or None
+            workers: the number of processes to search with (see parallel.parallel_scores).
+                The table is only shared with them if it is a parallel.SharedTranspositionTable
+            stats: the statistics to count the search in, or None. Only this process is counted
+            solve_empty: solve the game exactly when this many cells or fewer are empty.
+                0 never solves. The solver ignores every other setting
+            tree: the mcts.MonteCarloTree to search with, kept from move to move, or None
+                for a new one
+            solver: the solver.Solver to solve with, or None for one kept by this process
+        
+        The book, the solver and the batch engine only know the standard board, so
+        boards of any other shape are always searched with minimax or mcts
         
         Returns:
             The best move found from minimax"""
-        # get all the possible moves
-        moves = self.valid_moves()
-        children = self.children()
-        states = {}
-        # calculate all the scores
-        scores = [child.score_state(recursion_depth, states, float('-inf'), float('inf'), self.player) for child in children]
+        standard = self.geometry is STANDARD
+        if book is not None and standard:
+            entry = book.lookup(self)
+            if entry is not None: return entry[1]
+
+        move = self.forced_move()
+        if move is not None: return move
+
+        if standard and STANDARD.cells - self.moves <= solve_empty:
+            if solver is None:
+                global _solver
+                if _solver is None:
+                    from solver import Solver
+                    _solver = Solver()
+                solver = _solver
+            moves = self.valid_moves()
+            # solver scores are for the player to move, pick_best wants them for player 1
+            return self.pick_best(moves, [score * self.player for score in solver.score_moves(self, moves)])
+
+        if engine == 'mcts':
+            from mcts import MonteCarloTree
+            if tree is None: tree = MonteCarloTree()
+            tree.set_root(self)
+            tree.search(time_limit, node_limit)
+            return tree.best_move()
+
+        if engine == 'batch' and standard:
+            from batch import frontier_scores # numpy is only needed for this engine
+            moves = self.valid_moves()
+            return self.pick_best(moves, frontier_scores(self, recursion_depth))
+
+        moves = [move for move in self.geometry.center_order if self.has_space(move)]
+        if workers > 1:
+            from parallel import parallel_scores
+            scores = parallel_scores(self, moves, recursion_depth, workers, table, time_limit, node_limit, stats)
+            return self.pick_best(moves, scores)
+
+        if table is None: table = TranspositionTable()
+        table.new_search()
+        context = SearchContext(table, self.player, stats, self.geometry)
+        if time_limit is None and node_limit is None:
+            scores = self.score_moves(moves, recursion_depth, context)
+        else:
+            moves, scores, _ = self.deepen(moves, context, time_limit, node_limit)
+        return self.pick_best(moves, scores)
+
+    def pick_best(self, moves: list[int], scores: list[int]) -> int:
+        """Picks the move with the best score for the current player, breaking ties at random
+        
+        Args:
+            moves: the moves to pick from
+            scores: the score of each move
         
+        Returns:
+            The best move"""
         # randomize the order in which we evaluate moves to decrease predictability
         indices = list(range(len(moves)))
         shuffle(indices)
@@ -287,10 +1030,362 @@ class Connect4:
 
     def show(self):
         """Print out the board for debugging/playing in the terminal"""
-        for row in range(6):  # From top to bottom
-            print(' '.join(str(self.player_to_string(self.state[col][row])) for col in range(7)))
-        print('0 1 2 3 4 5 6')  # Column indices
- 
+        geometry = self.geometry
+        for row in range(geometry.height):  # From top to bottom
+            print(' '.join(str(self.player_to_string(self.state[col][row])) for col in range(geometry.width)))
+        print(' '.join(str(col % 10) for col in range(geometry.width)))  # Column indices
+
+class BitboardConnect4(Connect4):
+    """A Connect4 board stored as two integer bitboards instead of seven lists.
+    Moves, win checks and copies are a handful of integer operations.
+
+    The list based state is still available through the state property, so this
+    can be used anywhere a Connect4 is expected.
+
+    Attributes:
+        player: An integer representing the player. Should always be either 1 or -1
+        geometry: the shape of the board and its bitboard layout (see Geometry)
+        ones: a bitboard of the cells occupied by player 1
+        mask: a bitboard of every occupied cell
+        moves: the number of pieces on the board
+    """
+    def __init__(self, width: int = WIDTH, height: int = HEIGHT, connect: int = CONNECT) -> None:
+        """Initializes the instance
+
+        Args:
+            width, height: the size of the board
+            connect: the number of pieces in a row that wins"""
+        self.player = 1 # player 1 goes first
+        self.geometry = get_geometry(width, height, connect)
+        self.ones = 0
+        self.mask = 0
+        self.moves = 0
+
+    @property
+    def state(self) -> list[list[int]]:
+        """the state of the board in the same layout as Connect4.state. it is built from
+        the bitboards on every read, so writing into it changes nothing. assign a whole
+        new state to change the board"""
+        geometry = self.geometry
+        state = [[0] * geometry.height for _ in range(geometry.width)]
+        for col in range(geometry.width):
+            for row in range(geometry.height):
+                bit = geometry.cell_bits[col][row]
+                if self.mask & bit:
+                    state[col][row] = 1 if self.ones & bit else -1
+        return state
+
+    @state.setter
+    def state(self, state: list[list[int]]) -> None:
+        self.ones = 0
+        self.mask = 0
+        for col, column in enumerate(state):
+            for row, player in enumerate(column):
+                if player == 0: continue
+                bit = self.geometry.cell_bits[col][row]
+                self.mask |= bit
+                if player == 1:
+                    self.ones |= bit
+        self.moves = self.mask.bit_count()
+        if self.evaluation is not None: self.evaluation.reset(self)
+
+    @classmethod
+    def from_board(cls, board: Connect4) -> 'BitboardConnect4':
+        """Converts any Connect4 board into a bitboard
+        
+        Args:
+            board: the board to convert
+        
+        Returns:
+            A bitboard with the same pieces and player"""
+        geometry = board.geometry
+        bitboard = cls(geometry.width, geometry.height, geometry.connect)
+        bitboard.state = board.state
+        bitboard.player = board.player
+        if board.evaluation is not None: bitboard.set_evaluation(board.evaluation.copy())
+        return bitboard
+
+    def __hash__(self) -> int:
+        """Returns a hash value of the state"""
+        return hash((self.ones, self.mask))
+
+    def __eq__(self, other) -> bool:
+        """Checks if this board is the same as another board. It ignores the active player"""
+        if isinstance(other, BitboardConnect4):
+            return self.ones == other.ones and self.mask == other.mask
+        return self.state == other.state
+
+    def pieces(self, player: int) -> int:
+        """Gets the bitboard of a player's pieces
+        
+        Args:
+            player: the player to get. Should be -1 or 1
+        
+        Returns:
+            a bitboard of the cells occupied by the player"""
+        return self.ones if player == 1 else self.mask ^ self.ones
+
+    def make_move(self, move: int) -> None:
+        """Drops a piece into the board.
+        
+        Args:
+            move: an integer representing which column to drop the piece, starting at 0"""
+        self.validate_move(move)
+        self.drop(move)
+        return
+
+    def drop(self, move: int) -> None:
+        """Drops a piece into the board without validating the move
+        
+        Args:
+            move: the column to drop the piece in. It must have space"""
+        # adding the bottom bit carries up to the first free cell of the column
+        mask = self.mask | (self.mask + self.geometry.bottoms[move])
+        if self.player == 1:
+            self.ones |= mask ^ self.mask
+        self.mask = mask
+        if self.evaluation is not None:
+            self.evaluation.drop(move, self.geometry.height - (mask & self.geometry.columns[move]).bit_count(), self.player)
+        self.moves += 1
+        self.player *= -1
+        return
+
+    def undo(self, move: int) -> None:
+        """Takes back the last piece dropped into a column
+        
+        Args:
+            move: the column to remove the top piece from"""
+        column = self.geometry.columns[move]
+        top = 1 << ((self.mask & column).bit_length() - 1)
+        self.mask ^= top
+        self.ones &= ~top
+        self.moves -= 1
+        self.player *= -1
+        if self.evaluation is not None:
+            self.evaluation.undo(move, self.geometry.height - 1 - (self.mask & column).bit_count(), self.player)
+        return
+
+    def is_valid_move(self, move: int) -> bool:
+        """Checks if a move is valid
+        
+        Args:
+            move: the move to check, a column starting at 0
+        
+        Returns:
+            True if the move is valid else False"""
+        return move in range(self.geometry.width) and self.has_space(move)
+
+    def valid_moves(self) -> list[int]:
+        """Gets all the valid moves
+        
+        Returns:
+            A list of all the valid moves that can be made in the current state"""
+        mask = self.mask
+        return [column for column, top in enumerate(self.geometry.tops) if not mask & top]
+
+    def has_space(self, column: int) -> bool:
+        """Checks if a column has space for more pieces
+        
+        Args:
+            column: the index of the column to check
+        
+        Returns:
+            True if the column can accept more pieces else false"""
+        return not self.mask & self.geometry.tops[column]
+
+    def is_winner(self, player: int) -> bool:
+        """check if a player wins
+        
+        Args:
+            player: the player to check. Should be -1 or 1
+        
+        Returns:
+            True if the player is a winner, else False"""
+        return self.geometry.is_aligned(self.pieces(player))
+
+    def last_move_won(self, move: int) -> bool:
+        """Checks if the last piece dropped wins the game
+        
+        Args:
+            move: the column that was just played in
+        
+        Returns:
+            True if the player who just moved has a line, else False"""
+        return self.geometry.is_aligned(self.pieces(-self.player))
+
+    def tactics(self) -> tuple[int, list[int] | None]:
+        """Sorts out the sharp moves of the position with a few bitboard operations
+        (see Connect4.tactics)"""
+        geometry = self.geometry
+        mask = self.mask
+        position = self.ones if self.player == 1 else self.ones ^ mask
+        possible = (mask + geometry.bottom_mask) & geometry.board_mask
+        wins = possible & geometry.winning_cells(position, mask)
+        if wins: return WINS_NOW, [column for column in geometry.center_order if wins & geometry.columns[column]]
+        safe = geometry.non_losing_cells(position, mask)
+        if not safe: return LOSES_NEXT, None
+        if safe == possible: return UNCLEAR, None
+        return UNCLEAR, [column for column in geometry.center_order if safe & geometry.columns[column]]
+
+    def count_groups(self, player: int, size: int) -> int:
+        """Counts every winning line in the game with at least size pieces belonging to the specified player
+        
+        Args:
+            player: the player to check
+            size: the number of pieces in the group to match or exceed. Should not be more than the pieces in a line
+        
+        Returns:
+            The number of valid groups found
+            """
+        pieces = self.pieces(player)
+        geometry = self.geometry
+        connect = geometry.connect
+        if connect == 4 and size >= 3:
+            # line up the 4 cells of every line in each direction and count the lines
+            # with enough of them set, all at once
+            count = 0
+            for shift, starts in geometry.window_starts.items():
+                b1 = pieces >> shift
+                b2 = pieces >> (2 * shift)
+                b3 = pieces >> (3 * shift)
+                if size == 3:
+                    windows = (pieces & b1 & (b2 | b3)) | (b2 & b3 & (pieces | b1))
+                else:
+                    windows = pieces & b1 & b2 & b3
+                count += (windows & starts).bit_count()
+            return count
+
+        if size < connect - 1:
+            return sum((pieces & line).bit_count() >= size for line in geometry.line_masks)
+
+        # the same for other lengths of line, one cell at a time, keeping the lines
+        # with every cell so far set and those missing at most one
+        count = 0
+        for shift, starts in geometry.window_starts.items():
+            full = near = -1
+            for i in range(connect):
+                cells = pieces >> (i * shift)
+                near = (near & cells) | full
+                full &= cells
+            count += ((full if size >= connect else near) & starts).bit_count()
+        return count
+
+    def is_terminal(self) -> bool:
+        """Checks if the board is in a terminal state (ie someone won or the board is full)
+        
+        Returns:
+            True if the board is terminal, else False"""
+        geometry = self.geometry
+        return self.mask == geometry.board_mask or geometry.is_aligned(self.ones) or geometry.is_aligned(self.mask ^ self.ones)
+
+    def clone(self) -> 'BitboardConnect4':
+        """Make a copy of ourself
+        
+        Returns:
+            A copy of the current board"""
+        clone = BitboardConnect4.__new__(BitboardConnect4)
+        clone.geometry = self.geometry
+        clone.player = self.player
+        clone.ones = self.ones
+        clone.mask = self.mask
+        clone.moves = self.moves
+        if self.evaluation is not None: clone.evaluation = self.evaluation.copy()
+        return clone
+
+    def keys(self) -> tuple[int, int]:
+        """Gets the keys used to look the board up in a transposition table. The
+        key is unique to the board, so a table never confuses two positions, unless
+        the board is too big for its keys to fit (see KEY_BITS)
+        
+        Returns:
+            The key of the board and the key of its mirror image"""
+        # the mask fills in every column up to its height, so adding it to a subset
+        # of itself gives every board its own number without carrying between columns
+        geometry = self.geometry
+        key = self.ones + self.mask
+        column_key_mask = geometry.column_key_mask
+        mirror_key = 0
+        for shift, mirror_shift in geometry.key_shifts:
+            mirror_key |= ((key >> shift) & column_key_mask) << mirror_shift
+        if not geometry.packed: return key % KEY_PRIME, mirror_key % KEY_PRIME
+        return key, mirror_key
+
+    def children(self) -> list['BitboardConnect4']:
+        """Generates all boards that can result from making a move
+        
+        Returns:
+            A list of boards that can be made by making a move"""
+        children = []
+        for move in self.valid_moves():
+            child = self.clone()
+            child.drop(move)
+            children.append(child)
+        return children
+
+    def encode(self) -> int:
+        """Packs the board into a single integer, the same as its transposition table
+        key. That is under 64 bits on the standard board. The player to move isn't
+        stored, see decode
+        
+        Returns:
+            The packed board"""
+        return self.ones + self.mask
+
+    @classmethod
+    def decode(cls, key: int, width: int = WIDTH, height: int = HEIGHT, connect: int = CONNECT) -> 'BitboardConnect4':
+        """Unpacks a board packed by encode. Player 1 is taken to have moved first
+        
+        Args:
+            key: the packed board
+            width, height, connect: the shape of the board it was packed from
+        
+        Returns:
+            The board
+
+        Raises:
+            ValueError: the key isn't a packed board, or it has pieces no game could
+                leave, with either player having too many"""
+        board = cls(width, height, connect)
+        column_key_mask = board.geometry.column_key_mask
+        for column in range(width):
+            # a column of height h packs to between 2^h - 1 and 2^(h+1) - 2
+            bits = (key >> (column * (height + 1))) & column_key_mask
+            filled_height = (bits + 1).bit_length() - 1
+            filled = (1 << filled_height) - 1
+            if filled_height > height: raise ValueError(f'{key} is not a packed board')
+            board.mask |= filled << (column * (height + 1))
+            board.ones |= (bits - filled) << (column * (height + 1))
+        if key >> (width * (height + 1)): raise ValueError(f'{key} is not a packed board')
+        board.moves = board.mask.bit_count()
+        board.player = 1 if board.moves % 2 == 0 else -1
+        # player 1 moved first, so they have the extra piece after an odd number of moves
+        if board.ones.bit_count() != (board.moves + 1) // 2:
+            raise ValueError(f'{key} has the wrong number of pieces for each player')
+        return board
+
+    @classmethod
+    def from_bits(cls, ones: int, mask: int, player: int, width: int = WIDTH, height: int = HEIGHT,
+                  connect: int = CONNECT) -> 'BitboardConnect4':
+        """Builds a board from its bitboards, checking that a game could reach it
+
+        Args:
+            ones, mask, player: the board (see BitboardConnect4)
+            width, height, connect: the shape of the board
+
+        Returns:
+            The board
+
+        Raises:
+            ValueError: ones has pieces outside of mask, a piece is floating or off the
+                board, a player has too many pieces, or it isn't player's turn"""
+        if ones & ~mask: raise ValueError('ones has pieces outside of mask')
+        # unpacking the key rebuilds each column from the bottom up, so a board with
+        # a floating piece or one outside the board comes back different
+        board = cls.decode(ones + mask, width, height, connect)
+        if board.mask != mask: raise ValueError('mask is not a legal board')
+        if player != board.player: raise ValueError(f'it is not player {player}\'s turn')
+        return board
+
 if __name__ == '__main__':
     # create a board
     c = Connect4()
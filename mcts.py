@@ -0,0 +1,328 @@
+from array import array
+from math import log, sqrt
+from random import random
+from time import perf_counter
+from main import Connect4, BitboardConnect4
+
+# the number of playouts to run when there is no time or playout limit
+PLAYOUTS = 4000
+# the number of nodes the tree has room for
+CAPACITY = 1 << 18
+# how much an unsure move is tried for the chance it is better than it looks
+EXPLORATION = 0.4
+# how quickly moves stop being judged by how they did anywhere in a playout (RAVE)
+# and start being judged by how they did when played right away. smaller trusts RAVE longer
+RAVE_BIAS = 0.002
+# playouts between checks of the clock and the stop function
+CHECK_EVERY = 32
+
+# the end states of a node, for the player who moved into it
+OPEN, WON, DRAWN = 0, 1, 2
+
+class MonteCarloTree:
+    """An anytime Monte Carlo tree search, to run next to minimax when moves must
+    be made on a strict time budget
+
+    Each playout walks down the tree picking moves by UCT with RAVE, adds the
+    children of the node it stops at, plays random moves from there to the end of
+    the game on bitboards and counts the result in every node it went through.
+    The search can be stopped after any playout and the move played most so far
+    is the answer, so a busy machine only makes the moves weaker, never late.
+
+    The tree is a set of preallocated arrays with a slot per node rather than a
+    Python object per node. The children of a node sit next to each other, so a
+    node only needs the index of its first child and how many it has. The tree is
+    kept from move to move: set_root finds the new position below the old root and
+    searches on from there with everything learned under it.
+
+    Attributes:
+        geometry: the shape of the board being searched
+        capacity: the number of nodes there is room for
+        size: the number of slots used. Slots under nodes cut off by set_root are
+            not freed until the tree is compacted
+        root: the slot of the node of the position being searched
+        ones, mask, player: the position at the root, as in BitboardConnect4
+        parent, move, first_child, child_count: the shape of the tree. move is the
+            column played into each node
+        ending: OPEN, WON or DRAWN, for the player who moved into each node
+        visits, wins: the playouts through each node, and their score for the player
+            who moved into it. A win counts 1 and a draw 0.5
+        rave_visits, rave_wins: the same for playouts in which the move into each node
+            was made by the same player at any later point
+    """
+    def __init__(self, capacity: int = CAPACITY) -> None:
+        """Initializes the instance
+
+        Args:
+            capacity: the number of nodes to make room for"""
+        self.capacity = capacity
+        self.geometry = None
+        self.allocate()
+
+    def allocate(self) -> None:
+        """Makes empty arrays for the nodes"""
+        capacity = self.capacity
+        self.parent = array('i', bytes(4 * capacity))
+        self.move = array('b', bytes(capacity))
+        self.first_child = array('i', bytes(4 * capacity))
+        self.child_count = array('b', bytes(capacity))
+        self.ending = array('b', bytes(capacity))
+        self.visits = array('i', bytes(4 * capacity))
+        self.wins = array('d', bytes(8 * capacity))
+        self.rave_visits = array('i', bytes(4 * capacity))
+        self.rave_wins = array('d', bytes(8 * capacity))
+        self.size = 0
+        self.root = -1
+
+    def reset(self, board: BitboardConnect4) -> None:
+        """Throws the tree away and starts a new one at a board"""
+        self.geometry = board.geometry
+        self.ones, self.mask, self.player = board.ones, board.mask, board.player
+        self.size = 1
+        self.root = 0
+        self.parent[0] = -1
+        self.move[0] = -1
+        self.clear(0)
+
+    def clear(self, node: int) -> None:
+        """Empties the statistics and children of a new node"""
+        self.child_count[node] = 0
+        self.ending[node] = OPEN
+        self.visits[node] = self.rave_visits[node] = 0
+        self.wins[node] = self.rave_wins[node] = 0.0
+
+    def set_root(self, board: Connect4) -> None:
+        """Moves the root to a board. If the board follows from the current root by
+        moves already in the tree, the search picks up from that node, keeping its
+        playouts. Otherwise the tree starts again
+
+        Args:
+            board: the board to search. It must not be terminal"""
+        if not isinstance(board, BitboardConnect4):
+            board = BitboardConnect4.from_board(board)
+        node = self.find(board)
+        if node is None:
+            self.reset(board)
+            return
+        self.ones, self.mask, self.player = board.ones, board.mask, board.player
+        self.root = node
+        self.parent[node] = -1
+        # most of the tree is unreachable after a few moves, so win the room back
+        if self.size > self.capacity // 2: self.compact()
+
+    def find(self, board: BitboardConnect4) -> int | None:
+        """Looks for the node of a board under the root
+
+        Returns:
+            The node, or None if it is not in the tree"""
+        if self.root < 0 or board.geometry is not self.geometry: return None
+        # pieces are only ever added, so the board has to hold every piece at the root
+        if board.mask & self.mask != self.mask or (board.ones & self.mask) != self.ones: return None
+        bottoms, columns = self.geometry.bottoms, self.geometry.columns
+        node, ones, mask, player = self.root, self.ones, self.mask, self.player
+        while mask != board.mask:
+            # a child whose piece is on the board, belonging to the player who made it
+            for child in range(self.first_child[node], self.first_child[node] + self.child_count[node]):
+                column = self.move[child]
+                cell = (mask + bottoms[column]) & columns[column]
+                if cell & board.mask and bool(cell & board.ones) == (player == 1): break
+            else:
+                return None
+            node = child
+            mask |= cell
+            if player == 1: ones |= cell
+            player = -player
+        return node if player == board.player else None
+
+    def compact(self) -> None:
+        """Copies the nodes under the root to the front of new arrays, dropping the rest"""
+        move, first_child, child_count, ending = self.move, self.first_child, self.child_count, self.ending
+        visits, wins, rave_visits, rave_wins = self.visits, self.wins, self.rave_visits, self.rave_wins
+        root = self.root
+        self.allocate()
+        # breadth first, so each node's children are given slots next to each other
+        queue = [root]
+        self.parent[0] = -1
+        index = 0
+        while index < len(queue):
+            node = queue[index]
+            self.move[index] = move[node]
+            self.child_count[index] = child_count[node]
+            self.ending[index] = ending[node]
+            self.visits[index] = visits[node]
+            self.wins[index] = wins[node]
+            self.rave_visits[index] = rave_visits[node]
+            self.rave_wins[index] = rave_wins[node]
+            if child_count[node]:
+                self.first_child[index] = len(queue)
+                for child in range(first_child[node], first_child[node] + child_count[node]):
+                    self.parent[len(queue)] = index
+                    queue.append(child)
+            index += 1
+        self.size = len(queue)
+        self.root = 0
+
+    def expand(self, node: int, ones: int, mask: int, player: int) -> bool:
+        """Adds a child for every move from a node, in center first order
+
+        Args:
+            node: the node to expand
+            ones, mask, player: its position
+
+        Returns:
+            False if there is no room left in the tree"""
+        geometry = self.geometry
+        moves = [column for column in geometry.center_order if not mask & geometry.tops[column]]
+        if self.size + len(moves) > self.capacity: return False
+        first = self.size
+        self.size += len(moves)
+        self.first_child[node] = first
+        self.child_count[node] = len(moves)
+        for child, column in enumerate(moves, first):
+            self.parent[child] = node
+            self.move[child] = column
+            self.clear(child)
+            after = mask | (mask + geometry.bottoms[column])
+            pieces = (ones if player == 1 else mask ^ ones) | (after ^ mask)
+            if geometry.is_aligned(pieces): self.ending[child] = WON
+            elif after == geometry.board_mask: self.ending[child] = DRAWN
+        return True
+
+    def search(self, time_limit: float | None = None, playouts: int | None = None, stop=None) -> int:
+        """Runs playouts from the root until the budget runs out
+
+        Args:
+            time_limit: the number of seconds to search for, or None
+            playouts: the number of playouts to run, or None. PLAYOUTS if there is
+                no limit of any kind
+            stop: a function that returns True when the search should stop, or None
+
+        Returns:
+            The number of playouts run"""
+        if time_limit is None and playouts is None and stop is None: playouts = PLAYOUTS
+        deadline = None if time_limit is None else perf_counter() + time_limit
+        count = 0
+        while playouts is None or count < playouts:
+            if count % CHECK_EVERY == 0:
+                if deadline is not None and perf_counter() >= deadline: break
+                if stop is not None and stop(): break
+            self.playout()
+            count += 1
+        return count
+
+    def playout(self) -> None:
+        """Runs one playout: down the tree, out to the end of the game at random,
+        and the result back up"""
+        geometry = self.geometry
+        bottoms, columns, tops = geometry.bottoms, geometry.columns, geometry.tops
+        bottom_mask, board_mask, is_aligned = geometry.bottom_mask, geometry.board_mask, geometry.is_aligned
+        first_child, child_count, move, ending = self.first_child, self.child_count, self.move, self.ending
+        visits, wins, rave_visits, rave_wins = self.visits, self.wins, self.rave_visits, self.rave_wins
+
+        node, ones, mask, player = self.root, self.ones, self.mask, self.player
+        # the nodes walked through and the occupied cells at each, for RAVE
+        path, masks = [node], [mask]
+        winner = None
+        while True:
+            if ending[node] == WON:
+                winner = -player
+                break
+            if ending[node] == DRAWN:
+                winner = 0
+                break
+            if not child_count[node]:
+                # a leaf is only expanded the second time it is reached
+                if visits[node] == 0 and node != self.root: break
+                if not self.expand(node, ones, mask, player): break
+            node = self.select(node)
+            column = move[node]
+            cell = (mask + bottoms[column]) & columns[column]
+            mask |= cell
+            if player == 1: ones |= cell
+            player = -player
+            path.append(node)
+            masks.append(mask)
+
+        if winner is None:
+            # random moves to the end of the game
+            while True:
+                possible = (mask + bottom_mask) & board_mask
+                if not possible:
+                    winner = 0
+                    break
+                # the kth playable cell, picked at random
+                k = int(random() * possible.bit_count())
+                while k:
+                    possible &= possible - 1
+                    k -= 1
+                cell = possible & -possible
+                mask |= cell
+                if player == 1:
+                    ones |= cell
+                    if is_aligned(ones):
+                        winner = 1
+                        break
+                elif is_aligned(mask ^ ones):
+                    winner = -1
+                    break
+                player = -player
+
+        # every piece each player has at the end, to find the moves they made later on
+        pieces = {1: ones, -1: mask ^ ones}
+        score = {winner: 1.0, -winner: 0.0} if winner else {1: 0.5, -1: 0.5}
+        mover = -self.player
+        for depth, node in enumerate(path):
+            visits[node] += 1
+            wins[node] += score[mover]
+            mover = -mover
+            # mover is now the player to move at this node. each child whose cell they
+            # filled at some point after it counts for RAVE
+            if depth + 1 == len(path) and not child_count[node]: continue
+            node_mask = masks[depth]
+            filled = pieces[mover] & ~node_mask
+            result = score[mover]
+            for child in range(first_child[node], first_child[node] + child_count[node]):
+                column = move[child]
+                if filled & (node_mask + bottoms[column]) & columns[column]:
+                    rave_visits[child] += 1
+                    rave_wins[child] += result
+
+    def select(self, node: int) -> int:
+        """Picks the child of a node to play through, by UCT with RAVE. Children that
+        have never been tried come first, in center first order"""
+        first = self.first_child[node]
+        visits, wins, rave_visits, rave_wins, ending = self.visits, self.wins, self.rave_visits, self.rave_wins, self.ending
+        log_visits = log(visits[node] or 1)
+        best, best_value = first, -1.0
+        for child in range(first, first + self.child_count[node]):
+            # a move that wins on the spot is always played
+            if ending[child] == WON: return child
+            count = visits[child]
+            if not count: return child
+            value = wins[child] / count
+            rave_count = rave_visits[child]
+            if rave_count:
+                weight = rave_count / (count + rave_count + RAVE_BIAS * count * rave_count)
+                value += weight * (rave_wins[child] / rave_count - value)
+            value += EXPLORATION * sqrt(log_visits / count)
+            if value > best_value:
+                best, best_value = child, value
+        return best
+
+    def best_move(self) -> int:
+        """Gets the move played most from the root so far. There is always one,
+        even before any playouts, as long as the root is not terminal"""
+        if not self.child_count[self.root]:
+            self.expand(self.root, self.ones, self.mask, self.player)
+        first = self.first_child[self.root]
+        children = range(first, first + self.child_count[self.root])
+        for child in children:
+            if self.ending[child] == WON: return self.move[child]
+        return self.move[max(children, key=lambda child: (self.visits[child], self.wins[child]))]
+
+    def scores(self) -> dict[int, float]:
+        """Gets the share of playouts won by the player to move after each move from
+        the root, counting draws as half, or None for a move that was never tried"""
+        first = self.first_child[self.root]
+        return {self.move[child]: self.wins[child] / self.visits[child] if self.visits[child] else None
+                for child in range(first, first + self.child_count[self.root])}
@@ -0,0 +1,201 @@
+import os
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+
+# every metric name starts with this
+PREFIX = 'connect4_bot'
+
+# the parts of a turn that are timed, in order. wait is the time spent waiting for our
+# turn, read the time from the page changing to us having it (see web.Bot.wait_for_turn),
+# parse turning the page into a board, lookup finding the move buttons, search finding
+# the move, click making it, delay the random waits that make us look human, and total
+# the time from our turn starting to our move being clicked
+PHASES = ('wait', 'read', 'parse', 'lookup', 'search', 'click', 'delay', 'total')
+
+# the upper bounds of the histogram buckets, in seconds
+TURN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+GAME_BUCKETS = (30.0, 60.0, 120.0, 300.0, 600.0, 1200.0)
+# the number of our turns in a game
+TURNS_BUCKETS = (4, 8, 12, 16, 21)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Histogram:
+    """Counts observations into buckets, the way Prometheus histograms do
+
+    Attributes:
+        buckets: the upper bound of each bucket, in increasing order
+        counts: the observations in each bucket, not counting those of the buckets below
+        total: the sum of every observation
+        count: the number of observations
+    """
+    def __init__(self, buckets: tuple) -> None:
+        """Initializes the instance
+
+        Args:
+            buckets: the upper bound of each bucket, in increasing order. Anything
+                larger goes in a last bucket with no bound"""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Counts one observation"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str = '') -> list[str]:
+        """Writes the histogram out in the Prometheus text format
+
+        Args:
+            name: the name of the metric
+            labels: labels to put on every line, like 'phase="wait"', or ''
+
+        Returns:
+            The lines, without newlines"""
+        prefix = labels + ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        braces = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{braces} {self.total}')
+        lines.append(f'{name}_count{braces} {self.count}')
+        return lines
+
+class BotMetrics:
+    """Where the time of web.Bot's turns and games goes, for Prometheus to scrape.
+    One instance can be shared by every bot in a process
+
+    Each phase of a turn (see PHASES) has a histogram of how long it took, and
+    each game has its length and number of turns counted when it ends. There are
+    counters for games finished, games aborted by the opponent, and timeouts: scripts
+    the browser never answered, and boards that never loaded. Waits that end with the
+    page unchanged are normal while the opponent thinks, so they aren't timeouts.
+
+    The metrics are written out with export, which can be called as often as wanted,
+    or served over HTTP with serve.
+
+    Attributes:
+        path: the file export writes to, or None. Written whole then renamed into
+            place, so it suits node_exporter's textfile collector
+        phases: the histogram of each phase
+        game_seconds: the histogram of the length of each game
+        game_turns: the histogram of the number of our turns in each game
+        games: the number of games finished
+        aborted: the number of games the opponent left
+        timeouts: the number of waits for the browser that failed
+        lock: keeps the metrics whole when bots in different threads update them
+        server: the HTTP server started by serve, or None
+    """
+    def __init__(self, path: str | None = None) -> None:
+        """Initializes the instance
+
+        Args:
+            path: the file export writes to, or None"""
+        self.path = path
+        self.phases = {phase: Histogram(TURN_BUCKETS) for phase in PHASES}
+        self.game_seconds = Histogram(GAME_BUCKETS)
+        self.game_turns = Histogram(TURNS_BUCKETS)
+        self.games = 0
+        self.aborted = 0
+        self.timeouts = 0
+        self.lock = Lock()
+        self.server = None
+
+    def observe(self, phase: str, seconds: float) -> None:
+        """Counts the time a phase of a turn took
+
+        Args:
+            phase: the phase (see PHASES)
+            seconds: how long it took"""
+        with self.lock:
+            self.phases[phase].observe(seconds)
+
+    def end_game(self, seconds: float, turns: int, aborted: bool = False) -> None:
+        """Counts a game once it is over
+
+        Args:
+            seconds: how long the game took, from waiting for the board to the end
+            turns: the number of moves we made
+            aborted: whether the opponent left before the end"""
+        with self.lock:
+            self.game_seconds.observe(seconds)
+            self.game_turns.observe(turns)
+            if aborted: self.aborted += 1
+            else: self.games += 1
+
+    def timeout(self) -> None:
+        """Counts a wait for the browser that failed"""
+        with self.lock:
+            self.timeouts += 1
+
+    def render(self) -> str:
+        """Writes every metric out in the Prometheus text format"""
+        lines = []
+        with self.lock:
+            lines.append(f'# HELP {PREFIX}_phase_seconds How long each phase of our turns took')
+            lines.append(f'# TYPE {PREFIX}_phase_seconds histogram')
+            for phase, histogram in self.phases.items():
+                lines.extend(histogram.lines(f'{PREFIX}_phase_seconds', f'phase="{phase}"'))
+            lines.append(f'# HELP {PREFIX}_game_seconds How long each game took')
+            lines.append(f'# TYPE {PREFIX}_game_seconds histogram')
+            lines.extend(self.game_seconds.lines(f'{PREFIX}_game_seconds'))
+            lines.append(f'# HELP {PREFIX}_game_turns The number of moves we made in each game')
+            lines.append(f'# TYPE {PREFIX}_game_turns histogram')
+            lines.extend(self.game_turns.lines(f'{PREFIX}_game_turns'))
+            counters = (('games', self.games, 'Games played to the end'),
+                        ('aborted_games', self.aborted, 'Games the opponent left'),
+                        ('timeouts', self.timeouts, 'Waits for the browser that failed'))
+            for name, value, description in counters:
+                lines.append(f'# HELP {PREFIX}_{name}_total {description}')
+                lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+                lines.append(f'{PREFIX}_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self) -> None:
+        """Writes the metrics to path, if there is one"""
+        if self.path is None: return
+        # renamed into place so a scrape never sees half a file
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            file.write(self.render())
+        os.replace(temporary, self.path)
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> None:
+        """Serves the metrics at /metrics from a background thread
+
+        Args:
+            port: the port to listen on, or 0 for any free one (see server.server_port)
+            host: the address to listen on"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass # scrapes would fill the console
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        """Writes the metrics a last time and stops serving them"""
+        self.export()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
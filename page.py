@@ -0,0 +1,49 @@
+from main import BitboardConnect4, WIDTH, HEIGHT, CONNECT
+
+# reading the game page from the snapshots web.Bot takes of it (see web.READ_PAGE).
+# kept apart from web.py so recorded snapshots can be read without a browser (see replay.py)
+
+class IncompleteBoardError(ValueError): pass # raised when the page doesn't show a whole board, like while it is drawn
+
+def parse_circle(circle_classes: list[str]) -> int | None:
+    """Takes in the circle's classes and determines what player it belongs to
+    
+    Args:
+        circle_classes: a list of the classes of a circle
+    
+    Returns:
+        an int representing the player that the piece belongs to, 0 if the peice is an empty slot
+        or None if none of the above"""
+    if 'circle-dark' in circle_classes: return -1
+    if 'circle-light' in circle_classes: return 1
+    if 'empty-slot' in circle_classes: return 0
+    return None
+
+def parse_board(cells: list[str], width: int = WIDTH, height: int = HEIGHT, connect: int = CONNECT) -> BitboardConnect4:
+    """Converts the circles on the page into a connect 4 board
+    
+    Args:
+        cells: the class attribute of every circle in the board, in page order
+        width, height: the number of columns and rows
+        connect: the number of pieces in a row that wins
+    
+    Returns:
+        The board, with player 1 to move
+
+    Raises:
+        IncompleteBoardError: there isn't a circle for every cell of the board"""
+    # determine which player occupies what square
+    circles = map(parse_circle, (cell.split() for cell in cells))
+    circles = [circle for circle in circles if circle is not None]
+    if len(circles) != width * height:
+        raise IncompleteBoardError(f'{len(circles)} circles on the page, not {width * height}')
+
+    # convert the list of circles into a state that can be used
+    board = [[] for _ in range(width)]
+    for i, player in enumerate(circles):
+        board[i % width].append(player)
+    
+    # pack it up into a connect 4 board
+    c = BitboardConnect4(width, height, connect)
+    c.state = board
+    return c
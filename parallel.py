@@ -0,0 +1,198 @@
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from main import Connect4, BitboardConnect4, SearchContext, Geometry, STANDARD
+from stats import SearchStats
+from tt import TranspositionTable
+
+class SharedTranspositionTable(TranspositionTable):
+    """A TranspositionTable stored in shared memory, so several processes can search with it at once.
+    One extra byte after the table tells helper searches when to stop
+
+    Attributes:
+        memory: the shared memory block the table lives in
+        name: the name other processes attach to the block with
+    """
+    def __init__(self, size: int = 1 << 18, name: str | None = None) -> None:
+        """Creates a new table, or attaches to one made by another process
+
+        Args:
+            size: the number of slots. Must match the table being attached to
+            name: the name of the table to attach to, or None to create a new one"""
+        if name is None:
+            # new shared memory is zero filled, which is an empty table
+            self.memory = shared_memory.SharedMemory(create=True, size=16 * size + 1)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        super().__init__(size, self.memory.buf[:16 * size])
+
+    def clear(self) -> None:
+        """Removes every entry from the table and clears the stop flag"""
+        super().clear()
+        self.memory.buf[16 * self.size] = 0
+
+    def stop_helpers(self) -> None:
+        """Tells every helper search using the table to stop"""
+        self.memory.buf[16 * self.size] = 1
+
+    def start_helpers(self) -> None:
+        """Clears the stop flag before a new search"""
+        self.memory.buf[16 * self.size] = 0
+
+    def stopping(self) -> bool:
+        """Checks if the helper searches have been told to stop"""
+        return self.memory.buf[16 * self.size] == 1
+
+    def close(self, unlink: bool = False) -> None:
+        """Detaches from the shared memory
+
+        Args:
+            unlink: also free the memory. Only the process that created the table should do this"""
+        # the views into the buffer have to be released before it can be closed
+        self.keys.release()
+        self.data.release()
+        self.buffer.release()
+        self.memory.close()
+        if unlink: self.memory.unlink()
+
+# worker pools are slow to start, so they are kept for the life of the process
+_executors: dict[int, ProcessPoolExecutor] = {}
+
+def get_executor(workers: int) -> ProcessPoolExecutor:
+    """Gets a pool of worker processes, starting one the first time a size is asked for
+
+    Args:
+        workers: the number of processes in the pool
+
+    Returns:
+        The pool"""
+    if workers not in _executors:
+        _executors[workers] = ProcessPoolExecutor(max_workers=workers)
+    return _executors[workers]
+
+@atexit.register
+def shutdown_executors() -> None:
+    """Stops every worker pool"""
+    for executor in _executors.values():
+        executor.shutdown(cancel_futures=True)
+    _executors.clear()
+
+def board_from_bits(ones: int, mask: int, player: int, geometry: Geometry = STANDARD) -> BitboardConnect4:
+    """Rebuilds a board sent to a worker as plain integers and its geometry"""
+    board = BitboardConnect4(geometry.width, geometry.height, geometry.connect)
+    board.ones, board.mask, board.moves, board.player = ones, mask, mask.bit_count(), player
+    return board
+
+def score_root_move(board: Connect4, move: int, depth: int, name: str, size: int, generation: int) -> int:
+    """Worker task for a root split search. Scores one move at the root with a full window
+
+    Args:
+        board: the root board, pickled with its class and evaluation
+        move: the move to score
+        depth: the max recursion depth below the move
+        name, size, generation: the shared transposition table to search with
+
+    Returns:
+        The score of the move"""
+    table = SharedTranspositionTable(size, name)
+    table.generation = generation
+    try:
+        context = SearchContext(table, board.player, geometry=board.geometry)
+        return board.score_move(move, depth, context, float('-inf'), float('inf'))
+    finally:
+        table.close()
+
+def helper_search(board: Connect4, moves: list[int], name: str, size: int, generation: int,
+                  max_depth: int | None = None) -> int:
+    """Worker task for a Lazy SMP search. Deepens from the root until told to stop,
+    or until it reaches max_depth, only to fill the shared transposition table for
+    the main search
+
+    Args:
+        board: the root board, pickled with its class and evaluation
+        moves: the root moves, in the order this helper should try them
+        name, size, generation: the shared transposition table to search with
+        max_depth: the deepest search to run, or None to keep going until told to stop
+
+    Returns:
+        The depth the helper finished"""
+    table = SharedTranspositionTable(size, name)
+    table.generation = generation
+    try:
+        context = SearchContext(table, board.player, geometry=board.geometry)
+        _, _, depth = board.deepen(moves, context, stop=table.stopping, max_depth=max_depth)
+        return depth
+    finally:
+        table.close()
+
+def parallel_scores(board: Connect4, moves: list[int], depth: int, workers: int,
+                    table: TranspositionTable | None = None, time_limit: float | None = None,
+                    node_limit: int | None = None, stats: SearchStats | None = None) -> list[int]:
+    """Scores the root moves with several processes sharing one transposition table
+
+    Without a time or node limit the root is split: each move is scored to the given
+    depth with a full window by whichever worker is free. Workers left over once
+    every move has one run Lazy SMP helpers up to the same depth, so a machine with
+    more cores than there are columns still puts them all to use. With a limit this is a
+    Lazy SMP search: this process runs the usual iterative deepening while the workers
+    run the same search with the root moves in different orders, filling the table
+    with positions the main search will reach.
+
+    Entries are only reused at the exact depth they were searched to, and only as
+    the bound they are stored as, so sharing the table changes how fast a score is
+    found but never the score. The scores come back in move order, so the result
+    is the same no matter which worker finishes first.
+
+    The workers are sent the board itself, so they score leaves the same way this
+    process does: with its class's temp_score and its evaluation, if it has one.
+    Its class has to be importable by the workers for that.
+
+    Args:
+        board: the board to score the moves of. It must not be terminal
+        moves: the moves to score
+        depth: the max recursion depth below each move. Ignored if there is a limit
+        workers: the number of processes to search with
+        table: a SharedTranspositionTable to keep between searches. A new one is made
+            for this search if this is None or not shared
+        time_limit: the number of seconds to search for, or None
+        node_limit: the number of nodes for this process to search, or None
+        stats: the statistics to count this process's search in, or None. Only used with a limit
+
+    Returns:
+        The score of each move"""
+    # a plain list board scores the same as a bitboard and is much slower to search.
+    # subclasses are sent as they are, since they may score leaves their own way
+    if type(board) is Connect4:
+        board = BitboardConnect4.from_board(board)
+    owned = not isinstance(table, SharedTranspositionTable)
+    if owned: table = SharedTranspositionTable()
+    table.new_search()
+    table.start_helpers()
+    shared = (table.name, table.size, table.generation)
+    executor = get_executor(workers)
+
+    try:
+        if time_limit is None and node_limit is None:
+            futures = [executor.submit(score_root_move, board, move, depth, *shared) for move in moves]
+            # the moves are queued first, so the helpers only get the workers they don't need
+            helpers = []
+            for i in range(workers - len(moves)):
+                order = moves[i % len(moves):] + moves[:i % len(moves)]
+                helpers.append(executor.submit(helper_search, board, order, *shared, depth))
+            try:
+                return [future.result() for future in futures]
+            finally:
+                table.stop_helpers()
+                for helper in helpers: helper.result()
+
+        # each helper starts from a different root move so they spread over the tree
+        helpers = [executor.submit(helper_search, board, moves[i:] + moves[:i], *shared) for i in range(1, workers)]
+        try:
+            searched, scores, _ = board.deepen(moves, SearchContext(table, board.player, stats, board.geometry), time_limit, node_limit)
+        finally:
+            table.stop_helpers()
+            for helper in helpers: helper.result()
+        return [scores[searched.index(move)] for move in moves]
+    finally:
+        if owned: table.close(unlink=True)
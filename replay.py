@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import sys
+from threading import Lock
+from time import perf_counter, time
+from uuid import uuid4
+from book import OpeningBook
+from main import Connect4
+from page import parse_board
+from session import SearchSession
+from stats import latency
+
+BOOK_PATH = 'book.bin' # made with `python book.py book.bin`, the same book web.Bot plays with
+
+# the steps of a live turn timed in each log line, in order. wait is the time spent
+# waiting for our turn, read the time from the page changing to us having it,
+# parse turning it into a board, search finding the move and click making it
+STEPS = ('wait', 'read', 'parse', 'search', 'click', 'total')
+
+class GameRecorder:
+    """Appends what web.Bot sees and does to a log, a line of JSON per event, so
+    games can be looked at and replayed later (see replay). One recorder can be
+    shared by every bot in a process
+
+    The log has a line when each game starts ({"event": "game"}), one for each of
+    our turns ({"event": "turn"}) with the snapshot of the page, the board it was
+    read as, the move we made and how long each step took (see STEPS), and one when
+    the game ends ({"event": "end"}). Lines are flushed as they are written, so a
+    crash loses nothing before it
+
+    Attributes:
+        file: the log, opened for appending
+        lock: keeps lines from different threads whole
+    """
+    def __init__(self, path: str) -> None:
+        """Opens the log
+
+        Args:
+            path: the log to append to. It is made if it doesn't exist"""
+        self.file = open(path, 'a')
+        self.lock = Lock()
+
+    def write(self, record: dict) -> None:
+        """Appends a line to the log"""
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def start_game(self, player: int, url: str) -> str:
+        """Logs the start of a game
+
+        Args:
+            player: the player we are playing as
+            url: the page the game is on
+
+        Returns:
+            The id of the game, to log its turns with"""
+        game = uuid4().hex
+        self.write({'event': 'game', 'game': game, 'time': time(), 'player': player, 'url': url})
+        return game
+
+    def record_turn(self, game: str, turn: int, snapshot: dict, board: Connect4, move: int, seconds: dict) -> None:
+        """Logs one of our turns
+
+        Args:
+            game: the id of the game from start_game
+            turn: the number of our turn in the game, from 0
+            snapshot: the page as it was when our turn started (see web.Bot.snapshot)
+            board: the board read from the snapshot, with the player to move set
+            move: the move we made
+            seconds: how long each step of the turn took (see STEPS)"""
+        self.write({
+            'event': 'turn',
+            'game': game,
+            'turn': turn,
+            'time': time(),
+            'snapshot': snapshot,
+            'board': {'ones': board.ones, 'mask': board.mask, 'player': board.player},
+            'move': move,
+            'seconds': seconds,
+        })
+
+    def end_game(self, game: str, result: str) -> None:
+        """Logs the end of a game
+
+        Args:
+            game: the id of the game from start_game
+            result: 'finished', 'aborted', or 'error' if the bot crashed"""
+        self.write({'event': 'end', 'game': game, 'time': time(), 'result': result})
+
+    def close(self) -> None:
+        """Closes the log"""
+        self.file.close()
+
+def read_log(paths: list[str]):
+    """Reads the turns from logs written by GameRecorder
+
+    Args:
+        paths: the logs to read
+
+    Yields:
+        Each turn's line, in the order they were written"""
+    for path in paths:
+        with open(path) as file:
+            for line in file:
+                if not line.strip(): continue
+                record = json.loads(line)
+                if record['event'] == 'turn': yield record
+
+def replay(turns, new_session=None) -> list[dict]:
+    """Plays logged turns again without a browser: each snapshot is read the way
+    web.Bot reads the page, and the board is searched the way the bot searches it.
+    Each game gets its own session, so its turns share a table like they did live.
+    The bot pondered on the opponent's time, which the replay can't, so turns the
+    bot answered from pondering take longer here
+
+    Args:
+        turns: the logged turns, from read_log
+        new_session: a function that makes the search session for each game, or None
+            for a SearchSession like the bot's
+
+    Returns:
+        For each turn: the game and turn, whether the snapshot read as the logged
+        board, the move found and the move made live, and how long the replay's
+        parse, search and both together took"""
+    new_session = new_session or SearchSession
+    sessions = {}
+    results = []
+    for record in turns:
+        game = record['game']
+        if game not in sessions: sessions[game] = new_session()
+        board = record['board']
+
+        start = perf_counter()
+        state = parse_board(record['snapshot']['cells'])
+        state.player = board['player']
+        parsed = perf_counter()
+        move = sessions[game].best_move(state)
+        searched = perf_counter()
+
+        results.append({
+            'game': game,
+            'turn': record['turn'],
+            'read': state.ones == board['ones'] and state.mask == board['mask'],
+            'move': move,
+            'live_move': record['move'],
+            'seconds': {'parse': parsed - start, 'search': searched - parsed, 'total': searched - start},
+        })
+    for session in sessions.values(): session.stop_pondering()
+    return results
+
+def report(turns: list[dict], results: list[dict]) -> dict:
+    """Sums up a replay
+
+    Args:
+        turns: the logged turns that were replayed
+        results: what replay found for each of them
+
+    Returns:
+        The number of games and turns, the turns whose snapshot no longer reads as the
+        logged board, the number of moves that came out differently (ties are broken
+        at random, so some always will), and the latency of each step live and replayed"""
+    return {
+        'games': len({record['game'] for record in turns}),
+        'turns': len(turns),
+        'misreads': [[result['game'], result['turn']] for result in results if not result['read']],
+        'different_moves': sum(result['move'] != result['live_move'] for result in results),
+        'live': {step: latency([record['seconds'][step] for record in turns if record['seconds'].get(step) is not None])
+                 for step in STEPS},
+        'replay': {step: latency([result['seconds'][step] for result in results]) for step in ('parse', 'search', 'total')},
+    }
+
+def regressions(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """Compares a replay against an earlier one of the same logs, like bench.regressions
+
+    Args:
+        report: the results of this replay
+        baseline: the results of the replay to compare against
+        threshold: the fraction the replayed latency can grow by before it counts as a regression
+
+    Returns:
+        A description of each regression found"""
+    found = []
+    for step, times in report['replay'].items():
+        old = baseline['replay'].get(step)
+        if old is None: continue
+        for key in ('p50', 'p90'):
+            if times[key] is None or old[key] is None: continue
+            # a millisecond of slack, since steps that quick are all noise
+            if times[key] > old[key] * (1 + threshold) + 0.001:
+                found.append(f'{step} {key}: {times[key] * 1000:.1f}ms, was {old[key] * 1000:.1f}ms')
+    if len(report['misreads']) > len(baseline['misreads']):
+        found.append(f"{len(report['misreads'])} misread snapshots, was {len(baseline['misreads'])}")
+    return found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay games logged by the web bot without a browser, timing every turn')
+    parser.add_argument('logs', nargs='+', help='logs written by the bot (see web.py --record)')
+    parser.add_argument('--depth', type=int, default=6, help='the depth to search to when there is no time limit')
+    parser.add_argument('--time', type=float, default=None, help='the number of seconds to search each move for')
+    parser.add_argument('--no-book', action='store_true', help='search every position, even those in the opening book')
+    parser.add_argument('--slowest', type=int, default=5, help='list this many of the slowest live turns')
+    parser.add_argument('--output', help='where to write the results as JSON')
+    parser.add_argument('--baseline', help='the results of an earlier replay to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='the fraction latency can grow by before failing')
+    args = parser.parse_args()
+
+    book = OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) and not args.no_book else None
+    turns = list(read_log(args.logs))
+    results = replay(turns, lambda: SearchSession(args.depth, args.time, book))
+    summary = report(turns, results)
+
+    print(f"{summary['turns']} turns from {summary['games']} games, {len(summary['misreads'])} misread, "
+          f"{summary['different_moves']} different moves")
+    for name in ('live', 'replay'):
+        for step, times in summary[name].items():
+            if times['p50'] is None: continue
+            print(f"{name:>6} {step:>6}: p50 {times['p50'] * 1000:8.1f}ms  p90 {times['p90'] * 1000:8.1f}ms  "
+                  f"p99 {times['p99'] * 1000:8.1f}ms  max {times['max'] * 1000:8.1f}ms")
+    # the slowest turns live, to look at one by one
+    by_speed = sorted(zip(turns, results), key=lambda pair: pair[0]['seconds']['total'], reverse=True)
+    for record, result in by_speed[:args.slowest]:
+        print(f"slow turn {record['game']}#{record['turn']}: {record['seconds']['total'] * 1000:.1f}ms live, "
+              f"{result['seconds']['total'] * 1000:.1f}ms replayed")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(summary, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(summary, json.load(file), args.threshold)
+        for regression in found:
+            print(f'Regression: {regression}')
+        if found: sys.exit(1)
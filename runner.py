@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from threading import Thread
+from time import perf_counter
+from book import OpeningBook
+from main import Connect4, BitboardConnect4
+from mcts import MonteCarloTree
+from metrics import BotMetrics
+from parallel import board_from_bits
+from replay import GameRecorder
+from stats import latency
+from tt import TranspositionTable
+from web import Bot, BOOK_PATH, URL
+
+# the offline stand-in for the game site (see site/connect4.html)
+SITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'site')
+
+# each engine worker keeps its table, tree and book for the life of the process
+_table = None
+_tree = None
+_book = None
+
+def engine_move(ones: int, mask: int, player: int, depth: int, time_limit: float | None, engine: str) -> int:
+    """Worker task. Finds the best move for a board sent from a browser session
+
+    Args:
+        ones, mask, player: the board (see BitboardConnect4)
+        depth: the depth to search to when there is no time limit
+        time_limit: the number of seconds to search for, or None
+        engine: the search to use (see Connect4.best_move). The mcts tree is only
+            reused when the worker's last move was for the same game
+
+    Returns:
+        The best move"""
+    global _table, _tree, _book
+    if _table is None:
+        _table = TranspositionTable(1 << 20)
+        _tree = MonteCarloTree()
+        _book = OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+    return board_from_bits(ones, mask, player).best_move(depth, _table, time_limit, engine=engine, book=_book, tree=_tree)
+
+class EnginePool:
+    """A pool of engine processes shared by every browser session. It stands in for
+    the SearchSession of every game at once, so a Bot can be given it as its session
+
+    Attributes:
+        executor: the worker processes
+        depth: the depth to search to when there is no time limit
+        time_limit: the number of seconds to search each move for, or None
+        engine: the search to use, 'minimax' or 'mcts'
+    """
+    def __init__(self, workers: int | None = None, depth: int = 6, time_limit: float | None = None,
+                 engine: str = 'minimax') -> None:
+        """Starts the workers
+
+        Args:
+            workers: the number of engine processes, or None for one per CPU
+            depth: the depth to search to when there is no time limit
+            time_limit: the number of seconds to search each move for, or None
+            engine: the search to use, 'minimax' or 'mcts'"""
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.depth = depth
+        self.time_limit = time_limit
+        self.engine = engine
+
+    def best_move(self, board: Connect4) -> int:
+        """Finds the best move on the first free worker, waiting for the answer
+
+        Args:
+            board: the board to move on. It must not be terminal
+
+        Returns:
+            The best move"""
+        if not isinstance(board, BitboardConnect4):
+            board = BitboardConnect4.from_board(board)
+        return self.executor.submit(engine_move, board.ones, board.mask, board.player, self.depth, self.time_limit,
+                                    self.engine).result()
+
+    def ponder(self, board: Connect4) -> None:
+        """Does nothing. The workers are shared, so they don't think on the opponent's time"""
+
+    def stop_pondering(self) -> None:
+        """Does nothing, see ponder"""
+
+    def shutdown(self) -> None:
+        """Stops the workers"""
+        self.executor.shutdown()
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serves files without logging every request"""
+    def log_message(self, format, *args) -> None:
+        pass
+
+def serve_site(port: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    """Serves the offline test site in a background thread
+
+    Args:
+        port: the port to serve on, or 0 for any free port
+
+    Returns:
+        The server and the url of its lobby"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), partial(QuietHandler, directory=SITE))
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/connect4.html'
+
+def play_session(index: int, url: str, games: int, pool: EnginePool, headless: bool, profiles: str | None,
+                 block_ads: bool, delays: bool, recorder: GameRecorder | None = None,
+                 metrics: BotMetrics | None = None) -> Bot:
+    """Opens one browser and plays games back to back in it
+
+    Args:
+        index: the number of the session, which picks its profile directory
+        url: the lobby of the site to play on
+        games: the number of games to play
+        pool: the engines to search with
+        headless, block_ads, delays: see Bot
+        profiles: a directory to keep each session's browser profile in, or None for fresh ones
+        recorder: logs every turn of every session, or None
+        metrics: the metrics shared by every session, or None for the bot's own
+
+    Returns:
+        The bot, with the results of its games"""
+    profile = None if profiles is None else os.path.join(profiles, f'session-{index}')
+    bot = Bot(url, headless, profile, block_ads, delays, verbose=False, new_session=lambda: pool,
+              recorder=recorder, metrics=metrics)
+    try:
+        bot.play(games)
+    finally:
+        bot.quit()
+    return bot
+
+def run(url: str, sessions: int, games: int, workers: int | None = None, depth: int = 6,
+        time_limit: float | None = None, headless: bool = True, profiles: str | None = None,
+        block_ads: bool = True, delays: bool = False, record: str | None = None, engine: str = 'minimax',
+        metrics: BotMetrics | None = None) -> dict:
+    """Plays games in several browsers at once, all searching with one pool of engines
+
+    Args:
+        url: the lobby of the site to play on
+        sessions: the number of browsers to play in at once
+        games: the number of games each browser plays
+        workers: the number of engine processes, or None for one per CPU
+        depth: the depth to search to when there is no time limit
+        time_limit: the number of seconds to search each move for, or None
+        headless, block_ads, delays: see Bot
+        profiles: a directory to keep each session's browser profile in, or None for fresh ones
+        record: a log to append every turn of every session to, for replay.py, or None
+        engine: the search to use, 'minimax' or 'mcts', which keeps to the time limit
+            however busy the machine is
+        metrics: the metrics every session times its turns and games in, or None for new ones
+
+    Returns:
+        The results: games finished and aborted, waits that timed out, games per hour and move latency"""
+    pool = EnginePool(workers, depth, time_limit, engine)
+    metrics = metrics or BotMetrics()
+    recorder = None if record is None else GameRecorder(record)
+    start = perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=sessions) as threads:
+            futures = [threads.submit(play_session, index, url, games, pool, headless, profiles, block_ads, delays,
+                                      recorder, metrics)
+                       for index in range(sessions)]
+            bots = [future.result() for future in futures]
+    finally:
+        pool.shutdown()
+        if recorder is not None: recorder.close()
+    seconds = perf_counter() - start
+
+    played = sum(bot.games_played for bot in bots)
+    times = [time for bot in bots for time in bot.move_times]
+    return {
+        'sessions': sessions,
+        'games': played,
+        'aborted': sum(bot.games_aborted for bot in bots),
+        'timeouts': metrics.timeouts,
+        'seconds': seconds,
+        'games_per_hour': played * 3600 / seconds,
+        'moves': len(times),
+        'latency': latency(times),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play games in several browsers at once and measure throughput')
+    parser.add_argument('--local', action='store_true', help='play against the offline test site instead of the real one')
+    parser.add_argument('--url', default=URL, help='the lobby of the site to play on')
+    parser.add_argument('--sessions', type=int, default=2, help='the number of browsers to play in at once')
+    parser.add_argument('--games', type=int, default=5, help='the number of games each browser plays')
+    parser.add_argument('--workers', type=int, default=None, help='the number of engine processes')
+    parser.add_argument('--depth', type=int, default=6, help='the depth to search to when there is no time limit')
+    parser.add_argument('--time', type=float, default=None, help='the number of seconds to search each move for')
+    parser.add_argument('--engine', choices=['minimax', 'mcts'], default='minimax', help='the search to use')
+    parser.add_argument('--window', action='store_true', help='show the browsers instead of running them headless')
+    parser.add_argument('--profiles', help='a directory to keep each browser profile in between runs')
+    parser.add_argument('--human-delays', action='store_true', help='wait a random time before acting, like Bot does on its own')
+    parser.add_argument('--opponent-delay', type=int, default=200, help='milliseconds the test site opponent thinks for')
+    parser.add_argument('--abort', type=float, default=0.0, help='the chance the test site opponent leaves after each move')
+    parser.add_argument('--record', help='a log to append every turn to, for replay.py')
+    parser.add_argument('--metrics', help='a file to write Prometheus metrics to after every game')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics at /metrics on this local port')
+    parser.add_argument('--output', help='where to write the results as JSON')
+    args = parser.parse_args()
+
+    url = args.url
+    if args.local:
+        server, url = serve_site()
+        url += f'?delay={args.opponent_delay}&abort={args.abort}'
+    metrics = BotMetrics(args.metrics)
+    if args.metrics_port is not None: metrics.serve(args.metrics_port)
+    try:
+        report = run(url, args.sessions, args.games, args.workers, args.depth, args.time, not args.window,
+                     args.profiles, block_ads=not args.local, delays=args.human_delays, record=args.record,
+                     engine=args.engine, metrics=metrics)
+    finally:
+        metrics.close()
+
+    latency = report['latency']
+    print(f"{report['games']} games ({report['aborted']} aborted, {report['timeouts']} timeouts) in {report['seconds']:.1f}s: {report['games_per_hour']:.0f} games/hour")
+    if report['moves']:
+        print(f"{report['moves']} moves: p50 {latency['p50'] * 1000:.0f}ms, p90 {latency['p90'] * 1000:.0f}ms, "
+              f"p99 {latency['p99'] * 1000:.0f}ms, max {latency['max'] * 1000:.0f}ms")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
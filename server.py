@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from book import OpeningBook
+from main import Connect4, BitboardConnect4, SearchContext, STANDARD, SOLVE_EMPTY_CELLS
+from solver import Solver
+from tt import TranspositionTable
+
+class SearchCancelled(Exception): pass # raised when the server drops a request instead of answering it
+
+BOOK_PATH = 'book.bin' # made with `python book.py book.bin`
+ADDRESS = '127.0.0.1:7474'
+
+# The protocol is one JSON object per line each way. A search request looks like
+#   {"id": 1, "moves": "3324", "depth": 8, "priority": 0, "game": "a"}
+# where the board is either the columns played from the start (moves) or a bitboard
+# ("ones", "mask" and "player", see BitboardConnect4). The budget is a depth, or a
+# time in seconds and/or a number of nodes ("time", "nodes"). Lower priorities are
+# searched first. The answer echoes the id:
+#   {"id": 1, "move": 3, "score": 5, "depth": 8, "source": "search", "seconds": 0.41}
+# A request can be dropped with {"cancel": 1}, and every request of a game with
+# {"cancel_game": "a"}. A dropped request is answered with {"id": 1, "cancelled": true}
+
+def parse_address(address: str) -> tuple[str, int] | str:
+    """Parses a server address: a path for a Unix socket, or host:port for TCP"""
+    if '/' in address: return address
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+def parse_board(request: dict) -> BitboardConnect4:
+    """Reads the board of a search request (see the protocol above)
+
+    Raises:
+        ValueError: the request has no board, or an illegal one"""
+    if 'moves' in request:
+        board = BitboardConnect4()
+        for move in str(request['moves']):
+            if not move.isdigit() or not board.is_valid_move(int(move)): raise ValueError(f'invalid move {move}')
+            board.make_move(int(move))
+        return board
+    if 'mask' in request:
+        return BitboardConnect4.from_bits(int(request['ones']), int(request['mask']), int(request['player']))
+    raise ValueError('the request has no board')
+
+class Job:
+    """A search waiting in the queue or running, with everyone waiting for its answer.
+    Identical requests share one job
+
+    Attributes:
+        board: the board to search
+        depth: the depth to search to when there is no time or node limit
+        time_limit: the number of seconds to search for, or None
+        node_limit: the number of nodes to search, or None
+        waiters: the (connection, request id, game) of each request waiting for the answer
+        running: whether the engine has started on the job
+        cancelled: whether everyone waiting has gone, so the search should stop
+    """
+    def __init__(self, board: BitboardConnect4, depth: int, time_limit: float | None, node_limit: int | None) -> None:
+        """Initializes the instance"""
+        self.board = board
+        self.depth = depth
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.waiters = []
+        self.running = False
+        self.cancelled = False
+
+    def key(self) -> tuple:
+        """Identifies the search, so identical requests can be answered by one job"""
+        return self.board.ones, self.board.mask, self.board.player, self.depth, self.time_limit, self.node_limit
+
+class EngineServer:
+    """Serves searches to any number of clients from one warm engine
+
+    Every search shares one transposition table, opening book and endgame solver,
+    which stay warm for as long as the server runs. Searches run one at a time on
+    a single engine thread (the search is pure Python, so more threads would only
+    take turns). Requests wait in a priority queue, identical requests share
+    one search, and a request whose game has ended can be cancelled even mid-search.
+
+    Attributes:
+        table: the transposition table shared by every search
+        book: the opening book, or None
+        solver: solves endgames exactly (see SOLVE_EMPTY_CELLS)
+        queue: the jobs waiting for the engine, by priority then arrival
+        jobs: the unfinished job for each search, to share between identical requests
+        searches: the number of searches run so far
+    """
+    def __init__(self, table_size: int = 1 << 22, book: OpeningBook | None = None) -> None:
+        """Initializes the instance
+
+        Args:
+            table_size: the number of slots in the transposition table
+            book: the opening book to look positions up in, or None"""
+        self.table = TranspositionTable(table_size)
+        self.book = book
+        self.solver = Solver(table_size)
+        self.queue = None # made on the event loop in serve
+        self.jobs = {}
+        self.searches = 0
+        self.order = itertools.count()
+        self.engine = ThreadPoolExecutor(max_workers=1)
+
+    async def serve(self, address: str) -> None:
+        """Accepts clients until cancelled
+
+        Args:
+            address: a path for a Unix socket, or host:port for TCP"""
+        self.queue = asyncio.PriorityQueue()
+        parsed = parse_address(address)
+        if isinstance(parsed, str):
+            if os.path.exists(parsed): os.remove(parsed)
+            server = await asyncio.start_unix_server(self.handle, parsed)
+        else:
+            server = await asyncio.start_server(self.handle, *parsed)
+        worker = asyncio.create_task(self.run_jobs())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Reads requests from one client until it disconnects"""
+        try:
+            while line := await reader.readline():
+                if not line.strip(): continue
+                request = None
+                try:
+                    request = json.loads(line)
+                    if 'cancel' in request: self.cancel(lambda waiter: waiter[0] is writer and waiter[1] == request['cancel'])
+                    elif 'cancel_game' in request: self.cancel(lambda waiter: waiter[2] == request['cancel_game'])
+                    else: self.submit(request, writer)
+                except (ValueError, KeyError, TypeError) as error:
+                    self.send(writer, {'id': request.get('id') if isinstance(request, dict) else None, 'error': str(error)})
+        finally:
+            # nobody is left to answer
+            self.cancel(lambda waiter: waiter[0] is writer, notify=False)
+            writer.close()
+
+    def send(self, writer: asyncio.StreamWriter, message: dict) -> None:
+        """Writes one message to a client, unless it has gone"""
+        if not writer.is_closing():
+            writer.write(json.dumps(message).encode() + b'\n')
+
+    def submit(self, request: dict, writer: asyncio.StreamWriter) -> None:
+        """Queues a search request, joining an identical one if there is one
+
+        Raises:
+            ValueError: the request is not a valid search"""
+        board = parse_board(request)
+        if board.is_terminal(): raise ValueError('the game is over')
+        time_limit = None if request.get('time') is None else float(request['time'])
+        node_limit = None if request.get('nodes') is None else int(request['nodes'])
+        job = Job(board, int(request.get('depth', 6)), time_limit, node_limit)
+        job = self.jobs.setdefault(job.key(), job)
+        job.waiters.append((writer, request.get('id'), request.get('game')))
+        # a job already queued is queued again if this request is more urgent. the
+        # engine skips it the second time it comes out
+        if not job.running:
+            self.queue.put_nowait((int(request.get('priority', 0)), next(self.order), job))
+
+    def cancel(self, matches, notify: bool = True) -> None:
+        """Drops every waiting request that matches, stopping searches nobody is waiting for
+
+        Args:
+            matches: a function that takes a (connection, request id, game) and returns True to drop it
+            notify: tell the clients their requests were dropped"""
+        for key, job in list(self.jobs.items()):
+            dropped = [waiter for waiter in job.waiters if matches(waiter)]
+            if not dropped: continue
+            job.waiters = [waiter for waiter in job.waiters if not matches(waiter)]
+            if notify:
+                for writer, id, _ in dropped: self.send(writer, {'id': id, 'cancelled': True})
+            if not job.waiters:
+                job.cancelled = True
+                del self.jobs[key]
+
+    async def run_jobs(self) -> None:
+        """Feeds queued jobs to the engine thread one at a time, most urgent first"""
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self.queue.get()
+            if job.cancelled or job.running: continue
+            job.running = True
+            try:
+                answer = await loop.run_in_executor(self.engine, self.search, job)
+            except Exception as error:
+                answer = {'error': str(error)}
+            if self.jobs.get(job.key()) is job: del self.jobs[job.key()]
+            if job.cancelled: continue
+            for writer, id, _ in job.waiters:
+                self.send(writer, {'id': id, **answer})
+
+    def search(self, job: Job) -> dict:
+        """Searches a job on the engine thread
+
+        Returns:
+            The answer: the move, its score, the depth searched, where the move came
+            from ('book', 'solver' or 'search') and the seconds it took"""
+        start = perf_counter()
+        board = job.board
+        self.searches += 1
+        if self.book is not None:
+            entry = self.book.lookup(board)
+            if entry is not None:
+                score, move = entry
+                return {'move': move, 'score': score, 'depth': None, 'source': 'book', 'seconds': perf_counter() - start}
+
+        empty = board.geometry.cells - board.moves
+        if board.geometry is STANDARD and empty <= SOLVE_EMPTY_CELLS:
+            moves = board.valid_moves()
+            scores = [score * board.player for score in self.solver.score_moves(board, moves)]
+            source, depth = 'solver', empty
+        else:
+            self.table.new_search()
+            context = SearchContext(self.table, board.player, geometry=board.geometry)
+            moves = [move for move in board.geometry.center_order if board.has_space(move)]
+            stop = lambda: job.cancelled
+            if job.time_limit is None and job.node_limit is None:
+                moves, scores, depth = board.deepen(moves, context, stop=stop, max_depth=job.depth)
+            else:
+                moves, scores, depth = board.deepen(moves, context, job.time_limit, job.node_limit, stop)
+            source = 'search'
+        move = board.pick_best(moves, scores)
+        return {'move': move, 'score': scores[moves.index(move)], 'depth': depth, 'source': source,
+                'seconds': perf_counter() - start}
+
+class EngineClient:
+    """A blocking connection to an EngineServer, for bots and scripts
+
+    Attributes:
+        connection: the socket connected to the server
+        file: the socket's lines
+    """
+    def __init__(self, address: str = ADDRESS) -> None:
+        """Connects to a server
+
+        Args:
+            address: a path for a Unix socket, or host:port for TCP"""
+        parsed = parse_address(address)
+        if isinstance(parsed, str):
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connection.connect(parsed)
+        self.file = self.connection.makefile('rwb')
+        self.ids = itertools.count()
+
+    def request(self, message: dict) -> dict:
+        """Sends a search request and waits for its answer
+
+        Args:
+            message: the request, without an id (see the protocol above)
+
+        Returns:
+            The answer
+
+        Raises:
+            RuntimeError: the server couldn't search the request"""
+        message = {**message, 'id': next(self.ids)}
+        self.file.write(json.dumps(message).encode() + b'\n')
+        self.file.flush()
+        while line := self.file.readline():
+            answer = json.loads(line)
+            # answers to requests that were given up on can still arrive
+            if answer.get('id') != message['id']: continue
+            if 'error' in answer: raise RuntimeError(answer['error'])
+            return answer
+        raise ConnectionError('the server closed the connection')
+
+    def best_move(self, board: Connect4, depth: int = 6, time_limit: float | None = None,
+                  node_limit: int | None = None, priority: int = 0, game: str | None = None) -> int:
+        """Asks the server for the best move
+
+        Args:
+            board: the board to move on. It must not be terminal
+            depth: the depth to search to when there is no time or node limit
+            time_limit: the number of seconds to search for, or None
+            node_limit: the number of nodes to search, or None
+            priority: lower numbers are searched first
+            game: the game the board is from, so its searches can be cancelled together
+
+        Returns:
+            The best move
+
+        Raises:
+            SearchCancelled: the request was cancelled before it was searched, which
+                happens once its game is over"""
+        if not isinstance(board, BitboardConnect4):
+            board = BitboardConnect4.from_board(board)
+        answer = self.request({'ones': board.ones, 'mask': board.mask, 'player': board.player, 'depth': depth,
+                               'time': time_limit, 'nodes': node_limit, 'priority': priority, 'game': game})
+        if answer.get('cancelled'): raise SearchCancelled()
+        return answer['move']
+
+    def cancel_game(self, game: str) -> None:
+        """Drops every waiting request of a game"""
+        self.file.write(json.dumps({'cancel_game': game}).encode() + b'\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        """Disconnects from the server"""
+        self.file.close()
+        self.connection.close()
+
+class RemoteSession:
+    """Searches one game on an EngineServer. It can stand in for a SearchSession,
+    for example as what web.Bot's new_session makes
+
+    Attributes:
+        client: the connection to the server
+        game: the name of the game, to cancel its searches once it ends
+        depth, time_limit: the budget of each search (see EngineClient.best_move)
+    """
+    def __init__(self, client: EngineClient, game: str, depth: int = 6, time_limit: float | None = None) -> None:
+        """Initializes the instance"""
+        self.client = client
+        self.game = game
+        self.depth = depth
+        self.time_limit = time_limit
+
+    def best_move(self, board: Connect4) -> int:
+        """Asks the server for the best move
+
+        Raises:
+            SearchCancelled: the game's searches were cancelled"""
+        return self.client.best_move(board, self.depth, self.time_limit, game=self.game)
+
+    def ponder(self, board: Connect4) -> None:
+        """Does nothing. The server's table stays warm between turns instead"""
+
+    def stop_pondering(self) -> None:
+        """Cancels anything still waiting for this game. Called once the game ends"""
+        self.client.cancel_game(self.game)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve Connect4 searches over JSON lines')
+    parser.add_argument('--address', default=ADDRESS, help='host:port to listen on, or a path for a Unix socket')
+    parser.add_argument('--table-size', type=int, default=1 << 22, help='the number of slots in the transposition table')
+    args = parser.parse_args()
+
+    book = OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+    print(f'Serving on {args.address}')
+    try:
+        asyncio.run(EngineServer(args.table_size, book).serve(args.address))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,166 @@
+import threading
+from main import Connect4, BitboardConnect4, SearchContext, SearchTimeout, STANDARD, SOLVE_EMPTY_CELLS
+from mcts import MonteCarloTree
+from solver import Solver
+from stats import SearchStats
+from tt import TranspositionTable
+
+class SearchSession:
+    """Searches for one side of a whole game
+
+    The transposition table is kept from move to move, so positions searched on
+    one turn don't have to be searched again on the next. While the opponent is
+    thinking, a background thread searches our answer to each of their likely
+    replies. When the real reply comes in and it was searched deeply enough, the
+    move is returned straight away, and if not the search picks up from a warm table.
+
+    With the mcts engine the Monte Carlo tree is kept instead, and pondering runs
+    playouts from the position after our move, which grows the tree under every
+    reply at once. Whatever reply comes in, its playouts are already in the tree.
+
+    Attributes:
+        recursion_depth: the depth to search to when there is no time limit
+        time_limit: the number of seconds to search for on each turn, or None
+        book: a book.OpeningBook to look positions up in before searching, or None
+        table: the transposition table shared by every search in the session
+        pondered: our scored moves for each reply searched while pondering, by position
+        ponder_hits: the number of turns answered straight from pondering
+        solver: solves the endgame exactly once SOLVE_EMPTY_CELLS or fewer cells are left,
+            keeping its table from move to move
+        tree: the mcts.MonteCarloTree kept from move to move, or None for minimax
+    """
+    def __init__(self, recursion_depth: int = 6, time_limit: float | None = None, book=None,
+                 table_size: int = 1 << 20, engine: str = 'minimax') -> None:
+        """Initializes the instance
+
+        Args:
+            recursion_depth: the depth to search to when there is no time limit
+            time_limit: the number of seconds to search for on each turn, or None
+            book: a book.OpeningBook to look positions up in before searching, or None
+            table_size: the number of slots in the transposition table
+            engine: 'minimax', or 'mcts' to search with Monte Carlo tree search, running
+                mcts.PLAYOUTS playouts a turn when there is no time limit"""
+        self.recursion_depth = recursion_depth
+        self.time_limit = time_limit
+        self.book = book
+        self.table = TranspositionTable(table_size)
+        self.pondered = {}
+        self.ponder_hits = 0
+        self.solver = Solver(table_size)
+        self.tree = MonteCarloTree() if engine == 'mcts' else None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def best_move(self, board: Connect4, stats: SearchStats | None = None) -> int:
+        """Finds the best move for the player to move, using anything learned while pondering
+
+        Args:
+            board: the board to move on. It must not be terminal
+            stats: the statistics to count the search in, or None
+
+        Returns:
+            The best move"""
+        self.stop_pondering()
+        # the book and the solver only know the standard board
+        standard = board.geometry is STANDARD
+        if self.book is not None and standard:
+            entry = self.book.lookup(board)
+            if entry is not None: return entry[1]
+
+        if not isinstance(board, BitboardConnect4):
+            board = BitboardConnect4.from_board(board)
+        move = board.forced_move()
+        if move is not None:
+            self.pondered.clear()
+            return move
+        if standard and board.geometry.cells - board.moves <= SOLVE_EMPTY_CELLS:
+            moves = board.valid_moves()
+            return board.pick_best(moves, [score * board.player for score in self.solver.score_moves(board, moves)])
+
+        if self.tree is not None:
+            self.tree.set_root(board)
+            self.tree.search(self.time_limit)
+            return self.tree.best_move()
+
+        moves, scores, depth = self.pondered.get(position_key(board), (None, None, -1))
+        self.pondered.clear()
+        if self.time_limit is None and depth >= self.recursion_depth:
+            self.ponder_hits += 1
+            return board.pick_best(moves, scores)
+
+        self.table.new_search()
+        context = SearchContext(self.table, board.player, stats, board.geometry)
+        if moves is None: moves = [move for move in board.geometry.center_order if board.has_space(move)]
+        if self.time_limit is None:
+            moves, scores, _ = board.deepen(moves, context, max_depth=self.recursion_depth)
+        else:
+            moves, scores, _ = board.deepen(moves, context, self.time_limit)
+        return board.pick_best(moves, scores)
+
+    def ponder(self, board: Connect4) -> None:
+        """Starts searching our answers to the opponent's replies in the background
+
+        Args:
+            board: the board after our move, with the opponent to move"""
+        self.stop_pondering()
+        if board.is_terminal(): return
+        # our answer will be solved, which is quicker than pondering would be
+        if board.geometry is STANDARD and board.geometry.cells - board.moves - 1 <= SOLVE_EMPTY_CELLS: return
+        if not isinstance(board, BitboardConnect4):
+            board = BitboardConnect4.from_board(board)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run_ponder, args=(board.clone(),), daemon=True)
+        self.thread.start()
+
+    def stop_pondering(self) -> None:
+        """Stops the background search and waits for it to finish"""
+        if self.thread is None: return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def run_ponder(self, board: BitboardConnect4) -> None:
+        """The background search started by ponder. The likely replies are found with a
+        shallow search from the opponent's side, then our answer to every reply is
+        deepened one level at a time, most likely reply first, until told to stop.
+        With mcts, playouts are run from the board until told to stop
+
+        Args:
+            board: the board after our move, with the opponent to move"""
+        stop = self.stop_event.is_set
+        if self.tree is not None:
+            self.tree.set_root(board)
+            self.tree.search(stop=stop)
+            return
+        try:
+            geometry = board.geometry
+            replies = [move for move in geometry.center_order if board.has_space(move)]
+            replies, _, _ = board.deepen(replies, SearchContext(self.table, board.player, geometry=geometry), stop=stop,
+                                         max_depth=2)
+
+            # the boards we could have to answer, with the state of their searches
+            searches = []
+            for reply in replies:
+                child = board.clone()
+                child.drop(reply)
+                if child.last_move_won(reply) or child.is_full(): continue
+                context = SearchContext(self.table, child.player, geometry=geometry)
+                context.set_budget(None, None, stop)
+                searches.append((child, [move for move in geometry.center_order if child.has_space(move)], context))
+
+            end = geometry.cells - board.moves - 1
+            if self.time_limit is None: end = min(end, self.recursion_depth + 1)
+            for depth in range(end):
+                for child, moves, context in searches:
+                    scores = child.score_moves(moves, depth, context)
+                    # search the best move first on the next pass
+                    best = max(range(len(moves)), key=lambda x: scores[x] * child.player)
+                    moves.insert(0, moves.pop(best))
+                    scores.insert(0, scores.pop(best))
+                    self.pondered[position_key(child)] = (moves[:], scores, depth)
+        except SearchTimeout:
+            pass
+
+def position_key(board: BitboardConnect4) -> tuple[int, int]:
+    """Gets a key that is unique to a board and the player to move"""
+    return board.keys()[0], board.player
@@ -0,0 +1,157 @@
+from main import Connect4, BitboardConnect4, CENTER_ORDER, WIDTH, HEIGHT, BOTTOM_MASK, BOARD_MASK, STANDARD, column_mask
+from tt import TranspositionTable, LOWER, UPPER
+
+CELLS = WIDTH * HEIGHT
+# the best score a position can have: a win with the first piece
+MAX_SCORE = (CELLS + 1) // 2
+# the threat finding the search uses too, on the one board the solver knows
+winning_cells = STANDARD.winning_cells
+non_losing_cells = STANDARD.non_losing_cells
+
+def plies_to_end(score: int, moves: int) -> int:
+    """Converts an exact score into the number of moves left until the game ends
+
+    Args:
+        score: a score from solve, for the player to move
+        moves: the number of pieces on the board
+
+    Returns:
+        The number of moves left, counting the winning move. For a draw, the moves
+        left until the board is full"""
+    # the winner's piece number that wins, less the pieces they have already played
+    if score > 0: return 2 * (MAX_SCORE + 1 - score - moves // 2) - 1
+    if score < 0: return 2 * (MAX_SCORE + 1 + score - (moves + 1) // 2)
+    return CELLS - moves
+
+class Solver:
+    """Solves positions exactly, by searching every line to the end of the game
+
+    Scores are from the side of the player to move. A win scores more the sooner it
+    comes, a loss less, and a draw scores 0. The score is the number of pieces the
+    winner has left when they win, counting the winning piece. So a win with the next
+    move on an empty board scores 21, and a loss to the opponent's last piece scores -1
+    (see plies_to_end).
+
+    Finding the exact score is a series of null window searches. Each one only checks
+    whether the score is above a guess, which prunes far more than a full window.
+    A binary search on the guess narrows down the score. Only moves that don't lose
+    straight away are searched, and moves that make the most new threats go first.
+
+    Attributes:
+        table: the transposition table, keeping bounds from one search to the next
+        nodes: the number of positions searched so far
+    """
+    def __init__(self, table_size: int = 1 << 20) -> None:
+        """Initializes the instance
+
+        Args:
+            table_size: the number of slots in the transposition table"""
+        self.table = TranspositionTable(table_size)
+        self.nodes = 0
+
+    def negamax(self, position: int, mask: int, moves: int, alpha: int, beta: int) -> int:
+        """Scores a position within a window. The player to move must not have a winning move
+
+        Args:
+            position: a bitboard of the pieces of the player to move
+            mask: a bitboard of every occupied cell
+            moves: the number of pieces on the board
+            alpha: the score the player to move is already sure of
+            beta: the score the opponent is already sure of
+
+        Returns:
+            The exact score if it is inside the window, otherwise a bound past the window edge"""
+        self.nodes += 1
+        possible = non_losing_cells(position, mask)
+        if possible == 0: return -((CELLS - moves) // 2)
+        if moves >= CELLS - 2: return 0 # no one can win with the last two pieces
+
+        # the opponent can't win with their next piece, and we can't with this one
+        low = -((CELLS - 2 - moves) // 2)
+        if alpha < low:
+            alpha = low
+            if alpha >= beta: return alpha
+        high = (CELLS - 1 - moves) // 2
+
+        key = position + mask
+        entry = self.table.probe(key)
+        if entry is not None:
+            score, _, flag, _ = entry
+            if flag == LOWER:
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta: return alpha
+            elif score < high:
+                high = score
+        if beta > high:
+            beta = high
+            if alpha >= beta: return beta
+
+        # the moves that leave us the most ways to win go first
+        ordered = []
+        for column in CENTER_ORDER:
+            move = possible & column_mask(column)
+            if move:
+                ordered.append((-winning_cells(position | move, mask).bit_count(), len(ordered), move))
+        ordered.sort()
+
+        opponent = position ^ mask
+        for _, _, move in ordered:
+            score = -self.negamax(opponent, mask | move, moves + 1, -beta, -alpha)
+            if score >= beta:
+                self.table.store(key, score, 0, LOWER, -1)
+                return score
+            if score > alpha: alpha = score
+        self.table.store(key, alpha, 0, UPPER, -1)
+        return alpha
+
+    def solve(self, board: Connect4) -> int:
+        """Finds the exact score of a board for the player to move. The board must not be terminal
+
+        Args:
+            board: the board to solve
+
+        Returns:
+            The score (see Solver)"""
+        if not isinstance(board, BitboardConnect4):
+            board = BitboardConnect4.from_board(board)
+        position = board.ones if board.player == 1 else board.ones ^ board.mask
+        mask = board.mask
+        possible = (mask + BOTTOM_MASK) & BOARD_MASK
+        if winning_cells(position, mask) & possible:
+            return (CELLS + 1 - board.moves) // 2
+
+        low = -((CELLS - board.moves) // 2)
+        high = (CELLS + 1 - board.moves) // 2
+        while low < high:
+            # guesses near 0 first, since most positions are close to a draw
+            guess = low + (high - low) // 2
+            if guess <= 0 and low // 2 < guess: guess = low // 2
+            elif guess >= 0 and high // 2 > guess: guess = high // 2
+            score = self.negamax(position, mask, board.moves, guess, guess + 1)
+            if score <= guess: high = score
+            else: low = score
+        return low
+
+    def score_moves(self, board: Connect4, moves: list[int]) -> list[int]:
+        """Finds the exact score of each move, for the player making it
+
+        Args:
+            board: the board to move on. It must not be terminal
+            moves: the moves to score
+
+        Returns:
+            The score of each move (see Solver)"""
+        if not isinstance(board, BitboardConnect4):
+            board = BitboardConnect4.from_board(board)
+        board = board.clone()
+        scores = []
+        for move in moves:
+            board.drop(move)
+            try:
+                if board.last_move_won(move): scores.append((CELLS + 2 - board.moves) // 2)
+                elif board.is_full(): scores.append(0)
+                else: scores.append(-self.solve(board))
+            finally:
+                board.undo(move)
+        return scores
@@ -0,0 +1,121 @@
+import json
+from time import perf_counter
+
+class SearchStats:
+    """Counts what a search does, to see where the time of a turn goes. Pass one to
+    Connect4.best_move. A search without one only pays for a None check
+
+    Attributes:
+        iterations: a dictionary for each finished search depth with its depth, nodes and seconds
+        tt_probes: the number of transposition table lookups
+        tt_hits: the number of lookups that found the position
+        tt_stores: the number of positions saved to the table
+        cutoffs: the number of beta cutoffs
+        first_move_cutoffs: the number of cutoffs caused by the first move searched
+        leaves: the number of boards scored by the evaluation function
+        on_iteration: a function called with each iteration's dictionary as it finishes, or None
+        trace: record trace events that can be loaded into a profiler
+        events: the recorded trace events, in the Chrome trace event format
+    """
+    def __init__(self, on_iteration=None, trace: bool = False) -> None:
+        """Initializes the instance
+
+        Args:
+            on_iteration: a function called with each iteration's dictionary as it finishes, or None
+            trace: record a trace span for every iteration and root move"""
+        self.iterations = []
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_stores = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.leaves = 0
+        self.on_iteration = on_iteration
+        self.trace = trace
+        self.events = []
+        self.started = perf_counter()
+        self.iteration_start = None
+        self.iteration_nodes = 0
+
+    def span(self, name: str, start: float, **args) -> None:
+        """Records a trace span that ends now. Does nothing unless tracing
+
+        Args:
+            name: the name to show for the span
+            start: the perf_counter time the span started at
+            args: extra values to show with the span"""
+        if self.trace:
+            now = perf_counter()
+            self.events.append({'name': name, 'ph': 'X', 'ts': (start - self.started) * 1e6,
+                                'dur': (now - start) * 1e6, 'pid': 0, 'tid': 0, 'args': args})
+
+    def start_iteration(self, depth: int, nodes: int) -> None:
+        """Marks the start of a search to a given depth
+
+        Args:
+            depth: the depth being searched to
+            nodes: the number of nodes the search had visited before this iteration"""
+        self.iteration_start = perf_counter()
+        self.iteration_nodes = nodes
+
+    def finish_iteration(self, depth: int, nodes: int) -> None:
+        """Marks the end of a search to a given depth
+
+        Args:
+            depth: the depth that was searched to
+            nodes: the number of nodes the search has visited so far"""
+        iteration = {'depth': depth, 'nodes': nodes - self.iteration_nodes, 'seconds': perf_counter() - self.iteration_start}
+        self.span(f'depth {depth}', self.iteration_start, nodes=iteration['nodes'])
+        self.iterations.append(iteration)
+        if self.on_iteration is not None:
+            self.on_iteration(iteration)
+
+    def branching_factors(self) -> list[float]:
+        """Gets the effective branching factor of each iteration: how many times more
+        nodes it took than the one before"""
+        return [new['nodes'] / old['nodes'] for old, new in zip(self.iterations, self.iterations[1:]) if old['nodes']]
+
+    def summary(self) -> dict:
+        """Gets every statistic in a dictionary, ready to be logged or written as JSON"""
+        return {
+            'iterations': self.iterations,
+            'nodes': sum(iteration['nodes'] for iteration in self.iterations),
+            'tt_probes': self.tt_probes,
+            'tt_hits': self.tt_hits,
+            'tt_hit_rate': self.tt_hits / self.tt_probes if self.tt_probes else None,
+            'tt_stores': self.tt_stores,
+            'cutoffs': self.cutoffs,
+            'first_move_cutoff_rate': self.first_move_cutoffs / self.cutoffs if self.cutoffs else None,
+            'branching_factors': self.branching_factors(),
+            'leaves': self.leaves,
+        }
+
+    def write_trace(self, path: str) -> None:
+        """Writes the trace events to a file that chrome://tracing, Perfetto or speedscope can open
+
+        Args:
+            path: where to write the trace"""
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, file)
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    """Gets the value a given fraction of the way through sorted values, or None if there are none"""
+    if not values: return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def latency(values: list[float]) -> dict:
+    """Summarizes how long something took over many runs
+
+    Args:
+        values: the seconds each run took
+
+    Returns:
+        The mean, median, 90th and 99th percentiles and the longest, all None if there are no values"""
+    values = sorted(values)
+    return {
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 0.5),
+        'p90': percentile(values, 0.9),
+        'p99': percentile(values, 0.99),
+        'max': values[-1] if values else None,
+    }
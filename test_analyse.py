@@ -0,0 +1,20 @@
+import io
+import pytest
+from main import BitboardConnect4
+from analyse import parse_position, read_positions
+
+def test_packed_boards_are_checked():
+    board = BitboardConnect4.from_moves('3324')
+    assert parse_position(str(board.encode()), 'key') == board
+    assert parse_position(board.encode(), 'binary') == board
+    # three pieces of player -1 in the first column, and none of player 1
+    with pytest.raises(ValueError):
+        parse_position('7', 'key')
+    with pytest.raises(ValueError):
+        parse_position(1 << 63, 'binary')
+
+def test_truncated_binary_input():
+    records = b''.join(BitboardConnect4.from_moves(moves).encode().to_bytes(8, 'little') for moves in ('', '3'))
+    assert len(list(read_positions(io.BytesIO(records), 'binary'))) == 2
+    with pytest.raises(ValueError):
+        list(read_positions(io.BytesIO(records + b'\0\0\0'), 'binary'))
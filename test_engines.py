@@ -0,0 +1,231 @@
+import random
+import pytest
+from main import Connect4, BitboardConnect4, SearchContext, WINS_NOW, LOSES_NEXT, UNCLEAR
+from solver import Solver, plies_to_end
+from tt import TranspositionTable
+
+INF = float('inf')
+# the board shapes the tactics and search are checked on: (width, height, connect)
+SHAPES = [(7, 6, 4), (5, 4, 3), (8, 7, 5), (6, 5, 4)]
+
+def random_boards(seed: int, count: int, shape: tuple = (7, 6, 4), min_moves: int = 0, max_moves: int | None = None):
+    """Plays random games on both engines at once
+
+    Yields:
+        A list and a bitboard Connect4 with the same random moves made, count times.
+        The games stop at a random number of moves from min_moves to max_moves, or
+        sooner if they end"""
+    rng = random.Random(seed)
+    width, height, _ = shape
+    for _ in range(count):
+        board, bitboard = Connect4(*shape), BitboardConnect4(*shape)
+        for _ in range(rng.randint(min_moves, width * height if max_moves is None else max_moves)):
+            if board.is_terminal(): break
+            move = rng.choice(board.valid_moves())
+            board.make_move(move)
+            bitboard.make_move(move)
+        yield board, bitboard
+
+def brute_tactics(board: Connect4) -> tuple[int, list[int] | None]:
+    """Connect4.tactics found by making every move, to check the shortcuts against"""
+    player = board.player
+    moves = [move for move in board.geometry.center_order if board.has_space(move)]
+
+    def wins(move: int) -> bool:
+        board.drop(move)
+        won = board.last_move_won(move)
+        board.undo(move)
+        return won
+
+    winning = [move for move in moves if wins(move)]
+    if winning: return WINS_NOW, winning
+    board.player = -player
+    threats = [move for move in moves if wins(move)]
+    board.player = player
+    if len(threats) > 1: return LOSES_NEXT, None
+    safe = []
+    for move in threats or moves:
+        board.drop(move)
+        # the opponent must not be able to win on top of the move
+        if not board.has_space(move) or not wins(move): safe.append(move)
+        board.undo(move)
+    if not safe: return LOSES_NEXT, None
+    return UNCLEAR, safe if len(safe) < len(moves) else None
+
+def reference_search(board: Connect4, depth: int, alpha: float, beta: float, start_player: int) -> int:
+    """A plain alpha-beta search with the same tactics and scores as Connect4.search,
+    but no table, move ordering or other pruning"""
+    if depth == 0: return board.temp_score(start_player)
+    outcome, moves = brute_tactics(board)
+    if outcome == WINS_NOW: return board.player * (100 + depth - 1)
+    if outcome == LOSES_NEXT: return -board.player * (100 + depth - 2)
+    if moves is None: moves = [move for move in range(board.geometry.width) if board.has_space(move)]
+    maximizing = board.player == 1
+    best = -INF if maximizing else INF
+    for move in moves:
+        board.drop(move)
+        if board.last_move_won(move): score = -board.player * (100 + depth - 1)
+        elif board.is_full(): score = -start_player * (depth - 1)
+        else: score = reference_search(board, depth - 1, alpha, beta, start_player)
+        board.undo(move)
+        if maximizing:
+            best = max(best, score)
+            alpha = max(alpha, best)
+        else:
+            best = min(best, score)
+            beta = min(beta, best)
+        if alpha >= beta: break
+    return best
+
+def reference_scores(board: Connect4, depth: int) -> list[int]:
+    """The exact score of each valid move, as Connect4.score_move gives them"""
+    scores = []
+    for move in board.valid_moves():
+        board.drop(move)
+        if board.last_move_won(move): score = -board.player * (100 + depth)
+        elif board.is_full(): score = board.player * depth
+        else: score = reference_search(board, depth, -INF, INF, -board.player)
+        board.undo(move)
+        scores.append(score)
+    return scores
+
+def exact_score(board: BitboardConnect4, memo: dict) -> int:
+    """Solves a board by trying every move, in the scores of Solver.solve"""
+    key = board.keys()
+    if key not in memo:
+        best = None
+        for move in board.valid_moves():
+            board.drop(move)
+            if board.last_move_won(move): score = (board.geometry.cells + 2 - board.moves) // 2
+            elif board.is_full(): score = 0
+            else: score = -exact_score(board, memo)
+            board.undo(move)
+            best = score if best is None else max(best, score)
+        memo[key] = best
+    return memo[key]
+
+def test_engines_agree():
+    for board, bitboard in random_boards(1, 150):
+        assert board.state == bitboard.state and board.player == bitboard.player
+        assert board.valid_moves() == bitboard.valid_moves()
+        for player in (1, -1):
+            for size in (1, 2, 3, 4):
+                assert board.count_groups(player, size) == bitboard.count_groups(player, size)
+        assert board.is_terminal() == bitboard.is_terminal()
+        assert board.score() == bitboard.score()
+        copy = BitboardConnect4()
+        copy.state, copy.player = board.state, board.player
+        assert copy == bitboard and copy.keys() == bitboard.keys()
+
+def test_state_round_trips():
+    for board, bitboard in random_boards(8, 60):
+        # each engine takes the other's state, and gives back the same board
+        copies = [type(board)(), type(bitboard)()]
+        copies[0].state, copies[1].state = bitboard.state, board.state
+        assert copies[0].state == board.state and copies[1] == bitboard
+        assert copies[0].keys() == board.keys() and copies[1].keys() == bitboard.keys()
+        assert copies[0].moves == copies[1].moves == board.moves
+        # writing into a bitboard's state changes nothing. assigning it does, on both engines
+        state = bitboard.state
+        free = [column for column in range(7) if state[column][0] == 0]
+        if not free: continue
+        state[free[0]][state[free[0]].count(0) - 1] = bitboard.player
+        assert bitboard.state != state
+        board.state = [column[:] for column in state]
+        bitboard.state = state
+        assert board.state == bitboard.state == state
+        assert board.moves == bitboard.moves
+
+def test_engines_score_alike():
+    for board, bitboard in random_boards(2, 40, max_moves=30):
+        if board.is_terminal(): continue
+        moves = board.valid_moves()
+        exact, bounded, best_moves = [], [], []
+        for engine in (board, bitboard):
+            context = SearchContext(TranspositionTable(), engine.player, geometry=engine.geometry)
+            exact.append([engine.score_move(move, 4, context, -INF, INF) for move in moves])
+            bounded.append(engine.score_moves(moves, 4, context))
+            # searching leaves the board as it was
+            assert engine.state == board.state
+            # ties between the best moves are broken at random
+            random.seed(board.moves)
+            best_moves.append(engine.best_move(4))
+        assert exact[0] == exact[1]
+        # score_moves only bounds the moves that can't beat the best one, and the
+        # bounds depend on the table, whose keys differ between the engines
+        best = (max if board.player == 1 else min)(exact[0])
+        for scores in bounded:
+            assert [move for move, score in zip(moves, scores) if score == best] == \
+                [move for move, score in zip(moves, exact[0]) if score == best]
+            assert all(score * board.player <= best * board.player for score in scores)
+        assert best_moves[0] == best_moves[1]
+
+@pytest.mark.parametrize('table_size', [1 << 20, 1 << 8])
+def test_table_keeps_scores_exact(table_size):
+    # a small table keeps replacing entries, which must never change a score
+    for board, bitboard in random_boards(3, 40, max_moves=30):
+        if board.is_terminal(): continue
+        depth = random.Random(board.moves).randint(1, 4)
+        expected = reference_scores(bitboard, depth)
+        table = TranspositionTable(table_size)
+        for engine in (board, bitboard):
+            context = SearchContext(table, engine.player, geometry=engine.geometry)
+            assert [engine.score_move(move, depth, context, -INF, INF) for move in engine.valid_moves()] == expected
+
+def test_terminal_scores_agree():
+    # a game that ends, by a win or a draw, scores the same from score_move as from score_state
+    rng, results = random.Random(7), set()
+    for shape in SHAPES:
+        for _ in range(30):
+            board = BitboardConnect4(*shape)
+            while True:
+                move = rng.choice(board.valid_moves())
+                after = board.clone()
+                after.make_move(move)
+                if after.is_terminal(): break
+                board = after
+            results.add(after.score())
+            for depth in range(4):
+                for start_player in (1, -1):
+                    context = SearchContext(TranspositionTable(1 << 8), start_player, geometry=board.geometry)
+                    assert board.score_move(move, depth, context, -INF, INF) == \
+                        after.score_state(depth, context.table, -INF, INF, start_player)
+    # draws as well as wins
+    assert 0 in results and len(results) > 1
+
+def test_tactics_match_brute_force():
+    for shape in SHAPES:
+        for board, bitboard in random_boards(4, 60, shape):
+            if board.is_terminal(): continue
+            expected = brute_tactics(board)
+            assert board.tactics() == expected
+            assert bitboard.tactics() == expected
+            move = board.forced_move()
+            if move is not None: assert board.best_move() == move == bitboard.best_move()
+
+def test_search_matches_reference():
+    for shape in SHAPES:
+        for board, bitboard in random_boards(5, 40, shape):
+            if board.is_terminal(): continue
+            depth = random.Random(board.moves).randint(1, 4)
+            expected = reference_scores(board, depth)
+            for engine in (board, bitboard):
+                context = SearchContext(TranspositionTable(1 << 10), engine.player, geometry=engine.geometry)
+                assert [engine.score_move(move, depth, context, -INF, INF) for move in engine.valid_moves()] == expected
+
+def test_solver_is_exact():
+    solver, memo, solved = Solver(1 << 16), {}, 0
+    for _, board in random_boards(6, 30, min_moves=30, max_moves=30):
+        if board.is_terminal() or board.moves < 30: continue
+        score = exact_score(board, memo)
+        assert solver.solve(board) == score
+        assert max(solver.score_moves(board, board.valid_moves())) == score
+        # playing the solver's moves ends the game when it says it will
+        start, expected = board.moves, plies_to_end(score, board.moves)
+        while not board.is_terminal():
+            moves = board.valid_moves()
+            scores = solver.score_moves(board, moves)
+            board.make_move(moves[scores.index(max(scores))])
+        assert board.moves - start == expected
+        solved += 1
+    assert solved
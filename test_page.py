@@ -0,0 +1,29 @@
+import pytest
+from main import BitboardConnect4
+from page import IncompleteBoardError, parse_board
+
+# the classes of the circles on the page (see page.parse_circle)
+CLASSES = {0: 'circle empty-slot', 1: 'circle circle-light', -1: 'circle circle-dark'}
+
+def page_cells(board: BitboardConnect4) -> list[str]:
+    """Draws a board as the page does: row by row from the top, left to right"""
+    # each column of state starts from the top too
+    state = board.state
+    return [CLASSES[state[column][row]] for row in range(board.geometry.height) for column in range(board.geometry.width)]
+
+def test_reads_the_board():
+    board = BitboardConnect4.from_moves('3324416')
+    assert parse_board(page_cells(board)) == board
+
+def test_empty_page():
+    # a game that was left goes back to the lobby, which has no board
+    with pytest.raises(IncompleteBoardError):
+        parse_board([])
+
+def test_partly_drawn_board():
+    cells = page_cells(BitboardConnect4())
+    with pytest.raises(IncompleteBoardError):
+        parse_board(cells[:-1])
+    # circles that aren't pieces or slots don't count towards the board
+    with pytest.raises(IncompleteBoardError):
+        parse_board(cells[:-1] + ['circle'])
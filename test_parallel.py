@@ -0,0 +1,34 @@
+import random
+from array import array
+from main import Connect4, BitboardConnect4, SearchContext
+from evaluation import NTupleEvaluation, LINES, PATTERNS
+from parallel import parallel_scores
+from tt import TranspositionTable
+
+INF = float('inf')
+
+class CenterBoard(BitboardConnect4):
+    """A board that scores leaves its own way, by the pieces in the center column"""
+    def temp_score(self, start_player: int) -> int:
+        column = self.geometry.columns[self.geometry.width // 2]
+        return (self.ones & column).bit_count() - ((self.mask ^ self.ones) & column).bit_count()
+
+def serial_scores(board: Connect4, moves: list[int], depth: int) -> list[int]:
+    """Scores each move with a full window in this process"""
+    context = SearchContext(TranspositionTable(), board.player, geometry=board.geometry)
+    return [board.score_move(move, depth, context, -INF, INF) for move in moves]
+
+def random_weights(seed: int) -> NTupleEvaluation:
+    rng = random.Random(seed)
+    return NTupleEvaluation(array('f', (rng.uniform(-1, 1) for _ in range(len(LINES) * PATTERNS))))
+
+def test_parallel_scores_keep_the_evaluation():
+    for moves, board in (('3324', BitboardConnect4.from_moves('3324')), ('332', Connect4.from_moves('332')),
+                         ('4435', CenterBoard.from_moves('4435'))):
+        if type(board) is not CenterBoard: board.set_evaluation(random_weights(len(moves)))
+        columns = board.valid_moves()
+        expected = serial_scores(board, columns, 3)
+        # the evaluation has to matter for the check to mean anything
+        assert expected != serial_scores(BitboardConnect4.from_moves(moves), columns, 3)
+        for workers in (2, 9):
+            assert parallel_scores(board, columns, 3, workers) == expected
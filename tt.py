@@ -0,0 +1,92 @@
+# bound types stored with each score
+EXACT = 0 # the score is the true minimax value
+LOWER = 1 # the search failed high, the true value is at least the score
+UPPER = 2 # the search failed low, the true value is at most the score
+
+# keys are folded with these so the same board is stored separately for each
+# player to move and each root player (scores are relative to the root player)
+PLAYER_KEY = 1 << 62
+START_KEY = 1 << 63
+
+class TranspositionTable:
+    """A fixed size hash table of searched positions
+
+    Entries live in two flat arrays of 64 bit integers laid over one buffer, so
+    the table never grows no matter how long the search runs. Each slot holds the
+    position key and the packed entry: score, searched depth, bound type, best
+    move and the search generation that wrote it.
+
+    The buffer can be shared memory that several processes search with at once.
+    Each slot stores the key xored with the entry, so a slot torn by two
+    processes writing at the same time fails the key check instead of handing
+    back another position's entry.
+
+    Attributes:
+        size: the number of slots in the table
+        generation: incremented by new_search so older entries get replaced first
+        buffer: the memory the table is stored in
+        keys: the key of the position stored in each slot, xored with the entry
+        data: the packed entry stored in each slot, 0 if the slot is empty
+    """
+    def __init__(self, size: int = 1 << 18, buffer=None) -> None:
+        """Initializes the instance
+
+        Args:
+            size: the number of slots. Each slot uses 16 bytes
+            buffer: a writable buffer of at least 16 * size zeroed bytes to store the
+                table in, such as shared memory. A new one is made if this is None"""
+        self.size = size
+        self.generation = 0
+        self.buffer = bytearray(16 * size) if buffer is None else buffer
+        view = memoryview(self.buffer)
+        self.keys = view[:8 * size].cast('Q')
+        self.data = view[8 * size:16 * size].cast('Q')
+
+    def clear(self) -> None:
+        """Removes every entry from the table"""
+        self.keys.cast('B')[:] = bytes(8 * self.size)
+        self.data.cast('B')[:] = bytes(8 * self.size)
+
+    def new_search(self) -> None:
+        """Marks the entries stored so far as old, so they are the first to be replaced"""
+        self.generation = (self.generation + 1) & 0xff
+
+    def probe(self, key: int) -> tuple[int, int, int, int] | None:
+        """Looks up a position
+
+        Args:
+            key: the key of the position
+
+        Returns:
+            A tuple of (score, depth, bound type, best move) or None if the position
+            is not in the table. The best move is -1 if there isn't one"""
+        index = key % self.size
+        data = self.data[index]
+        if data == 0 or self.keys[index] ^ data != key: return None
+        return unpack(data)
+
+    def store(self, key: int, score: int, depth: int, flag: int, move: int) -> None:
+        """Saves a searched position. A slot holding a different position is only
+        overwritten if it was written by an older search or searched less deeply
+
+        Args:
+            key: the key of the position
+            score: the score found by the search
+            depth: the depth the position was searched to
+            flag: EXACT, LOWER, or UPPER
+            move: the best move found, or -1 if there isn't one"""
+        index = key % self.size
+        old = self.data[index]
+        if old and self.keys[index] ^ old != key and old >> 56 == self.generation and (old >> 32) & 0xff > depth:
+            return
+        data = pack(score, depth, flag, move, self.generation)
+        self.keys[index] = key ^ data
+        self.data[index] = data
+
+def pack(score: int, depth: int, flag: int, move: int, generation: int) -> int:
+    """Packs an entry into a single 64 bit integer. The score offset keeps packed entries nonzero"""
+    return (score + (1 << 31)) | depth << 32 | flag << 40 | (move + 1) << 48 | generation << 56
+
+def unpack(data: int) -> tuple[int, int, int, int]:
+    """Unpacks an entry made by pack into (score, depth, bound type, best move)"""
+    return (data & 0xffffffff) - (1 << 31), (data >> 32) & 0xff, (data >> 40) & 0xff, ((data >> 48) & 0xff) - 1
@@ -7,44 +7,136 @@ from selenium.webdriver.remote.webelement import WebElement
 from selenium.common.exceptions import TimeoutException
 
 # other packages
+import argparse
+import json
+import os
 import random
-from main import Connect4
-from time import sleep
-from bs4 import BeautifulSoup
+from main import BitboardConnect4
+from metrics import BotMetrics
+from page import IncompleteBoardError, parse_circle, parse_board
+from replay import GameRecorder
+from book import OpeningBook
+from session import SearchSession
+from server import SearchCancelled
+from time import sleep, perf_counter, time
 
-def wait() -> None:
-    """Waits a random amount of time. Used to avoid bot detection"""
-    sleep(random.uniform(0, 3))
+BOOK_PATH = 'book.bin' # made with `python book.py book.bin`
+URL = 'https://papergames.io/en/connect4' # the lobby, which is also where we end up if a game is aborted
+
+WAIT_TIMEOUT = 10 # seconds to wait for the page to change before checking it anyway
+
+# everything we read from the page, gathered in the browser in one round trip
+READ_PAGE = """
+function readPage() {
+    const board = document.querySelector('#connect4');
+    return JSON.stringify({
+        cells: board ? Array.from(board.querySelectorAll('circle'), circle => circle.getAttribute('class') || '') : [],
+        names: Array.from(document.querySelectorAll('span.text-truncate.cursor-pointer'), span => span.textContent.trim()),
+        shapes: Array.from(document.querySelectorAll('circle.shape'), circle => circle.getAttribute('class') || ''),
+        turns: Array.from(document.querySelectorAll('app-user-avatar.ng-star-inserted'), avatar => avatar.querySelector('circle') !== null),
+        url: location.href,
+    });
+}
+"""
+SNAPSHOT_SCRIPT = READ_PAGE + "return readPage();"
+
+# waits in the browser until the page differs from the snapshot passed in, then
+# returns the new one and the time it was read. the board and the avatars are watched
+# for changes, and the url is checked in the browser too since leaving the game may not touch them
+WAIT_SCRIPT = READ_PAGE + """
+const [previous, timeout, done] = arguments;
+let finished = false;
+const observer = new MutationObserver(check);
+const urlTimer = setInterval(check, 250);
+const timeoutTimer = setTimeout(() => finish(readPage()), timeout);
+
+function check() {
+    const current = readPage();
+    if (current !== previous) finish(current);
+}
+
+function finish(current) {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    clearInterval(urlTimer);
+    clearTimeout(timeoutTimer);
+    // when the change was seen, so we can tell how long it took to reach us
+    done([current, Date.now()]);
+}
+
+const targets = [document.querySelector('#connect4'), ...document.querySelectorAll('app-user-avatar.ng-star-inserted')];
+for (const target of targets) {
+    if (target) observer.observe(target, {subtree: true, childList: true, attributes: true, characterData: true});
+}
+// the page may have changed between the snapshot and now
+check();
+"""
+
+def wait() -> float:
+    """Waits a random amount of time. Used to avoid bot detection
 
-def parse_circle(circle_classes: list[str]) -> int | None:
-    """Takes in the circle's classes and determines what player it belongs to
-    
-    Args:
-        circle_classes: a list of the classes of a circle
-    
     Returns:
-        an int representing the player that the piece belongs to, 0 if the peice is an empty slot
-        or None if none of the above"""
-    if 'circle-dark' in circle_classes: return -1
-    if 'circle-light' in circle_classes: return 1
-    if 'empty-slot' in circle_classes: return 0
-    return None
+        The number of seconds waited"""
+    seconds = random.uniform(0, 3)
+    sleep(seconds)
+    return seconds
 
 class TerminalGameException(Exception): pass # exception for when a game is in a terminal state
 class AbortedGameException(Exception): pass  # For when the game is quit prematurily
 
 class Bot():
-    def __init__(self) -> None:
+    def __init__(self, url: str = URL, headless: bool = False, profile: str | None = None,
+                 block_ads: bool = True, delays: bool = True, verbose: bool = True, new_session=None,
+                 recorder: GameRecorder | None = None, metrics: BotMetrics | None = None) -> None:
+        """Opens a browser on the lobby
+        
+        Args:
+            url: the lobby of the site to play on
+            headless: run the browser without a window
+            profile: a directory to keep the browser profile in between runs, or None for a fresh one
+            block_ads: load uBlock into the browser
+            delays: wait a random amount of time before acting, to avoid bot detection
+            verbose: print the board and every move
+            new_session: a function that makes the search session for each game, or None
+                for a SearchSession. Anything with best_move, ponder and stop_pondering will do
+            recorder: logs every turn so games can be replayed without a browser, or None
+            metrics: the metrics to time every turn and game in, which can be shared
+                between bots, or None for the bot's own"""
         # we are named Jimbo
         self.name = 'Jimbo'
+        self.url = url
+        self.delays = delays
+        self.verbose = verbose
+        self.new_session = new_session or (lambda: SearchSession(book=self.book))
+        self.recorder = recorder
+        self.metrics = metrics or BotMetrics()
+
+        # look up opening moves instead of searching them, if there is a book
+        self.book = OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
 
-        # load uBlock into the bot to prevent ad fraud
         self.options = webdriver.ChromeOptions()
-        self.options.add_extension('uBlock-Origin.crx')
+        # load uBlock into the bot to prevent ad fraud
+        if block_ads: self.options.add_extension('uBlock-Origin.crx')
+        if headless: self.options.add_argument('--headless=new')
+        if profile is not None: self.options.add_argument(f'--user-data-dir={os.path.abspath(profile)}')
 
         # create a selenium web driver to interact with the website
         self.driver = webdriver.Chrome(options=self.options)
-        self.driver.get("https://papergames.io/en/connect4")
+        self.driver.get(self.url)
+        # leave time for WAIT_SCRIPT to give up on its own first
+        self.driver.set_script_timeout(WAIT_TIMEOUT + 5)
+
+        # our side of the scoreboard and our color don't change during a game,
+        # so they are only read once (see play_round)
+        self.side = None
+        self.color = None
+
+        # how we've done since the browser was opened
+        self.games_played = 0
+        self.games_aborted = 0
+        self.move_times = [] # seconds from our turn starting to our move being clicked
+        self.read_seconds = None # how long the last page read took to reach us (see wait_for_turn)
 
     def get_element(self, selector: str) -> WebElement:
         """Retreive a given element using the webdriver
@@ -76,7 +168,7 @@ class Bot():
             delay: whether or not to add in a random delay (helps avoid bot detection)
         """
         button = self.get_element(selector)
-        if delay: wait()
+        if delay and self.delays: self.metrics.observe('delay', wait())
         button.click()
         return
     
@@ -86,114 +178,135 @@ class Bot():
         Args:
             selector: the css selector for the name feild
             delay: whether to add in random delay (helps avoid bot detection)"""
-        if self.driver.current_url != 'https://papergames.io/en/connect4': return
+        if self.driver.current_url != self.url: return
         feild = self.get_element(selector)
-        if delay: wait()
+        if delay and self.delays: self.metrics.observe('delay', wait())
         feild.send_keys(self.name)
         return
 
-    def get_game_state(self) -> Connect4:
-        """Gets the game's state from the website and parses it into a connect 4 board
+    def snapshot(self) -> dict:
+        """Reads everything we need from the page with a single script
         
         Returns:
-            The state of the board on the website"""
-        # click to prevent extranious floating pieces
-        body = self.get_element('body')
-        body.click()
-
-        # grab the board and extract the circles in it
-        element = self.get_element('#connect4')
-        html = element.get_attribute('innerHTML')
-        soup = BeautifulSoup(html, 'html.parser')
-        circles = soup.find_all('circle')
-
-        # determine which player occupies what square
-        circles = [e['class'] for e in circles]
-        circles = map(parse_circle, circles)
-        circles = [circle for circle in circles if circle is not None]
-
-        # convert the list of circles into a state that can be used
-        board = [[] for _ in range(7)]
-        for i, player in enumerate(circles):
-            board[i % 7].append(player)
+            The class of every circle in the board (cells), the names on the
+            scoreboard (names), the class of each player's piece (shapes), whether
+            each player's avatar has a turn ring (turns) and the page's url (url)"""
+        return json.loads(self.driver.execute_script(SNAPSHOT_SCRIPT))
+
+    def get_game_state(self, snapshot: dict | None = None) -> BitboardConnect4:
+        """Gets the game's state from the website and parses it into a connect 4 board
+        
+        Args:
+            snapshot: the page to read the board from, or None to read it now
         
-        # pack it up into a connect 4 board
-        c = Connect4()
-        c.state = board
-        return c
+        Returns:
+            The state of the board on the website
 
-    def determine_side(self) -> str:
+        Raises:
+            IncompleteBoardError: the page doesn't show a whole board"""
+        if snapshot is None:
+            # click to prevent extranious floating pieces
+            self.get_element('body').click()
+            snapshot = self.snapshot()
+        return parse_board(snapshot['cells'])
+
+    def determine_side(self, snapshot: dict | None = None) -> str:
         """Determines if our score is on the left or right side of the scoreboard
         
+        Args:
+            snapshot: the page to read the scoreboard from, or None to read it now.
+                Only read the first time in a game
+        
         Returns:
             'r' or 'l' if we're on the left or right respectivley
         """
-        # figure out if we're on the left or the right
-        
-        html = self.driver.page_source
-        soup = BeautifulSoup(html, 'html.parser')
-
-        # Find all spans with the player name
-        player_name_spans = soup.find_all('span', class_='text-truncate cursor-pointer')
-        
-        # Extract and print the text content (names)
-        left, right = [span.get_text(strip=True) for span in player_name_spans]
+        if self.side is not None: return self.side
+        if snapshot is None: snapshot = self.snapshot()
 
+        # figure out if we're on the left or the right
+        left, right = snapshot['names'][:2]
         if right == self.name:
-            return 'r'
+            self.side = 'r'
         elif left == self.name:
-            return 'l'
-        raise Exception('Could not find name')
+            self.side = 'l'
+        else:
+            raise Exception('Could not find name')
+        return self.side
         
-    def player(self) -> int:
+    def player(self, snapshot: dict | None = None) -> int:
         """Determines what color we're playing as
         
+        Args:
+            snapshot: the page to read our piece from, or None to read it now.
+                Only read the first time in a game
+        
         Returns:
             1 or -1 depending on the color"""
-        side = self.determine_side()
-
-        html = self.driver.page_source
-        soup = BeautifulSoup(html, 'html.parser')
-
-        # Find all spans with the player name
-        circles = soup.find_all('circle', class_='shape')
-        if side == 'l':
-            return parse_circle(circles[0]['class'])
-        if side == 'r':
-            return parse_circle(circles[1]['class'])
+        if self.color is not None: return self.color
+        if snapshot is None: snapshot = self.snapshot()
+        side = self.determine_side(snapshot)
+        self.color = parse_circle(snapshot['shapes'][0 if side == 'l' else 1].split())
+        return self.color
     
-    def is_turn(self) -> bool:
+    def is_turn(self, snapshot: dict | None = None) -> bool:
         """checks if it's our turn
         
+        Args:
+            snapshot: the page to check, or None to read it now
+        
         Returns:
             True if it's our turn, else False"""
-        side = self.determine_side()
-        if side == 'l':
-            index = 0
-        if side == 'r':
-            index = 1
-        
-        html = self.driver.page_source
-        soup = BeautifulSoup(html, 'html.parser')
-
-        # Find all avatars
-        avatars = soup.find_all('app-user-avatar', class_='ng-star-inserted')
-
-        # check for a loading ring
-        rings = [avatar.find('circle') is not None for avatar in avatars]
-        return rings[index]
+        if snapshot is None: snapshot = self.snapshot()
+        index = 0 if self.determine_side(snapshot) == 'l' else 1
+        # check for a loading ring. the avatars are gone if the game was left
+        turns = snapshot['turns']
+        return index < len(turns) and turns[index]
     
-    def wait_for_turn(self) -> None:
+    def wait_for_turn(self, pieces: int = -1) -> dict:
         """Waits for our turn by watching for a green circle around our name.
+        The browser tells us as soon as the board or the avatars change (see
+        WAIT_SCRIPT), so the page is only read again when something happened
+
+        Args:
+            pieces: the number of pieces on the board after our last move, or -1 before
+                our first. The ring can still be around our name for a moment after we
+                move, so it is only our turn once the board has more pieces than this
+
+        The time from the page changing in the browser to the snapshot reaching us
+        is kept in read_seconds
+
+        Returns:
+            The page as it was when our turn started (see snapshot)
         Throws:
             TerminalGameException: The other player has won, so we will not get a turn
             AbortedGameException: The other player has aborted the game"""
-        while not self.is_turn():
-            if self.get_game_state().is_terminal():
-                raise TerminalGameException()
-            if self.driver.current_url == 'https://papergames.io/en/connect4':
+        # click to prevent extranious floating pieces, once rather than on every check
+        self.get_element('body').click()
+        start = perf_counter()
+        page = self.driver.execute_script(SNAPSHOT_SCRIPT)
+        self.read_seconds = perf_counter() - start
+        while True:
+            snapshot = json.loads(page)
+            # a game that was left goes back to the lobby, which has no board to read
+            if snapshot['url'] == self.url:
                 raise AbortedGameException()
-            sleep(0.1)
+            try:
+                state = self.get_game_state(snapshot)
+            except IncompleteBoardError:
+                state = None # the board is still being drawn, so wait for it to change
+            if state is not None:
+                if self.is_turn(snapshot) and state.moves > pieces: return snapshot
+                if state.is_terminal():
+                    raise TerminalGameException()
+            # an unchanged page only means the opponent is still thinking, so it isn't
+            # counted. the browser not answering at all is
+            try:
+                page, seen = self.driver.execute_async_script(WAIT_SCRIPT, page, WAIT_TIMEOUT * 1000)
+            except TimeoutException:
+                self.metrics.timeout()
+                raise
+            # the browser runs on this machine, so its clock is ours
+            self.read_seconds = max(0.0, time() - seen / 1000)
 
     def find_game(self) -> None:
         """Gets us into an online game"""
@@ -207,7 +320,7 @@ class Bot():
         
         Returns:
             true if we have the first move, else false"""
-        empty_state = Connect4()
+        empty_state = BitboardConnect4()
         return self.get_game_state() == empty_state
     
     def get_board_moves(self) -> list[WebElement]:
@@ -223,58 +336,141 @@ class Bot():
     def play_round(self) -> None:
         """Plays a single game of connect 4 online"""
         # wait for the board to move in
+        start = perf_counter()
         try:
             move_buttons = self.get_board_moves()
         except TimeoutException:
-            if self.driver.current_url == 'https://papergames.io/en/connect4':
+            self.metrics.timeout()
+            if self.driver.current_url == self.url:
                 raise AbortedGameException()
+            raise
+        self.metrics.observe('lookup', perf_counter() - start)
 
-        # determine what player we are
+        # determine what player we are, reading the page again for a new game
+        self.side = None
+        self.color = None
         player = self.player()
+        # one search session for the whole game, so it can think on the opponent's time
+        session = self.new_session()
+        game = None if self.recorder is None else self.recorder.start_game(player, self.driver.current_url)
+        result = 'error'
+        try:
+            self.play_moves(move_buttons, player, session, game)
+            result = 'finished'
+        except AbortedGameException:
+            result = 'aborted'
+            raise
+        finally:
+            session.stop_pondering()
+            if game is not None: self.recorder.end_game(game, result)
 
+    def play_moves(self, move_buttons: list[WebElement], player: int, session: SearchSession, game: str | None = None) -> None:
+        """Plays moves until the game is over
+        
+        Args:
+            move_buttons: the elements we click to make moves
+            player: the player we are playing as
+            session: the search session for this game
+            game: the id the recorder logs this game's turns with, or None if it isn't recorded"""
+        pieces = -1
+        turn = 0
         while True:
             # wait for our turn
+            waiting = perf_counter()
             try:
-                self.wait_for_turn()
+                snapshot = self.wait_for_turn(pieces)
             except TerminalGameException:
                 break
+            start = perf_counter()
 
             # get the state of the board
-            state = self.get_game_state()
+            state = self.get_game_state(snapshot)
             state.player = player
-            # show the board for debugging purposes (it also looks cool)
-            state.show()
-            print(f"Player: {state.player_to_string(state.player)}")
+            parsed = perf_counter()
+            if self.verbose:
+                # show the board for debugging purposes (it also looks cool)
+                state.show()
+                print(f"Player: {state.player_to_string(state.player)}")
             # stop playing if the state is terminal
             if state.is_terminal(): break
             
-            if self.has_first_turn():
-                move = 3 # always play the middle on the first turn
-            else:
-                # calculate the best move
-                move = state.best_move()
+            # calculate the best move
+            searching = perf_counter()
+            try:
+                move = session.best_move(state)
+            except SearchCancelled:
+                # a remote session's searches are only cancelled once the game is over
+                break
+            searched = perf_counter()
             
-            print(f"Move: {move}")
+            if self.verbose: print(f"Move: {move}")
             # input the move into the website
             move_buttons[move].click()
+            clicked = perf_counter()
+            self.move_times.append(clicked - start)
+            seconds = {
+                'wait': start - waiting,
+                'read': self.read_seconds,
+                'parse': parsed - start,
+                'search': searched - searching,
+                'click': clicked - searched,
+                'total': clicked - start,
+            }
+            for phase, value in seconds.items(): self.metrics.observe(phase, value)
+            if game is not None: self.recorder.record_turn(game, turn, snapshot, state, move, seconds)
+            turn += 1
             # check if we've won
             state.make_move(move)
+            pieces = state.moves
             if state.is_terminal(): break
-            sleep(1)
-            wait()
+            # think about our next move while the opponent thinks about theirs
+            session.ponder(state)
+            if self.delays:
+                sleep(1)
+                self.metrics.observe('delay', 1 + wait())
 
-    def play(self) -> None:
-        """Plays a round online"""
-        # TODO: add in support for multiple consecutive games
-        self.find_game()
-    
-        print("Waiting for round...")
-        try:
-            self.play_round()
-        except AbortedGameException:
-            pass
-        print('Game Over')
+    def play(self, games: int = 1) -> None:
+        """Plays rounds online one after another, in the same browser
+        
+        Args:
+            games: the number of rounds to play"""
+        for game in range(games):
+            # back to the lobby for the next game
+            if game: self.driver.get(self.url)
+            self.find_game()
+        
+            if self.verbose: print("Waiting for round...")
+            start = perf_counter()
+            turns = len(self.move_times)
+            try:
+                self.play_round()
+                self.games_played += 1
+                self.metrics.end_game(perf_counter() - start, len(self.move_times) - turns)
+            except AbortedGameException:
+                self.games_aborted += 1
+                self.metrics.end_game(perf_counter() - start, len(self.move_times) - turns, aborted=True)
+            finally:
+                self.metrics.export()
+            if self.verbose: print('Game Over')
+
+    def quit(self) -> None:
+        """Closes the browser"""
+        self.driver.quit()
 
 if __name__ == '__main__':
-   b = Bot()
-   b.play()
+    parser = argparse.ArgumentParser(description='Play connect 4 online')
+    parser.add_argument('--games', type=int, default=1, help='the number of games to play')
+    parser.add_argument('--record', help='a log to append every turn to, for replay.py')
+    parser.add_argument('--metrics', help='a file to write Prometheus metrics to after every game')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics at /metrics on this local port')
+    args = parser.parse_args()
+
+    recorder = None if args.record is None else GameRecorder(args.record)
+    metrics = BotMetrics(args.metrics)
+    if args.metrics_port is not None: metrics.serve(args.metrics_port)
+    b = Bot(recorder=recorder, metrics=metrics)
+    try:
+        b.play(args.games)
+    finally:
+        if recorder is not None: recorder.close()
+        metrics.close()